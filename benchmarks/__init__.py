@@ -0,0 +1,27 @@
+"""
+Benchmarks for cacofonisk.
+
+Run them from the repository root, for example::
+
+    python -m benchmarks.bench_tracing
+"""
+import time
+
+
+def best_of(func, repeat=5):
+    """
+    Call func repeat times and return the fastest wall clock time.
+
+    Args:
+        func (callable): The function to time.
+        repeat (int): The number of runs.
+
+    Returns:
+        float: The fastest run in seconds.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
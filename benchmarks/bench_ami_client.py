@@ -0,0 +1,80 @@
+"""
+Measure reading events from AMI with panoramisk and with the AmiClient.
+
+A FakeAmiServer on localhost sends the events of generated calls (with
+the usual VarSet and Newexten noise) to a connected client, which has
+the ChannelManager's INTERESTING_EVENTS registered, like the AmiRunner
+does. The events are formatted up front and written at once, so the
+time is spent reading and parsing them. The clock stops when the client
+has seen every interesting event.
+"""
+import argparse
+import asyncio
+import time
+
+from panoramisk import Manager
+
+from cacofonisk import AmiClient
+from cacofonisk.channel import ChannelManager
+from cacofonisk.utils.fakeami import FakeAmiServer, format_message
+
+from .traffic import TrafficGenerator
+
+
+def measure(loop, server, client_class, payload, expected):
+    booted = asyncio.Future(loop=loop)
+    done = asyncio.Future(loop=loop)
+    count = [0]
+
+    def on_event(client, event):
+        count[0] += 1
+        if count[0] == expected and not done.done():
+            done.set_result(None)
+
+    client = client_class(loop=loop, host='127.0.0.1', port=server.port, username='bench', secret='bench',
+                          ssl=False, encoding='utf8')
+    client.register_event('FullyBooted', lambda client, event: booted.done() or booted.set_result(None))
+    for name in ChannelManager.INTERESTING_EVENTS:
+        if name != 'FullyBooted':
+            client.register_event(name, on_event)
+
+    asyncio.ensure_future(client.connect(), loop=loop)
+    loop.run_until_complete(asyncio.wait_for(booted, 10))
+
+    start = time.perf_counter()
+    for connection in server.clients:
+        connection.transport.write(payload)
+    loop.run_until_complete(asyncio.wait_for(done, 300))
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    loop.run_until_complete(asyncio.sleep(0.05))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    payload = b''.join(format_message(event) for event in events)
+    expected = sum(1 for event in events if event['Event'] in ChannelManager.INTERESTING_EVENTS)
+    print('{} events, {} interesting, {:.1f} MB'.format(len(events), expected, len(payload) / 1e6))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = FakeAmiServer(loop=loop)
+    server.start()
+    try:
+        for name, client_class in (('panoramisk', Manager), ('AmiClient', AmiClient)):
+            elapsed = min(measure(loop, server, client_class, payload, expected) for i in range(args.repeat))
+            print('  {:10s} {:8.1f} ms  {:8.0f} events/s'.format(name, elapsed * 1e3, len(events) / elapsed))
+    finally:
+        server.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
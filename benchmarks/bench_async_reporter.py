@@ -0,0 +1,79 @@
+"""
+Measure a reporter which waits on I/O, as a blocking reporter and as an
+AsyncBaseReporter whose hooks are run as tasks.
+
+The events of generated calls are passed to a ChannelManager. The
+blocking reporter sleeps on every call hook; the coroutine hooks of the
+async reporter wait as long with asyncio.sleep, like a webhook would.
+The time includes waiting for the tasks.
+"""
+import argparse
+import asyncio
+import time
+
+from cacofonisk import AsyncBaseReporter, BaseReporter
+from cacofonisk.channel import ChannelManager
+from cacofonisk.reporters.async_reporter import TaskReporter
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+class BlockingReporter(BaseReporter):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        time.sleep(self.delay)
+
+    def on_up(self, call_id, caller, to_number, callee):
+        time.sleep(self.delay)
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        time.sleep(self.delay)
+
+
+class WaitingReporter(AsyncBaseReporter):
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def on_b_dial(self, call_id, caller, to_number, targets):
+        await asyncio.sleep(self.delay)
+
+    async def on_up(self, call_id, caller, to_number, callee):
+        await asyncio.sleep(self.delay)
+
+    async def on_hangup(self, call_id, caller, to_number, reason):
+        await asyncio.sleep(self.delay)
+
+
+def replay_tasks(loop, events, delay, max_tasks):
+    reporter = TaskReporter(WaitingReporter(delay), loop, max_tasks)
+    ChannelManager(reporter).on_events(events)
+    loop.run_until_complete(reporter.drain())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--delay', type=float, default=0.001, help='seconds per hook')
+    parser.add_argument('--max-tasks', type=int, nargs='+', default=[1, 10, 100])
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    print('{} calls, {:.1f} ms per hook'.format(args.calls, args.delay * 1e3))
+
+    elapsed = best_of(lambda: ChannelManager(BlockingReporter(args.delay)).on_events(events), repeat=3)
+    print('  blocking         {:8.1f} ms'.format(elapsed * 1e3))
+
+    loop = asyncio.new_event_loop()
+    try:
+        for max_tasks in args.max_tasks:
+            elapsed = best_of(lambda: replay_tasks(loop, events, args.delay, max_tasks), repeat=3)
+            print('  {:3d} tasks at once {:8.1f} ms'.format(max_tasks, elapsed * 1e3))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Measure reading a capture from disk.
+
+A capture of generated calls is written as a JSON array and as
+line-delimited JSON. Each is read with json.load (what the FileRunner
+did before) and with the streaming reader. The report shows the time
+until the first event, the total time and the peak memory.
+
+With --codecs the events of the test fixtures are written with each
+compression instead, and the report shows the compression ratio and the
+throughput of writing and replaying (decompressing and parsing) them.
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from cacofonisk.runners.capture import create_capture, open_capture, read_events
+
+from .traffic import TrafficGenerator
+
+CHUNK = 64 * 1024
+
+
+def write_captures(directory, calls):
+    events = TrafficGenerator().calls(calls)
+
+    array_path = os.path.join(directory, 'capture.json')
+    with open(array_path, 'w') as f:
+        f.write('[')
+        f.write(','.join('\n  ' + json.dumps(event) for event in events))
+        f.write('\n]\n')
+
+    ndjson_path = os.path.join(directory, 'capture.ndjson')
+    with open(ndjson_path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+    return len(events), array_path, ndjson_path
+
+
+def load_whole(path):
+    with open(path) as f:
+        for event in json.load(f):
+            yield event
+
+
+def stream(path):
+    with open(path) as f:
+        for event in read_events(f):
+            yield event
+
+
+def measure(reader, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    count = 0
+    for event in reader(path):
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, first, total, peak
+
+
+def load_fixtures():
+    pattern = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', '*', '*.json')
+    events = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            events.extend(read_events(f))
+    return events
+
+
+def measure_codec(directory, events, compression, copies):
+    path = os.path.join(directory, 'capture.json')
+    start = time.perf_counter()
+    with create_capture(path, compression) as f:
+        f.write('[')
+        comma = ''
+        for i in range(copies):
+            for event in events:
+                f.write('{}\n  {}'.format(comma, json.dumps(event)))
+                comma = ','
+        f.write('\n]\n')
+    write = time.perf_counter() - start
+    size = os.path.getsize(path)
+
+    start = time.perf_counter()
+    with open_capture(path) as f:
+        count = sum(1 for event in read_events(f))
+    read = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open_capture(path) as f:
+        raw = sum(len(chunk) for chunk in iter(lambda: f.read(CHUNK), ''))
+    decompress = time.perf_counter() - start
+
+    os.remove(path)
+    return count, raw, size, write, read, decompress
+
+
+def report_codecs(copies):
+    events = load_fixtures()
+    with tempfile.TemporaryDirectory() as directory:
+        for compression in ('', 'gzip', 'bz2', 'xz'):
+            count, raw, size, write, read, decompress = measure_codec(directory, events, compression, copies)
+            print('{:5s} {:6.1f} MB -> {:6.1f} MB ({:4.1%}), write {:6.1f} MB/s, '
+                  'decompress {:6.1f} MB/s, replay {:6.1f} MB/s ({:.0f} events/s)'.format(
+                      compression or 'none', raw / 1e6, size / 1e6, size / raw, raw / write / 1e6,
+                      raw / decompress / 1e6, raw / read / 1e6, count / read))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, nargs='+', default=[1000, 4000])
+    parser.add_argument('--codecs', action='store_true', help='compare the compressions on the test fixtures')
+    parser.add_argument('--copies', type=int, default=1, help='times the fixtures are repeated for --codecs')
+    args = parser.parse_args()
+
+    if args.codecs:
+        report_codecs(args.copies)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        for calls in args.calls:
+            count, array_path, ndjson_path = write_captures(directory, calls)
+            print('{} calls, {} events, {:.1f} MB'.format(calls, count, os.path.getsize(array_path) / 1e6))
+
+            for name, reader, path in (
+                    ('json.load', load_whole, array_path),
+                    ('array', stream, array_path),
+                    ('ndjson', stream, ndjson_path)):
+                count, first, total, peak = measure(reader, path)
+                print('  {:10s} first event {:8.2f} ms, all {:6.2f} s, peak {:7.1f} MB'.format(
+                    name, first * 1e3, total, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
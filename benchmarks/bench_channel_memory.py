@@ -0,0 +1,58 @@
+"""
+Measure the memory and attribute access time of tracked channels.
+
+This creates a registry full of channels, the way a busy cluster has
+tens of thousands of channels open at once.
+"""
+import argparse
+import timeit
+import tracemalloc
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager
+
+from .traffic import TrafficGenerator
+
+
+def open_channels(count):
+    """
+    Feed the Newchannel events of count channels to a ChannelManager.
+
+    Returns:
+        ChannelManager: The manager holding the open channels.
+    """
+    traffic = TrafficGenerator(noise=False)
+    events = []
+    for i in range(count):
+        traffic._new_channel(events, 'SIP', '203', str(200 + i % 100))
+
+    manager = ChannelManager(reporter=BaseReporter())
+    for event in events:
+        manager.on_event(event)
+    return manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--channels', type=int, default=20000)
+    args = parser.parse_args()
+
+    # Build the events first so only the channels themselves are measured.
+    open_channels(1)
+    tracemalloc.start()
+    manager = open_channels(args.channels)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    channel = next(iter(manager._registry._channels_by_name.values()))
+    access = min(timeit.repeat(
+        lambda: (channel._state, channel._side, channel.back_dial, channel.uniqueid),
+        number=200000, repeat=5)) / 200000
+
+    print('{} channels: {:.0f} bytes/channel (incl. strings and registry)'.format(
+        args.channels, size / args.channels))
+    print('attribute access: {:.1f} ns per 4 attributes'.format(access * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure the cost of saving checkpoints during a replay.
+
+A capture of generated calls, written as line-delimited JSON, is
+replayed without checkpoints and with checkpoints every so many events.
+Every checkpoint serializes the open channels and replaces the
+checkpoint file (with an fsync), so short intervals cost more.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from cacofonisk import BaseReporter, FileRunner
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[100000, 10000, 1000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.ndjson')
+        checkpoint = os.path.join(directory, 'checkpoint')
+        events = TrafficGenerator().calls(args.calls)
+        with open(path, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        print('{} calls, {} events'.format(args.calls, len(events)))
+
+        elapsed = best_of(lambda: FileRunner(path, BaseReporter()).run(), repeat=3)
+        print('  no checkpoints        {:8.1f} ms'.format(elapsed * 1e3))
+
+        for interval in args.intervals:
+            elapsed = best_of(lambda: FileRunner(
+                path, BaseReporter(), checkpoint=checkpoint, checkpoint_interval=interval).run(), repeat=3)
+            print('  every {:6d} events  {:8.1f} ms'.format(interval, elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Measure what typed, slotted event records would save the handlers.
+
+Every handled event of a generated capture is read the way its handler
+reads it: the same fields, with ChannelState, AccountCode and Cause
+parsed to integers. This is done once straight from the event, as the
+handlers do now, and once through a normalization stage that first
+turns the event into a slotted record with the integers parsed up front
+(keeping the event for trace_ami and on_user_event), after which the
+handler reads the record.
+
+The records only pay off when building one costs less than the lookups
+and conversions it saves. A full replay of the same capture is timed
+too, to put the difference per event in proportion. The events are
+timed as dicts (JSON captures) and as panoramisk Messages (AmiRunner).
+"""
+import argparse
+
+from panoramisk.message import Message
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+class Record(object):
+    __slots__ = ('event',)
+
+    def __init__(self, event):
+        self.event = event
+
+
+class NewchannelRecord(Record):
+    __slots__ = ('channel', 'uniqueid', 'state', 'exten', 'account_code', 'caller_id_name', 'caller_id_num')
+
+    def __init__(self, event):
+        self.event = event
+        self.channel = event['Channel']
+        self.uniqueid = event['Uniqueid']
+        self.state = int(event['ChannelState'])
+        self.exten = event['Exten']
+        self.account_code = int(event['AccountCode'] or 0)
+        self.caller_id_name = event['CallerIDName']
+        self.caller_id_num = event['CallerIDNum']
+
+
+class NewstateRecord(Record):
+    __slots__ = ('channel', 'state')
+
+    def __init__(self, event):
+        self.event = event
+        self.channel = event['Channel']
+        self.state = int(event['ChannelState'])
+
+
+class HangupRecord(Record):
+    __slots__ = ('channel', 'cause')
+
+    def __init__(self, event):
+        self.event = event
+        self.channel = event['Channel']
+        self.cause = int(event['Cause'])
+
+
+class DialBeginRecord(Record):
+    __slots__ = ('uniqueid', 'dest_uniqueid')
+
+    def __init__(self, event):
+        self.event = event
+        self.uniqueid = event['UniqueID']
+        self.dest_uniqueid = event['DestUniqueID']
+
+
+class LocalBridgeRecord(Record):
+    __slots__ = ('local_one', 'local_two')
+
+    def __init__(self, event):
+        self.event = event
+        self.local_one = event['LocalOneChannel']
+        self.local_two = event['LocalTwoChannel']
+
+
+class BridgeRecord(LocalBridgeRecord):
+    __slots__ = ('state',)
+
+    def __init__(self, event):
+        super().__init__(event)
+        self.state = event['Bridgestate']
+
+
+# The fields each handler reads, straight from the event.
+READ_EVENT = {
+    'Newchannel': lambda e: (
+        e['Channel'], e['Uniqueid'], int(e['ChannelState']), e['Exten'], int(e['AccountCode'] or 0),
+        e['CallerIDName'], e['CallerIDNum']),
+    'Newstate': lambda e: (e['Channel'], int(e['ChannelState'])),
+    'Hangup': lambda e: (e['Channel'], int(e['Cause'])),
+    'DialBegin': lambda e: (e['UniqueID'], e['DestUniqueID']),
+    'LocalBridge': lambda e: (e['LocalOneChannel'], e['LocalTwoChannel']),
+    'Bridge': lambda e: (e['LocalOneChannel'], e['LocalTwoChannel'], e['Bridgestate']),
+}
+
+# The normalization stage, and the same fields read from its records.
+RECORDS = {
+    'Newchannel': (NewchannelRecord, lambda r: (
+        r.channel, r.uniqueid, r.state, r.exten, r.account_code, r.caller_id_name, r.caller_id_num)),
+    'Newstate': (NewstateRecord, lambda r: (r.channel, r.state)),
+    'Hangup': (HangupRecord, lambda r: (r.channel, r.cause)),
+    'DialBegin': (DialBeginRecord, lambda r: (r.uniqueid, r.dest_uniqueid)),
+    'LocalBridge': (LocalBridgeRecord, lambda r: (r.local_one, r.local_two)),
+    'Bridge': (BridgeRecord, lambda r: (r.local_one, r.local_two, r.state)),
+}
+
+
+def read_events(events):
+    for event in events:
+        READ_EVENT[event['Event']](event)
+
+
+def read_records(events):
+    for event in events:
+        record_class, read = RECORDS[event['Event']]
+        read(record_class(event))
+
+
+def replay(events):
+    ChannelManager(reporter=BaseReporter()).on_events(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    handled = [event for event in events if event['Event'] in READ_EVENT]
+    print('{} calls, {} events, {} handled'.format(args.calls, len(events), len(handled)))
+
+    for kind, make in (('dict', dict), ('Message', Message)):
+        capture = [make(event) for event in events]
+        handled = [event for event in capture if event['Event'] in READ_EVENT]
+
+        fields = best_of(lambda: read_events(handled)) / len(handled)
+        records = best_of(lambda: read_records(handled)) / len(handled)
+        total = best_of(lambda: replay(capture), repeat=3) / len(handled)
+        print('{:8s} fields {:5.2f} us, records {:5.2f} us, replay {:5.2f} us per handled event '
+              '({:+.1f}% of the replay with records)'.format(
+                  kind, fields * 1e6, records * 1e6, total * 1e6, (records - fields) / total * 100))
+
+
+if __name__ == '__main__':
+    main()
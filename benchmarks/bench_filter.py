@@ -0,0 +1,55 @@
+"""
+Measure what the AMI Filter of the AmiRunner saves the client.
+
+The events of generated calls (with the usual VarSet and Newexten noise)
+are written to panoramisk and to the AmiClient once as they are, and
+once as Asterisk sends them with the filter of the ChannelManager's
+INTERESTING_EVENTS. The time to match the filter is Asterisk's and not
+measured here.
+"""
+import argparse
+import asyncio
+
+from panoramisk import Manager
+
+from cacofonisk import AmiClient
+from cacofonisk.channel import ChannelManager
+from cacofonisk.runners.ami_runner import event_filter
+from cacofonisk.utils.fakeami import FakeAmiServer, compile_filter, format_message
+
+from .bench_ami_client import measure
+from .traffic import TrafficGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    messages = [format_message(event) for event in events]
+    regex, negate = compile_filter(event_filter(ChannelManager.INTERESTING_EVENTS))
+    payloads = (
+        ('unfiltered', b''.join(messages)),
+        ('filtered', b''.join(message for message in messages if regex.search(message.decode('utf8')))),
+    )
+    expected = sum(1 for event in events if event['Event'] in ChannelManager.INTERESTING_EVENTS)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = FakeAmiServer(loop=loop)
+    server.start()
+    try:
+        for name, payload in payloads:
+            print('{}: {:.1f} MB'.format(name, len(payload) / 1e6))
+            for client_name, client_class in (('panoramisk', Manager), ('AmiClient', AmiClient)):
+                elapsed = min(measure(loop, server, client_class, payload, expected) for i in range(args.repeat))
+                print('  {:10s} {:8.1f} ms'.format(client_name, elapsed * 1e3))
+    finally:
+        server.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
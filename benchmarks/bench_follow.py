@@ -0,0 +1,63 @@
+"""
+Measure the latency of following a capture which is being written.
+
+A writer thread appends events at a steady rate, with a pause in the
+middle during which the poll interval grows to its maximum. The delay
+between writing an event and reading it with follow_events is measured,
+for a few poll intervals. Latency right after the pause is bounded by
+max_poll_interval.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from cacofonisk.runners.capture import follow_events
+
+
+def write(path, events, rate, pause):
+    with open(path, 'a') as f:
+        for i in range(events):
+            if i == events // 2:
+                time.sleep(pause)
+            f.write(json.dumps({'Event': 'UserEvent', 'Index': i, 'Written': time.time()}) + '\n')
+            f.flush()
+            time.sleep(1 / rate)
+
+
+def measure(path, events, rate, pause, poll_interval, max_poll_interval):
+    stop = threading.Event()
+    writer = threading.Thread(target=write, args=(path, events, rate, pause))
+    writer.start()
+
+    delays = []
+    for event in follow_events(path, stop, poll_interval, max_poll_interval):
+        delays.append(time.time() - event['Written'])
+        if len(delays) == events:
+            break
+    writer.join()
+    os.remove(path)
+
+    delays.sort()
+    return delays[len(delays) // 2], delays[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=200, help='events per second')
+    parser.add_argument('--pause', type=float, default=3.0, help='seconds without events halfway')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.ndjson')
+        for poll_interval, max_poll_interval in ((0.01, 0.1), (0.05, 2.0), (0.2, 2.0)):
+            median, worst = measure(path, args.events, args.rate, args.pause, poll_interval, max_poll_interval)
+            print('poll {:5.2f}-{:4.1f} s: median {:6.1f} ms, max {:7.1f} ms'.format(
+                poll_interval, max_poll_interval, median * 1e3, worst * 1e3))
+
+
+if __name__ == '__main__':
+    main()
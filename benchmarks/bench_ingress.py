@@ -0,0 +1,117 @@
+"""
+Measure how long reading from AMI is held up by a slow reporter, with
+and without the ingress queue of the AmiRunner.
+
+A FakeAmiServer sends the events of generated calls (with the usual
+VarSet and Newexten noise) to an AmiRunner with a manager which listens
+to all events, and a reporter which sleeps a little on every hangup.
+The read time is when the runner has read the last event; the total time
+is when the last event was handled. The queue counters show how large
+the queue had to be.
+"""
+import argparse
+import asyncio
+import time
+
+from cacofonisk import AmiClient, AmiRunner, BaseReporter, ChannelManager
+from cacofonisk.utils.fakeami import FakeAmiServer, format_message
+
+from .traffic import TrafficGenerator
+
+
+class SlowReporter(BaseReporter):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        time.sleep(self.delay)
+
+
+class AllChannelManager(ChannelManager):
+    INTERESTING_EVENTS = ('*',)
+
+
+class TimingRunner(AmiRunner):
+    def __init__(self, *args, expected, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expected = expected
+        self.read = self.handled = 0
+        self.read_at = self.handled_at = None
+        self.done = asyncio.Future(loop=self.loop)
+
+    def on_event(self, amimanager, amievent):
+        if amievent['Event'] != 'FullyBooted':
+            self.read += 1
+            if self.read == self.expected:
+                self.read_at = time.perf_counter()
+        super().on_event(amimanager, amievent)
+
+    def handle_event(self, amimanager, amievent):
+        super().handle_event(amimanager, amievent)
+        if amievent['Event'] != 'FullyBooted':
+            self.handled += 1
+            if self.handled + self.queue_dropped() == self.expected and not self.done.done():
+                self.handled_at = time.perf_counter()
+                self.done.set_result(None)
+
+    def queue_dropped(self):
+        return self.queue.dropped if self.queue is not None else 0
+
+
+def measure(loop, server, payload, expected, delay, **kwargs):
+    runner = TimingRunner([{
+        'host': '127.0.0.1',
+        'port': server.port,
+        'username': 'bench',
+        'password': 'bench',
+    }], SlowReporter(delay), channel_manager=AllChannelManager, resync=False, manager_class=AmiClient,
+        expected=expected, **kwargs)
+    runner.attach_all()
+    amimgr = next(iter(runner.amimgrs))
+    while not amimgr.authenticated:
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+    start = time.perf_counter()
+    for connection in server.clients:
+        connection.transport.write(payload)
+    loop.run_until_complete(asyncio.wait_for(runner.done, 600))
+
+    amimgr.close()
+    if runner.queue is not None:
+        runner.queue.close()
+    loop.run_until_complete(asyncio.sleep(0.05))
+    return runner.read_at - start, runner.handled_at - start, runner.queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--delay', type=float, default=0.0005, help='seconds per hangup')
+    parser.add_argument('--queue-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    payload = b''.join(format_message(event) for event in events)
+    print('{} events, {:.1f} MB, {:.1f} ms per hangup'.format(len(events), len(payload) / 1e6, args.delay * 1e3))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = FakeAmiServer(login_events=(), loop=loop)
+    server.start()
+    try:
+        for overflow in (None, 'block', 'drop', 'spill'):
+            kwargs = {} if overflow is None else {'queue_size': args.queue_size, 'overflow': overflow}
+            read, total, queue = measure(loop, server, payload, len(events), args.delay, **kwargs)
+            stats = ''
+            if queue is not None:
+                stats = 'high water {high_water:6d}  dropped {dropped:6d}  spilled {spilled:6d}'.format(
+                    **queue.stats())
+            print('  {:8s} read {:8.1f} ms  total {:8.1f} ms  {}'.format(
+                overflow or 'no queue', read * 1e3, total * 1e3, stats))
+    finally:
+        server.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure what interning channel names and uniqueids gains.
+
+A generated capture is loaded whole and replayed by a ChannelManager
+with and without INTERN_STRINGS. The memory is what the capture holds
+after the replay (the interning manager deduplicates its events in
+place), the replay time includes the interning, and the table size is
+what is left in the InternTable after every channel hung up.
+
+Then the registry lookups of all channels of the capture are timed,
+once with fresh (equal) strings and once with the interned ones.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager, ChannelRegistry, InternTable
+
+from .traffic import TrafficGenerator
+
+
+class InterningChannelManager(ChannelManager):
+    INTERN_STRINGS = True
+
+
+class FakeChannel(object):
+    def __init__(self, name, uniqueid):
+        self.name = name
+        self.uniqueid = uniqueid
+
+
+def replay(data, manager_class):
+    events = json.loads(data)
+    manager = manager_class(reporter=BaseReporter())
+    start = time.perf_counter()
+    manager.on_events(events)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    events = json.loads(data)
+    manager = manager_class(reporter=BaseReporter())
+    manager.on_events(events)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    table = len(manager._interned) if manager._interned is not None else 0
+    return len(events), size, elapsed, table
+
+
+def lookups(data, rounds):
+    channels = [FakeChannel(event['Channel'], event['Uniqueid'])
+                for event in json.loads(data) if event['Event'] == 'Newchannel']
+    interned = InternTable(max_size=2 * len(channels))
+    registry = ChannelRegistry(interned=interned)
+    for channel in channels:
+        registry.add(channel)
+
+    def timed(make_keys):
+        best = None
+        for i in range(rounds):
+            keys = make_keys()
+            get = registry.get_by_name
+            start = time.perf_counter()
+            for key in keys:
+                get(key)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best / len(channels)
+
+    # Equal strings as a new event brings them, whose hash isn't known
+    # yet, and the interned ones.
+    fresh = timed(lambda: [channel.name.encode().decode() for channel in channels])
+    same = timed(lambda: [interned.intern(channel.name) for channel in channels])
+    return len(channels), fresh, same
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=14000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    data = json.dumps(TrafficGenerator().calls(args.calls))
+
+    for name, manager_class in (('plain', ChannelManager), ('interned', InterningChannelManager)):
+        count, size, elapsed, table = replay(data, manager_class)
+        print('{:8s} {} events: capture {:6.1f} MB, replay {:5.2f} us/event, {} strings left'.format(
+            name, count, size / 1e6, elapsed / count * 1e6, table))
+
+    channels, fresh, same = lookups(data, args.rounds)
+    print('get_by_name of {} channels: {:5.1f} ns fresh, {:5.1f} ns interned'.format(
+        channels, fresh * 1e9, same * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Measure reading line-delimited captures through a memory map.
+
+The streaming reader decodes every event. map_events skips the events
+which the ChannelManager doesn't handle (mostly VarSet and Newexten)
+before decoding them. Both are timed on their own, on generated calls
+and on the test fixtures, and as part of a FileRunner replay of the
+generated calls.
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+
+from cacofonisk import BaseReporter, FileRunner
+from cacofonisk.channel import ChannelManager
+from cacofonisk.runners.capture import map_events, read_events
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+def write_ndjson(path, events, copies=1):
+    with open(path, 'w') as f:
+        for i in range(copies):
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+
+
+def load_fixtures():
+    pattern = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', '*', '*.json')
+    events = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            events.extend(read_events(f))
+    return events
+
+
+def read_streaming(path):
+    with open(path) as f:
+        for event in read_events(f):
+            pass
+
+
+def read_mapped(path):
+    for event in map_events(path, ChannelManager.INTERESTING_EVENTS):
+        pass
+
+
+def report(name, path, events, replay):
+    wanted = sum(1 for event in events if event['Event'] in ChannelManager.INTERESTING_EVENTS)
+    print('{}: {} events, {:.0%} handled, {:.1f} MB'.format(
+        name, len(events), wanted / len(events), os.path.getsize(path) / 1e6))
+
+    timings = [('read', 'stream', read_streaming), ('read', 'mmap', read_mapped)]
+    if replay:
+        timings += [
+            ('replay', 'stream', lambda path: FileRunner(path, BaseReporter()).run()),
+            ('replay', 'mmap', lambda path: FileRunner(path, BaseReporter(), use_mmap=True).run()),
+        ]
+
+    for what, how, func in timings:
+        elapsed = best_of(lambda: func(path), repeat=3)
+        print('  {:6s} {:6s} {:8.1f} ms'.format(what, how, elapsed * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--copies', type=int, default=10, help='times the fixtures are repeated')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.ndjson')
+
+        events = TrafficGenerator().calls(args.calls)
+        write_ndjson(path, events)
+        report('{} generated calls'.format(args.calls), path, events, replay=True)
+
+        # The fixtures are in an older event format, so they are only read.
+        events = load_fixtures()
+        write_ndjson(path, events, args.copies)
+        report('test fixtures x{}'.format(args.copies), path, events * args.copies, replay=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Measure how closely a paced replay follows the pace of a capture.
+
+Generated calls get arrival times in bursts: a few calls start at once,
+then it is quiet for a while. The capture is replayed by a FileRunner
+at several speeds, and the replay time is compared to the time the
+capture spans divided by the speed. max_lag is the most an event was
+late, because the events before it took longer to handle than the gap.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from cacofonisk import BaseReporter, FileRunner
+from cacofonisk.runners.capture import ARRIVAL_KEY
+
+from .traffic import TrafficGenerator
+
+
+def write_capture(path, calls, burst, gap):
+    """
+    Write calls in bursts of up to burst calls, gap seconds apart on
+    average, with the events of a burst 1 ms apart.
+
+    Returns:
+        float: The seconds between the first and the last event.
+    """
+    rng = random.Random(1)
+    traffic = TrafficGenerator()
+    now = 0.0
+
+    with open(path, 'w') as f:
+        written = 0
+        while written < calls:
+            size = min(rng.randint(1, burst), calls - written)
+            for i in range(size):
+                for event in traffic.simple_call():
+                    event[ARRIVAL_KEY] = last = now
+                    now += 0.001
+                    f.write(json.dumps(event) + '\n')
+            written += size
+            now += rng.expovariate(1 / gap)
+
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--burst', type=int, default=20, help='most calls in a burst')
+    parser.add_argument('--gap', type=float, default=5.0, help='mean seconds between bursts')
+    parser.add_argument('--speeds', type=float, nargs='+', default=[1000, 100, 30])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.ndjson')
+        span = write_capture(path, args.calls, args.burst, args.gap)
+        print('{} calls over {:.0f} s'.format(args.calls, span))
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.perf_counter()
+            FileRunner(path, BaseReporter()).run()
+            print('  max speed      {:8.1f} ms'.format((time.perf_counter() - start) * 1e3))
+
+            for speed in args.speeds:
+                runner = FileRunner(path, BaseReporter(), speed=speed, loop=loop)
+                start = time.perf_counter()
+                runner.run()
+                elapsed = time.perf_counter() - start
+                print('  {:6.0f}x  {:8.1f} ms (expected {:8.1f} ms), max lag {:6.1f} ms'.format(
+                    speed, elapsed * 1e3, span / speed * 1e3, runner.max_lag * 1e3))
+        finally:
+            loop.close()
+
+
+if __name__ == '__main__':
+    main()
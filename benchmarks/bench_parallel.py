@@ -0,0 +1,65 @@
+"""
+Measure replaying many captures in a process pool.
+
+Captures of generated calls are written as line-delimited JSON and
+replayed by a FileRunner with 1 (in process) and more processes. The
+reporter counts the hooks, so the recording and replaying of the hook
+calls is part of the measurement.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from cacofonisk import BaseReporter, FileRunner
+
+from .traffic import TrafficGenerator
+
+
+class CountingReporter(BaseReporter):
+    def __init__(self):
+        self.count = 0
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        self.count += 1
+
+    def on_up(self, call_id, caller, to_number, callee):
+        self.count += 1
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        self.count += 1
+
+
+def write_captures(directory, files, calls):
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, 'capture{}.ndjson'.format(i))
+        with open(path, 'w') as f:
+            for event in TrafficGenerator(prefix='bench{}'.format(i)).calls(calls):
+                f.write(json.dumps(event) + '\n')
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=1000, help='calls per file')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, os.cpu_count()])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_captures(directory, args.files, args.calls)
+        print('{} files of {} calls, {} CPUs'.format(args.files, args.calls, os.cpu_count()))
+
+        for processes in args.processes:
+            reporter = CountingReporter()
+            start = time.perf_counter()
+            FileRunner(paths, reporter, processes=processes).run()
+            elapsed = time.perf_counter() - start
+            print('  {:2d} processes {:8.1f} ms, {} hooks'.format(processes, elapsed * 1e3, reporter.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure replaying one capture in parallel partitions.
+
+A capture of generated calls is written as line-delimited JSON and
+replayed by a FileRunner and by a PartitionedFileRunner with 1 and more
+partitions, with and without use_mmap. The time to partition the
+capture is measured on its own, since it is not done in parallel.
+"""
+import argparse
+import json
+import mmap
+import os
+import tempfile
+
+from cacofonisk import FileRunner, PartitionedFileRunner
+from cacofonisk.channel import ChannelManager
+from cacofonisk.runners.partition import partition_mapped
+
+from . import best_of
+from .bench_parallel import CountingReporter
+from .traffic import TrafficGenerator
+
+
+def partition_only(path, partitions):
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            partition_mapped(mapped, partitions, ChannelManager.INTERESTING_EVENTS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, os.cpu_count()])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.ndjson')
+        with open(path, 'w') as f:
+            for event in TrafficGenerator().calls(args.calls):
+                f.write(json.dumps(event) + '\n')
+        print('{} calls, {:.1f} MB, {} CPUs'.format(args.calls, os.path.getsize(path) / 1e6, os.cpu_count()))
+
+        for use_mmap in (False, True):
+            elapsed = best_of(lambda: FileRunner(path, CountingReporter(), use_mmap=use_mmap).run(), repeat=3)
+            print('  sequential      mmap={!s:5} {:8.1f} ms'.format(use_mmap, elapsed * 1e3))
+
+        elapsed = best_of(lambda: partition_only(path, os.cpu_count()), repeat=3)
+        print('  partition only  mmap=True  {:8.1f} ms'.format(elapsed * 1e3))
+
+        for processes in args.processes:
+            for use_mmap in (False, True):
+                elapsed = best_of(lambda: PartitionedFileRunner(
+                    path, CountingReporter(), use_mmap=use_mmap, processes=processes).run(), repeat=3)
+                print('  {:2d} partitions   mmap={!s:5} {:8.1f} ms'.format(processes, use_mmap, elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main()
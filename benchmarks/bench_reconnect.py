@@ -0,0 +1,151 @@
+"""
+Measure how the AmiRunner reconnects through an Asterisk restart.
+
+An AmiRunner with many connections to a FakeAmiServer loses them all
+when the server goes down, tries to reconnect while it is down, and
+logs in again when it is back. This is done with a fixed delay without
+jitter (like panoramisk's reconnect_timeout) and with the jittered
+exponential backoff of the runner, with an AmiClient and with
+panoramisk's Manager. The attempts count the connections
+tried while the server was down; the burst is the most logins in any
+100 ms after the restart.
+
+Then the time to invalidate the channels of calls in progress, with
+their lost hangups reported, is measured.
+"""
+import argparse
+import asyncio
+import bisect
+import logging
+import time
+
+from panoramisk import Manager
+
+from cacofonisk import AmiClient, AmiRunner, BaseReporter, ChannelManager
+from cacofonisk.utils.fakeami import FakeAmiServer
+
+from .traffic import TrafficGenerator
+
+CORE_SHOW_CHANNELS = [
+    {'Response': 'Success', 'EventList': 'start', 'Message': 'Channels will follow'},
+    {'Event': 'CoreShowChannelsComplete', 'EventList': 'Complete', 'ListItems': '0'},
+]
+
+
+class CountingRunner(AmiRunner):
+    RECONNECT_DELAY = 0.1
+    MAX_RECONNECT_DELAY = 3.2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attempts = 0
+        self.booted = []
+
+    def connect(self, amimanager):
+        self.attempts += 1
+        super().connect(amimanager)
+
+    def on_event(self, amimanager, amievent):
+        if amievent['Event'] == 'FullyBooted':
+            self.booted.append(time.perf_counter())
+        super().on_event(amimanager, amievent)
+
+
+class FixedDelayRunner(CountingRunner):
+    def reconnect_delay(self, attempts):
+        return self.RECONNECT_DELAY
+
+
+class HangupCounter(BaseReporter):
+    def __init__(self):
+        self.hangups = 0
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        self.hangups += 1
+
+
+def wait_for(loop, condition, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError('Timed out')
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+
+def storm(loop, runner_class, manager_class, hosts, down):
+    # Every connection logs every failed attempt.
+    logger = logging.getLogger('bench_reconnect')
+    logger.setLevel(logging.CRITICAL)
+
+    server = FakeAmiServer(responses={'CoreShowChannels': CORE_SHOW_CHANNELS}, loop=loop)
+    server.start()
+    port = server.port
+    runner = runner_class([{
+        'host': '127.0.0.1',
+        'port': port,
+        'username': 'bench',
+        'password': 'bench',
+    }] * hosts, BaseReporter(), manager_class=manager_class, filter_events=False, logger=logger)
+    runner.attach_all()
+    wait_for(loop, lambda: len(runner.booted) == hosts)
+
+    server.close()
+    attempts = runner.attempts
+    loop.run_until_complete(asyncio.sleep(down))
+    attempts = runner.attempts - attempts
+
+    server = FakeAmiServer(responses={'CoreShowChannels': CORE_SHOW_CHANNELS}, loop=loop, port=port)
+    server.start()
+    restarted = time.perf_counter()
+    wait_for(loop, lambda: len(runner.booted) == 2 * hosts)
+
+    logins = runner.booted[hosts:]
+    burst = max(bisect.bisect_right(logins, login + 0.1) - index for index, login in enumerate(logins))
+    back = logins[-1] - restarted
+
+    runner._closing = True
+    for handle in runner._reconnects.values():
+        handle.cancel()
+    for amimgr in runner.amimgrs:
+        amimgr.close()
+    server.close()
+    loop.run_until_complete(asyncio.sleep(0.05))
+    return attempts, burst, back
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hosts', type=int, default=100, help='connections')
+    parser.add_argument('--down', type=float, default=5.0, help='seconds the server is down')
+    parser.add_argument('--calls', type=int, default=5000)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        print('{} connections, down for {:.1f} s'.format(args.hosts, args.down))
+        for name, runner_class, manager_class in (
+                ('fixed', FixedDelayRunner, AmiClient),
+                ('backoff', CountingRunner, AmiClient),
+                ('backoff', CountingRunner, Manager)):
+            attempts, burst, back = storm(loop, runner_class, manager_class, args.hosts, args.down)
+            print('  {:8s} {:9s} attempts {:6d}  burst {:4d} logins/100 ms  all back in {:6.1f} ms'.format(
+                name, manager_class.__name__, attempts, burst, back * 1e3))
+    finally:
+        loop.close()
+
+    # The calls in progress: all events but the hangups.
+    events = [event for event in TrafficGenerator().calls(args.calls) if event['Event'] != 'Hangup']
+    reporter = HangupCounter()
+    manager = ChannelManager(reporter)
+    for event in events:
+        manager.on_event(event)
+
+    start = time.perf_counter()
+    channels = manager.invalidate(report_hangups=True)
+    elapsed = time.perf_counter() - start
+    print('invalidate {} channels: {:.1f} ms, {} lost calls'.format(channels, elapsed * 1e3, reporter.hangups))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Measure bulk replay through ChannelManager.on_events.
+
+This compares on_events with the loop the runners used before: check
+INTERESTING_EVENTS for every event and call on_event for the
+interesting ones.
+"""
+import argparse
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+def replay_per_event(events):
+    manager = ChannelManager(reporter=BaseReporter())
+    for event in events:
+        if '*' in manager.INTERESTING_EVENTS or event['Event'] in manager.INTERESTING_EVENTS:
+            manager.on_event(event)
+
+
+def replay_bulk(events):
+    manager = ChannelManager(reporter=BaseReporter())
+    manager.on_events(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    print('{} calls, {} events'.format(args.calls, len(events)))
+
+    for name, replay in (('on_event', replay_per_event), ('on_events', replay_bulk)):
+        elapsed = best_of(lambda: replay(events))
+        print('{:10s} {:8.2f} ms, {:6.2f} us/event'.format(name, elapsed * 1e3, elapsed / len(events) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Measure how a ring-all call scales with the size of the ring group.
+
+Every target of the group is dialed through a pair of Local channels,
+starts ringing, and all but one hang up with answered-elsewhere. If the
+work per target is constant, the time per target stays flat as the
+group grows.
+"""
+import argparse
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+class DialCounter(BaseReporter):
+    def __init__(self):
+        self.b_dials = 0
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        self.b_dials += 1
+
+
+def replay(events):
+    reporter = DialCounter()
+    manager = ChannelManager(reporter=reporter)
+    for event in events:
+        if event['Event'] in manager.INTERESTING_EVENTS:
+            manager.on_event(event)
+    assert reporter.b_dials == 1, reporter.b_dials
+    assert not len(manager._registry)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--targets', type=int, nargs='+', default=[50, 100, 250, 500, 1000])
+    args = parser.parse_args()
+
+    for targets in args.targets:
+        events = TrafficGenerator(noise=False).ring_group_call(targets)
+        elapsed = best_of(lambda: replay(events), repeat=3)
+        print('{:5d} targets: {:8.2f} ms, {:6.2f} us/target'.format(
+            targets, elapsed * 1e3, elapsed / targets * 1e6))
+
+
+if __name__ == '__main__':
+    main()
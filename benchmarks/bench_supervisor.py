@@ -0,0 +1,102 @@
+"""
+Measure an AmiRunner with all hosts in one process against one with a
+worker process per host.
+
+Every host is a FakeAmiServer, which sends the events of generated
+calls (with the usual VarSet and Newexten noise) at once. The clock
+stops when the reporter in the parent has seen every hangup, so with
+workers the time includes sending the hook calls to the parent.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from cacofonisk import AmiClient, AmiRunner, BaseReporter, ChannelManager
+from cacofonisk.runners.supervisor import Supervisor
+from cacofonisk.utils.fakeami import FakeAmiServer, format_message
+
+from .traffic import TrafficGenerator
+
+
+class HangupReporter(BaseReporter):
+    def __init__(self, expected, done):
+        self.expected = expected
+        self.done = done
+        self.hangups = 0
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        self.hangups += 1
+        if self.hangups == self.expected and not self.done.done():
+            self.done.set_result(None)
+
+
+def measure(loop, servers, payload, hangups, processes):
+    done = asyncio.Future(loop=loop)
+    runner = AmiRunner([{
+        'host': '127.0.0.1',
+        'port': server.port,
+        'username': 'bench',
+        'password': 'bench',
+    } for server in servers], HangupReporter(hangups * len(servers), done), resync=False,
+        manager_class=AmiClient, processes=processes)
+
+    if processes == 1:
+        runner.attach_all()
+    else:
+        runner.supervisor = Supervisor(runner, processes)
+        runner.supervisor.start()
+
+    while not all(server.clients and server.actions for server in servers):
+        loop.run_until_complete(asyncio.sleep(0.01))
+    loop.run_until_complete(asyncio.sleep(0.1))
+
+    start = time.perf_counter()
+    for server in servers:
+        for connection in server.clients:
+            connection.transport.write(payload)
+    loop.run_until_complete(asyncio.wait_for(done, 600))
+    elapsed = time.perf_counter() - start
+
+    if runner.supervisor is not None:
+        runner.supervisor.stop()
+    for amimgr in getattr(runner, 'amimgrs', ()):
+        amimgr.close()
+    for server in servers:
+        server.actions.clear()
+    loop.run_until_complete(asyncio.sleep(0.1))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hosts', type=int, default=4)
+    parser.add_argument('--calls', type=int, default=1000)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    payload = b''.join(format_message(event) for event in events)
+    counter = HangupReporter(None, None)
+    ChannelManager(counter).on_events(events)
+    hangups = counter.hangups
+    print('{} hosts, {} events each, {} CPUs'.format(args.hosts, len(events), os.cpu_count()))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    servers = [FakeAmiServer(loop=loop) for _ in range(args.hosts)]
+    for server in servers:
+        server.start()
+    try:
+        for processes in (1, None):
+            elapsed = measure(loop, servers, payload, hangups, processes)
+            name = 'one process' if processes == 1 else 'per host'
+            print('  {:12s} {:8.1f} ms  {:8.0f} events/s'.format(
+                name, elapsed * 1e3, len(events) * args.hosts / elapsed))
+    finally:
+        for server in servers:
+            server.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
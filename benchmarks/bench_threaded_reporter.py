@@ -0,0 +1,61 @@
+"""
+Measure a reporter which blocks, called inline and through a
+ThreadedReporter.
+
+The events of generated calls are passed to a ChannelManager whose
+reporter sleeps on every call hook, like a reporter which posts to an
+HTTP service would wait. The time includes closing the reporter, so the
+ThreadedReporter has made all calls.
+"""
+import argparse
+import time
+
+from cacofonisk import BaseReporter, ThreadedReporter
+from cacofonisk.channel import ChannelManager
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+class BlockingReporter(BaseReporter):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        time.sleep(self.delay)
+
+    def on_up(self, call_id, caller, to_number, callee):
+        time.sleep(self.delay)
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        time.sleep(self.delay)
+
+
+def replay(events, reporter):
+    ChannelManager(reporter).on_events(events)
+    reporter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--delay', type=float, default=0.001, help='seconds per hook')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    print('{} calls, {:.1f} ms per hook'.format(args.calls, args.delay * 1e3))
+
+    elapsed = best_of(lambda: replay(events, BlockingReporter(args.delay)), repeat=3)
+    print('  inline      {:8.1f} ms'.format(elapsed * 1e3))
+    for threads in args.threads:
+        def threaded():
+            # A replay may wait for the threads instead of dropping calls.
+            return ThreadedReporter(BlockingReporter(args.delay), threads, overflow='block')
+
+        elapsed = best_of(lambda: replay(events, threaded()), repeat=3)
+        print('  {:2d} threads  {:8.1f} ms'.format(threads, elapsed * 1e3))
+
+
+if __name__ == '__main__':
+    main()
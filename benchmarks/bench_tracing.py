@@ -0,0 +1,53 @@
+"""
+Measure what tracing costs per AMI event.
+
+A reporter which doesn't override trace_msg gets no trace messages, so
+no trace message is formatted at all. This compares it with a reporter
+which does override trace_msg (and throws the messages away), which is
+what every run paid before tracing was gated.
+"""
+import argparse
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager
+
+from . import best_of
+from .traffic import TrafficGenerator
+
+
+class SilentReporter(BaseReporter):
+    pass
+
+
+class TracingReporter(BaseReporter):
+    def trace_msg(self, msg):
+        pass
+
+
+def replay(events, reporter):
+    manager = ChannelManager(reporter=reporter)
+    for event in events:
+        if event['Event'] in manager.INTERESTING_EVENTS:
+            manager.on_event(event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    events = TrafficGenerator().calls(args.calls)
+    interesting = sum(1 for event in events if event['Event'] in ChannelManager.INTERESTING_EVENTS)
+
+    traced = best_of(lambda: replay(events, TracingReporter()))
+    silent = best_of(lambda: replay(events, SilentReporter()))
+
+    print('{} events, {} handled'.format(len(events), interesting))
+    print('tracing on:  {:.2f} us/event'.format(traced / interesting * 1e6))
+    print('tracing off: {:.2f} us/event'.format(silent / interesting * 1e6))
+    print('saving:      {:.2f} us/event ({:.0%})'.format(
+        (traced - silent) / interesting * 1e6, (traced - silent) / traced))
+
+
+if __name__ == '__main__':
+    main()
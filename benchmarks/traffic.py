@@ -0,0 +1,272 @@
+"""
+Generate synthetic AMI traffic for the benchmarks.
+
+The events have the shape the ChannelManager expects (DialBegin,
+LocalBridge with LocalOneChannel and so on) and include the VarSet and
+Newexten noise which makes up most of a real capture.
+"""
+from itertools import zip_longest
+
+
+class TrafficGenerator(object):
+    """
+    TrafficGenerator builds the AMI events of complete calls.
+
+    Usage::
+
+        traffic = TrafficGenerator()
+        events = traffic.simple_call()
+        events += traffic.ring_group_call(targets=20)
+    """
+    def __init__(self, prefix='bench', noise=True):
+        """
+        Args:
+            prefix (str): Prefix of all generated uniqueids.
+            noise (bool): Whether to add VarSet and Newexten events.
+        """
+        self.prefix = prefix
+        self.noise = noise
+        self._sequence = 0
+
+    def _next(self):
+        self._sequence += 1
+        return self._sequence
+
+    def _new_channel(self, events, tech, exten, number, accountcode=''):
+        sequence = self._next()
+        if tech == 'Local':
+            base = 'Local/{}@bench_local-{:08x}'.format(exten, sequence)
+        else:
+            base = 'SIP/{}-{:08x}'.format(number, sequence)
+
+        channels = []
+        for suffix in ((';1', ';2') if tech == 'Local' else ('',)):
+            channel = {
+                'Channel': base + suffix,
+                'Uniqueid': '{}-{}.{}'.format(self.prefix, sequence, len(channels)),
+            }
+            events.append({
+                'Event': 'Newchannel',
+                'Privilege': 'call,all',
+                'Channel': channel['Channel'],
+                'Uniqueid': channel['Uniqueid'],
+                'ChannelState': '0',
+                'ChannelStateDesc': 'Down',
+                'CallerIDNum': number,
+                'CallerIDName': '',
+                'AccountCode': accountcode,
+                'Exten': exten,
+                'Context': 'bench',
+                'content': '',
+            })
+            self._add_noise(events, channel)
+            channels.append(channel)
+
+        if tech == 'Local':
+            events.append({
+                'Event': 'LocalBridge',
+                'Privilege': 'call,all',
+                'LocalOneChannel': channels[0]['Channel'],
+                'LocalTwoChannel': channels[1]['Channel'],
+                'Uniqueid1': channels[0]['Uniqueid'],
+                'Uniqueid2': channels[1]['Uniqueid'],
+                'LocalOptimization': 'Yes',
+                'content': '',
+            })
+            return channels
+
+        return channels[0]
+
+    def _add_noise(self, events, channel, count=3):
+        if not self.noise:
+            return
+
+        for i in range(count):
+            events.append({
+                'Event': 'VarSet',
+                'Privilege': 'dialplan,all',
+                'Channel': channel['Channel'],
+                'Uniqueid': channel['Uniqueid'],
+                'Variable': 'BENCH_VAR_{}'.format(i),
+                'Value': 'value-{}'.format(i),
+                'content': '',
+            })
+        events.append({
+            'Event': 'Newexten',
+            'Privilege': 'dialplan,all',
+            'Channel': channel['Channel'],
+            'Uniqueid': channel['Uniqueid'],
+            'Context': 'bench',
+            'Extension': 's',
+            'Priority': '1',
+            'Application': 'NoOp',
+            'AppData': '',
+            'content': '',
+        })
+
+    def _state(self, events, channel, state):
+        events.append({
+            'Event': 'Newstate',
+            'Privilege': 'call,all',
+            'Channel': channel['Channel'],
+            'Uniqueid': channel['Uniqueid'],
+            'ChannelState': str(state),
+            'ChannelStateDesc': '',
+            'content': '',
+        })
+
+    def _dial(self, events, source, target):
+        events.append({
+            'Event': 'DialBegin',
+            'Privilege': 'call,all',
+            'Channel': source['Channel'],
+            'UniqueID': source['Uniqueid'],
+            'DestChannel': target['Channel'],
+            'DestUniqueID': target['Uniqueid'],
+            'content': '',
+        })
+
+    def _bridge(self, events, one, two, state):
+        events.append({
+            'Event': 'Bridge',
+            'Privilege': 'call,all',
+            'LocalOneChannel': one['Channel'],
+            'LocalTwoChannel': two['Channel'],
+            'Bridgestate': state,
+            'content': '',
+        })
+
+    def _hangup(self, events, channel, cause=16):
+        self._add_noise(events, channel, count=1)
+        events.append({
+            'Event': 'Hangup',
+            'Privilege': 'call,all',
+            'Channel': channel['Channel'],
+            'Uniqueid': channel['Uniqueid'],
+            'Cause': str(cause),
+            'content': '',
+        })
+
+    def simple_call(self, caller='201', callee='202'):
+        """
+        Build the events of an answered call from caller to callee.
+
+        Returns:
+            list: The AMI events of the call.
+        """
+        events = []
+        a_chan = self._new_channel(events, 'SIP', callee, caller, accountcode='1500' + caller)
+        self._state(events, a_chan, 4)
+        b_chan = self._new_channel(events, 'SIP', callee, callee)
+        self._dial(events, a_chan, b_chan)
+        self._state(events, b_chan, 5)
+        self._state(events, b_chan, 6)
+        self._state(events, a_chan, 6)
+        self._bridge(events, a_chan, b_chan, 'Link')
+        self._add_noise(events, a_chan)
+        self._bridge(events, a_chan, b_chan, 'Unlink')
+        self._hangup(events, b_chan)
+        self._hangup(events, a_chan)
+        return events
+
+    def ring_group_call(self, targets, caller='201', group='401', via_local=True):
+        """
+        Build the events of a call to a ring group which is answered by
+        the first target.
+
+        Args:
+            targets (int): The number of phones in the ring group.
+            via_local (bool): Whether every target is dialed through a
+                pair of Local channels, like a real ring group does.
+
+        Returns:
+            list: The AMI events of the call.
+        """
+        events = []
+        a_chan = self._new_channel(events, 'SIP', group, caller, accountcode='1500' + caller)
+        self._state(events, a_chan, 4)
+
+        group_one, group_two = self._new_channel(events, 'Local', group, caller)
+        self._dial(events, a_chan, group_one)
+
+        chains = []
+        for i in range(targets):
+            number = str(1000 + i)
+            if via_local:
+                local_one, local_two = self._new_channel(events, 'Local', number, caller)
+                self._dial(events, group_two, local_one)
+                b_chan = self._new_channel(events, 'SIP', group, number)
+                self._dial(events, local_two, b_chan)
+                chains.append((b_chan, local_two, local_one))
+            else:
+                b_chan = self._new_channel(events, 'SIP', group, number)
+                self._dial(events, group_two, b_chan)
+                chains.append((b_chan,))
+
+        for chain in chains:
+            self._state(events, chain[0], 5)
+
+        winner = chains[0][0]
+        self._state(events, winner, 6)
+        self._state(events, a_chan, 6)
+
+        for chain in chains[1:]:
+            for i, channel in enumerate(chain):
+                self._hangup(events, channel, cause=26 if i == 0 else 16)
+
+        self._bridge(events, a_chan, winner, 'Link')
+        self._bridge(events, a_chan, winner, 'Unlink')
+        self._hangup(events, winner)
+        for channel in reversed(chains[0][1:]):
+            self._hangup(events, channel)
+        self._hangup(events, group_two)
+        self._hangup(events, group_one)
+        self._hangup(events, a_chan)
+        return events
+
+    def calls(self, count, concurrent=50, ring_group_every=10, ring_group_size=5):
+        """
+        Build the events of many calls, of which up to concurrent are
+        interleaved at a time.
+
+        Args:
+            count (int): The number of calls.
+            concurrent (int): The number of calls in progress at a time.
+            ring_group_every (int): Make every n-th call a ring group call.
+            ring_group_size (int): The number of phones in a ring group.
+
+        Returns:
+            list: The AMI events of all calls.
+        """
+        events = []
+        batch = []
+        for i in range(count):
+            if ring_group_every and i % ring_group_every == 0:
+                batch.append(self.ring_group_call(ring_group_size))
+            else:
+                batch.append(self.simple_call())
+
+            if len(batch) == concurrent:
+                events.extend(interleave(batch))
+                batch = []
+
+        events.extend(interleave(batch))
+        return events
+
+
+def interleave(event_lists):
+    """
+    Merge the events of concurrent calls round-robin.
+
+    Args:
+        event_lists (list): A list of event lists.
+
+    Returns:
+        list: The merged events.
+    """
+    return [
+        event
+        for events in zip_longest(*event_lists)
+        for event in events
+        if event is not None
+    ]
@@ -1,8 +1,13 @@
+from .runners.ami_client import AmiClient
 from .runners.ami_runner import AmiRunner
 from .runners.file_runner import FileRunner
+from .runners.partition import PartitionedFileRunner
 
+from .reporters.async_reporter import AsyncBaseReporter
 from .reporters.base_reporter import BaseReporter
 from .reporters.debug_reporter import DebugReporter
 from .reporters.json_reporter import JsonReporter
+from .reporters.recording_reporter import RecordingReporter
+from .reporters.threaded_reporter import ThreadedReporter
 
 from .channel import ChannelManager
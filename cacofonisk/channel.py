@@ -19,12 +19,20 @@ of these four events::
 You should override these ChannelManager methods in your
 subclass and add the desired behaviour for those events.
 """
+import io
+import pickle
+from collections import OrderedDict, defaultdict
+from time import monotonic
+
 from cacofonisk.constants import (AST_CAUSE_ANSWERED_ELSEWHERE, AST_CAUSE_CALL_REJECTED, AST_CAUSE_NORMAL_CLEARING,
                                   AST_CAUSE_NO_ANSWER, AST_CAUSE_NO_USER_RESPONSE, AST_CAUSE_UNKNOWN,
                                   AST_CAUSE_USER_BUSY, AST_STATE_DIALING, AST_STATE_DOWN, AST_STATE_RING,
                                   AST_STATE_RINGING, AST_STATE_UP)
 from .callerid import CallerId
 
+# The trace message when the last channel is gone.
+NO_CHANNELS_LEFT = '(no channels left)'
+
 
 class MissingChannel(KeyError):
     pass
@@ -38,6 +46,27 @@ class BridgedError(Exception):
     pass
 
 
+# Markers the ChannelManager puts on channels, as bit flags.
+FLAG_IGNORE_B_DIAL = 0x1
+FLAG_IGNORE_A_HANGUP = 0x2
+
+
+class ChannelMarkers(object):
+    """
+    ChannelMarkers holds the markers and custom data of a channel.
+
+    A channel only gets one when something is put on it. On masquerade,
+    the original channel takes over the ChannelMarkers of the clone, so
+    both channels share the same markers afterwards.
+    """
+    __slots__ = ('flags', 'raw_blind_transfer', 'custom')
+
+    def __init__(self):
+        self.flags = 0
+        self.raw_blind_transfer = None
+        self.custom = None
+
+
 class Channel(object):
     """
     A Channel holds Asterisk channel state.
@@ -50,6 +79,11 @@ class Channel(object):
     state of all open channels through the events generated by a running
     Asterisk instance.
     """
+    __slots__ = (
+        '_channel_manager', '_markers', '_name', '_id',
+        '_fwd_local_bridge', '_back_local_bridge', 'back_dial', 'fwd_dials',
+        '_state', '_bridged', '_exten', '_side', '_callerid', '_dialing_root',
+    )
 
     def __init__(self, event, channel_manager):
         """
@@ -85,9 +119,9 @@ class Channel(object):
         """
         self._channel_manager = channel_manager
 
-        # Uses of this instance may put data in the custom dict. We take
-        # care to link this on masquerade.
-        self.custom = {}
+        # Our markers and the custom dict are created when they're first
+        # used. We take care to link them on masquerade.
+        self._markers = None
 
         self._name = event['Channel']
         self._id = event['Uniqueid']
@@ -96,8 +130,14 @@ class Channel(object):
         self.back_dial = None
         self.fwd_dials = []
 
+        # The cached result of get_dialing_channel(). It is reset by
+        # _forget_dialing_root() whenever the dials or local bridges on
+        # the way to the dialing channel change.
+        self._dialing_root = None
+
         self._state = int(event['ChannelState'])  # 0, Down
-        self._bridged = set()
+        # The set of bridged channels is created on the first link.
+        self._bridged = None
         self._exten = event['Exten']
 
         self._side = None
@@ -109,7 +149,7 @@ class Channel(object):
             is_public=True
         )
 
-        self._trace('new {!r}'.format(self))
+        self._trace('new {!r}', self)
 
     def __repr__(self):
         return (
@@ -125,12 +165,102 @@ class Channel(object):
             next=(self._fwd_local_bridge and self._fwd_local_bridge.name),
             prev=(self._back_local_bridge and self._back_local_bridge.name))
 
-    def _trace(self, msg):
+    def _trace(self, msg, *args):
         """
         _trace can be used to follow interesting events.
+
+        The message is only formatted with args by an override that
+        actually wants it, so tracing costs nothing by default.
+
+        Args:
+            msg (str): A format string.
+            *args: The arguments for the format string.
         """
         pass
 
+    def _get_markers(self):
+        if self._markers is None:
+            self._markers = ChannelMarkers()
+        return self._markers
+
+    @property
+    def custom(self):
+        """
+        Get the dict in which users of this instance may put data.
+
+        The dict is created on first use and is shared with the clone
+        channel after a masquerade.
+
+        Returns:
+            dict: The custom data of this channel.
+        """
+        markers = self._get_markers()
+        if markers.custom is None:
+            markers.custom = {}
+        return markers.custom
+
+    @custom.setter
+    def custom(self, custom):
+        self._get_markers().custom = custom
+
+    def has_flag(self, flag):
+        """
+        Check whether one of the FLAG_* markers is set on this channel.
+
+        Args:
+            flag (int): The flag to check.
+
+        Returns:
+            bool: True if the flag is set.
+        """
+        return self._markers is not None and bool(self._markers.flags & flag)
+
+    def set_flag(self, flag):
+        """
+        Set one of the FLAG_* markers on this channel.
+
+        Args:
+            flag (int): The flag to set.
+        """
+        self._get_markers().flags |= flag
+
+    def pop_flag(self, flag):
+        """
+        Clear one of the FLAG_* markers on this channel.
+
+        Args:
+            flag (int): The flag to clear.
+
+        Returns:
+            bool: True if the flag was set.
+        """
+        if not self.has_flag(flag):
+            return False
+        self._markers.flags &= ~flag
+        return True
+
+    def set_raw_blind_transfer(self, redirector):
+        """
+        Remember that a blind transfer to this channel is coming up.
+
+        Args:
+            redirector (Channel): The channel which is being transferred.
+        """
+        self._get_markers().raw_blind_transfer = redirector
+
+    def pop_raw_blind_transfer(self):
+        """
+        Forget about a coming blind transfer to this channel.
+
+        Returns:
+            Channel: The channel which was being transferred, or None.
+        """
+        if self._markers is None:
+            return None
+        redirector = self._markers.raw_blind_transfer
+        self._markers.raw_blind_transfer = None
+        return redirector
+
     @property
     def is_relevant(self):
         """
@@ -185,7 +315,7 @@ class Channel(object):
         Returns:
             bool: True if the channel is local, false otherwise.
         """
-        return self.name.startswith('Local/')
+        return self._name.startswith('Local/')
 
     @property
     def is_sip(self):
@@ -199,7 +329,7 @@ class Channel(object):
         Returns:
             bool: True if this channel is a SIP channel, false otherwise.
         """
-        return self.name.startswith('SIP/')
+        return self._name.startswith('SIP/')
 
     @property
     def uniqueid(self):
@@ -219,7 +349,7 @@ class Channel(object):
 
     @property
     def bridged_channel(self):
-        tmp = list(self._bridged)
+        tmp = list(self._bridged or ())
         if len(tmp) != 1:
             raise BridgedError(
                 'Expected one bridged channel. '
@@ -278,7 +408,7 @@ class Channel(object):
         """
         old_name = self._name
         self._name = name
-        self._trace('set_name {} -> {}'.format(old_name, name))
+        self._trace('set_name {} -> {}', old_name, name)
 
     def set_state(self, event):
         """
@@ -313,7 +443,7 @@ class Channel(object):
         old_state = self._state
         self._state = int(event['ChannelState'])  # 4=Ring, 6=Up
         assert old_state != self._state
-        self._trace('set_state {} -> {}'.format(old_state, self._state))
+        self._trace('set_state {} -> {}', old_state, self._state)
 
         if old_state == AST_STATE_DOWN and self._state in (AST_STATE_DIALING, AST_STATE_RING, AST_STATE_UP):
             self._channel_manager._raw_a_dial(self)
@@ -324,7 +454,7 @@ class Channel(object):
         elif old_state == AST_STATE_RINGING and self._state == AST_STATE_UP:
             self._channel_manager._raw_b_up(self)
         else:
-            self._trace('Unimplemented state update: {} -> {}'.format(old_state, self._state))
+            self._trace('Unimplemented state update: {} -> {}', old_state, self._state)
 
     def set_callerid(self, event):
         """
@@ -342,7 +472,7 @@ class Channel(object):
             Event='NewCallerid' Privilege='call,all'
             Uniqueid='vgua0-dev-1442239323.24' content=''>
         """
-        old_cli = str(self._callerid)
+        old_cli = self._callerid
         if event['CallerIDNum'] == str(self._callerid.code):
             # If someone uses call pickups, the CallerIDNum will be the
             # same as the AccountCode. However, broadcasting that is a bit
@@ -358,7 +488,7 @@ class Channel(object):
             number=caller_id_number,
             is_public=('Allowed' in event['CID-CallingPres']))
 
-        self._trace('set_callerid {} -> {}'.format(old_cli, self._callerid))
+        self._trace('set_callerid {} -> {}', old_cli, self._callerid)
 
     def set_accountcode(self, event):
         """
@@ -378,9 +508,9 @@ class Channel(object):
         if not self._callerid.code:
             old_accountcode = self._callerid.code
             self._callerid = self._callerid.replace(code=int(event['AccountCode']))
-            self._trace('set_accountcode {} -> {}'.format(old_accountcode, self._callerid.code))
+            self._trace('set_accountcode {} -> {}', old_accountcode, self._callerid.code)
         else:
-            self._trace('set_accountcode ignored {} -> {}'.format(self._callerid.code, event['AccountCode']))
+            self._trace('set_accountcode ignored {} -> {}', self._callerid.code, event['AccountCode'])
 
     def connectab_participants(self):
         """
@@ -404,8 +534,12 @@ class Channel(object):
         Args:
             event (dict): A dictionary containing an AMI event.
         """
+        # Everything dialed through us will have a different origin.
+        self._forget_dialing_root()
+
         # Remove the bridges.
         if self._fwd_local_bridge:
+            self._fwd_local_bridge._forget_dialing_root()
             self._fwd_local_bridge._back_local_bridge = None
 
         if self._back_local_bridge:
@@ -419,6 +553,23 @@ class Channel(object):
         # Assert that there are no bridged channels.
         assert not self._bridged, self._bridged
 
+    def do_evict(self):
+        """
+        do_evict clears all related channels, like do_hangup, but also
+        unlinks the bridged channels and the channels we dialed. It is
+        used to forget a channel whose Hangup we never saw.
+        """
+        for other in list(self._bridged or ()):
+            self.do_unlink(other)
+
+        # The channels we dialed are on their own now.
+        for b_chan in self.fwd_dials:
+            b_chan.back_dial = None
+            b_chan._forget_dialing_root()
+        del self.fwd_dials[:]
+
+        self.do_hangup(None)
+
     def do_localbridge(self, other):
         """
         do_localbridge sets `self` as attr:`_back_local_bridge` on `other`
@@ -444,26 +595,31 @@ class Channel(object):
 
         self._fwd_local_bridge = other
         other._back_local_bridge = self
+        other._forget_dialing_root()
 
-        self._trace('do_localbridge -> {!r}'.format(other))
+        self._trace('do_localbridge -> {!r}', other)
 
     def do_masquerade(self, other):
         """
         do_masquerade removes all links from `self` and moves the links from
-        `other` to `self`. The `custom` dict is also moved from `other` to
-        `self`.
+        `other` to `self`. The markers and the `custom` dict are also moved
+        from `other` to `self`.
 
         Args:
             other (Channel): An instance of class:`Channel`.
         """
+        # The links of both channels change, so forget where everything
+        # dialed through them was dialed from.
+        self._forget_links_dialing_root(other)
+
         # If self is linked, we must undo all of that first.
         if self._fwd_local_bridge:
-            self._trace('discarding old next link {}'.format(self._fwd_local_bridge.name))
+            self._trace('discarding old next link {}', self._fwd_local_bridge.name)
             self._fwd_local_bridge._back_local_bridge = None
             self._fwd_local_bridge = None
 
         if self._back_local_bridge:
-            self._trace('discarding old prev link {}'.format(self._back_local_bridge.name))
+            self._trace('discarding old prev link {}', self._back_local_bridge.name)
             self._back_local_bridge._fwd_local_bridge = None
             self._back_local_bridge = None
 
@@ -472,13 +628,13 @@ class Channel(object):
             other._fwd_local_bridge._back_local_bridge = self
             self._fwd_local_bridge = other._fwd_local_bridge
             other._fwd_local_bridge = None
-            self._trace('updated next link {}'.format(self._fwd_local_bridge.name))
+            self._trace('updated next link {}', self._fwd_local_bridge.name)
 
         if other._back_local_bridge:
             other._back_local_bridge._fwd_local_bridge = self
             self._back_local_bridge = other._back_local_bridge
             other._back_local_bridge = None
-            self._trace('updated prev link {}'.format(self._back_local_bridge.name))
+            self._trace('updated prev link {}', self._back_local_bridge.name)
 
         # What should we do with bridges? In the Asterisk source, it looks like
         # we keep the bridges intact, i.e.: the original (self) channel gets
@@ -488,12 +644,37 @@ class Channel(object):
 
         # There is one interesting feature going on here, later on, in
         # certain cases, we a get a soon to be destroyed channel that we
-        # need to write info to. We link the info dict to the new class
+        # need to write info to. We link the markers to the new class
         # so we can write to the old one.
-        self.custom = other.custom
+        self._markers = other._get_markers()
+
+        self._forget_links_dialing_root(other)
         self._callerid = other.callerid
 
-        self._trace('do_masquerade -> {!r} {!r}'.format(self, other))
+        self._trace('do_masquerade -> {!r} {!r}', self, other)
+
+    def _forget_links_dialing_root(self, other):
+        for channel in (self, other):
+            channel._forget_dialing_root()
+            if channel._fwd_local_bridge:
+                channel._fwd_local_bridge._forget_dialing_root()
+
+    def do_dial(self, other):
+        """
+        do_dial records that `self` is dialing `other`.
+
+        Args:
+            other (Channel): An instance of class:`Channel`.
+        """
+        # Verify target is not being dialed already.
+        assert not other.back_dial
+
+        # fwd_dials is a list of channels being dialed by A.
+        self.fwd_dials.append(other)
+
+        # back_dial is the channel dialing B.
+        other.back_dial = self
+        other._forget_dialing_root()
 
     def do_link(self, other):
         """
@@ -503,6 +684,11 @@ class Channel(object):
         Args:
             other (Channel): An instance of class:`Channel`.
         """
+        if self._bridged is None:
+            self._bridged = set()
+        if other._bridged is None:
+            other._bridged = set()
+
         self._bridged.add(other)
         other._bridged.add(self)
 
@@ -514,6 +700,9 @@ class Channel(object):
         Args:
             other (Channel): An instance of class:`Channel`.
         """
+        if not self._bridged or not other._bridged:
+            raise KeyError(other if not self._bridged else self)
+
         self._bridged.remove(other)
         other._bridged.remove(self)
 
@@ -523,23 +712,69 @@ class Channel(object):
 
         When a channel is not bridged yet, you can use this on the
         B-channel to figure out which A-channel initiated the call.
-        """
-        if self.back_dial:
-            # Check if we are being dialed.
-            a_chan = self.back_dial
+
+        The result is cached on every channel along the way, until
+        _forget_dialing_root() is called for it.
+        """
+        if self._dialing_root is not None:
+            return self._dialing_root
+
+        path = []
+        seen = set()
+        channel = self
+
+        while channel._dialing_root is None:
+            if channel in seen:
+                raise ValueError('Dial loop through {!r}'.format(channel))
+            seen.add(channel)
+            path.append(channel)
+
+            # Check if we are being dialed. If not, this is the root
+            # channel.
+            a_chan = channel.back_dial
+            if not a_chan:
+                root = channel
+                break
+
+            # If our a_chan has a local bridge, use the back part of that
+            # bridge to check for further dials.
+            if a_chan._back_local_bridge:
+                a_chan = a_chan._back_local_bridge
+
+            # Continue with the incoming channel to find the true origin
+            # channel.
+            channel = a_chan
         else:
-            # This is the root channel.
-            a_chan = None
+            root = channel._dialing_root
+
+        for channel in path:
+            channel._dialing_root = root
+
+        return root
+
+    def _forget_dialing_root(self):
+        """
+        Reset the cached dialing channel of self and of all channels
+        dialed on our behalf, because the way back to the dialing
+        channel has changed.
+        """
+        self._dialing_root = None
+        if not self.fwd_dials and not self._fwd_local_bridge:
+            return
+
+        stack = [self]
+        seen = set()
 
-        # If our a_chan has a local bridge, use the back part of that bridge
-        # to check for further dials.
-        if a_chan and a_chan._back_local_bridge:
-            a_chan = a_chan._back_local_bridge
+        while stack:
+            channel = stack.pop()
+            if channel in seen:
+                continue
+            seen.add(channel)
 
-        # If we have an incoming channel, recurse through the channels to find
-        # the true origin channel. If we don't have one, it means we're the
-        # origin channel.
-        return a_chan.get_dialing_channel() if a_chan else self
+            channel._dialing_root = None
+            stack.extend(channel.fwd_dials)
+            if channel._fwd_local_bridge:
+                stack.append(channel._fwd_local_bridge)
 
     def get_dialed_channels(self):
         """
@@ -551,52 +786,188 @@ class Channel(object):
 
         It works like this:
 
-        * A-channel (this) has a list of _fwd_dials items (open
+        * A-channel (this) has a list of fwd_dials items (open
           dials).
-        * We loop over those (a list of uniqueids) and find the
-          corresponding channels.
         * Those channels may be SIP channels, or they can be local
-          channels, in which case we have to look further (by calling
-          this function on those channels).
+          channels, in which case we have to look further, at the
+          channels dialed by the other side of the local channel.
+
+        The channels are walked with an explicit stack rather than
+        recursion, so a ring group with many targets behind Local
+        channels is collected in a single pass.
+
+        Returns:
+            list: The dialed (non-Local) channels, in the order in which
+                they were dialed (depth first through the Local
+                channels), so a replay always reports the same order.
         """
-        b_channels = set()
+        b_channels = []
+        root = self._fwd_local_bridge or self
+        # Reversed, so the stack pops the dials in the order they were made.
+        pending = list(reversed(root.fwd_dials))
 
-        if self._fwd_local_bridge:
-            b_chans = self._fwd_local_bridge.fwd_dials
-        else:
-            b_chans = self.fwd_dials
+        while pending:
+            b_chan = pending.pop()
 
-        for b_chan in b_chans:
             # Likely, b_chan._fwd_local_bridge is None, in which case we're
             # looking at a real tech channel (non-Local).
-            # Or, the b_chan has one _fwd_local_bridge, after which we have
-            # to call this function again.
+            # Or, the b_chan has one _fwd_local_bridge, whose dials we
+            # have to look at as well.
             if b_chan._fwd_local_bridge:
                 b_chan = b_chan._fwd_local_bridge
 
                 assert not b_chan._fwd_local_bridge, \
                     ('Since when does asterisk do double links? b_chan={!r}'.format(b_chan))
 
-                b_channels.update(b_chan.get_dialed_channels())
+                pending.extend(reversed(b_chan.fwd_dials))
             else:
                 assert not b_chan.fwd_dials
-                b_channels.add(b_chan)
+                b_channels.append(b_chan)
 
         return b_channels
 
 
+class InternTable(object):
+    """
+    InternTable keeps a single copy of equal strings.
+
+    The ChannelRegistry can intern the names and uniqueids of its
+    channels, and the ChannelManager then replaces the equal strings of
+    the events by them (see INTERN_STRINGS), so the events and the
+    channels which refer to the same channel share one string, and the
+    registry finds its keys by identity. Unlike sys.intern(), the strings
+    are released again when their channel is removed from the registry,
+    and the table is bounded: when it is full, new strings are passed
+    through as they are.
+    """
+    # The event fields which hold a channel name or uniqueid.
+    EVENT_KEYS = frozenset((
+        'Channel', 'Uniqueid', 'UniqueID', 'DestChannel', 'DestUniqueID', 'LocalOneChannel', 'LocalTwoChannel',
+        'TargetChannel', 'TargetUniqueid', 'Clone', 'Original', 'Newname',
+    ))
+
+    def __init__(self, max_size=100000):
+        """
+        Create an InternTable instance.
+
+        Args:
+            max_size (int): The maximum number of strings in the table.
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1, got {!r}'.format(max_size))
+
+        self._strings = {}
+        self._max_size = max_size
+
+    def intern(self, value):
+        """
+        Get the single copy of a string.
+
+        Args:
+            value (str): The string to intern.
+
+        Returns:
+            str: The equal string in the table, or value itself if there
+                is none. Then value is added, unless the table is full.
+        """
+        strings = self._strings
+        interned = strings.get(value)
+        if interned is not None:
+            return interned
+
+        if len(strings) < self._max_size:
+            strings[value] = value
+        return value
+
+    def intern_event(self, event):
+        """
+        Replace the channel names and uniqueids of an event by their
+        single copies.
+
+        The strings which aren't in the table are left alone, not added:
+        only the registry adds the strings of the channels it knows, so
+        the names of unknown channels or of the targets of a transfer
+        don't fill up the table.
+
+        Args:
+            event (dict): A dictionary containing an AMI event.
+        """
+        strings = self._strings
+        for key in self.EVENT_KEYS.intersection(event):
+            value = event[key]
+            interned = strings.get(value)
+            if interned is not None and interned is not value:
+                event[key] = interned
+
+    def release(self, value):
+        """
+        Remove a string from the table, if it's there.
+
+        Args:
+            value (str): The string to release.
+        """
+        self._strings.pop(value, None)
+
+    def __len__(self):
+        """
+        Get the number of strings in the table.
+
+        Returns:
+            int: The number of strings.
+        """
+        return len(self._strings)
+
+
 class ChannelRegistry(object):
     """
     ChannelRegistry stores the channels tracked by ChannelManager.
 
     ChannelRegistry exposes methods to add and remove channels and to
     retrieve them by attributes like their name and uniqueid.
+
+    Channels whose Hangup is lost would stay in the registry forever, so
+    the registry can keep track of when each channel was last used. See
+    get_stale() for the channels which should be evicted.
+
+    With an InternTable, the name and uniqueid of every channel are
+    interned while the channel is in the registry.
     """
 
-    def __init__(self):
+    def __init__(self, max_age=None, max_size=None, clock=monotonic, interned=None):
+        """
+        Create a ChannelRegistry instance.
+
+        Args:
+            max_age (float): Evict channels which haven't been looked up
+                or added for this many seconds. None to never evict them.
+            max_size (int): Evict the least recently used channels when
+                there are more channels than this. None for no limit.
+            clock (callable): Returns the current time in seconds.
+            interned (InternTable): The table for the names and uniqueids
+                of the channels, or None to not intern them.
+        """
+        if max_size is not None and max_size < 1:
+            raise ValueError('max_size must be at least 1, got {!r}'.format(max_size))
+
         self._channels_by_name = {}
         self._channels_by_uniqueid = {}
 
+        self._max_age = max_age
+        self._max_size = max_size
+        self._clock = clock
+        self._interned = interned
+
+        # The time every channel was last used, least recently used
+        # first. We only spend time and memory on it if we evict.
+        if max_age is None and max_size is None:
+            self._last_used = None
+        else:
+            self._last_used = OrderedDict()
+
+    def _touch(self, channel):
+        self._last_used[channel] = self._clock()
+        self._last_used.move_to_end(channel)
+
     def add(self, channel):
         """
         Add the channel to the registry.
@@ -606,6 +977,11 @@ class ChannelRegistry(object):
         """
         self._channels_by_name[channel.name] = channel
         self._channels_by_uniqueid[channel.uniqueid] = channel
+        if self._last_used is not None:
+            self._touch(channel)
+        if self._interned is not None:
+            self._interned.intern(channel.name)
+            self._interned.intern(channel.uniqueid)
 
     def get_by_uniqueid(self, uniqueid):
         """
@@ -617,11 +993,14 @@ class ChannelRegistry(object):
         Returns:
             Channel: The channel with the given ID.
         """
-        if uniqueid in self._channels_by_uniqueid:
-            return self._channels_by_uniqueid[uniqueid]
-        else:
+        channel = self._channels_by_uniqueid.get(uniqueid)
+        if channel is None:
             raise MissingUniqueid(uniqueid)
 
+        if self._last_used is not None:
+            self._touch(channel)
+        return channel
+
     def get_by_name(self, name):
         """
         Get the channel with the given channel name.
@@ -632,11 +1011,37 @@ class ChannelRegistry(object):
         Returns:
             Channel: The channel with the given name.
         """
-        if name in self._channels_by_name:
-            return self._channels_by_name[name]
-        else:
+        channel = self._channels_by_name.get(name)
+        if channel is None:
             raise MissingChannel(name)
 
+        if self._last_used is not None:
+            self._touch(channel)
+        return channel
+
+    def get_stale(self):
+        """
+        Get the least recently used channel, if it should be evicted.
+
+        The caller should remove the channel before asking again.
+
+        Returns:
+            tuple: The channel and the reason ('max-size' or 'max-age'),
+                or (None, None) if no channel should be evicted.
+        """
+        if not self._last_used:
+            return None, None
+
+        channel, last_used = next(iter(self._last_used.items()))
+
+        if self._max_size is not None and len(self._last_used) > self._max_size:
+            return channel, 'max-size'
+
+        if self._max_age is not None and self._clock() - last_used > self._max_age:
+            return channel, 'max-age'
+
+        return None, None
+
     def remove(self, channel):
         """
         Remove a channel from the registry.
@@ -650,9 +1055,25 @@ class ChannelRegistry(object):
         if channel.uniqueid in self._channels_by_uniqueid:
             del (self._channels_by_uniqueid[channel.uniqueid])
 
+        if self._last_used is not None:
+            self._last_used.pop(channel, None)
+
+        if self._interned is not None:
+            self._interned.release(channel.name)
+            self._interned.release(channel.uniqueid)
+
         if not self._channels_by_name:
             assert not self._channels_by_uniqueid
 
+    def __iter__(self):
+        """
+        Iterate over a snapshot of the channels in the registry.
+
+        Returns:
+            iterator: The channels, so they can be removed while iterating.
+        """
+        return iter(list(self._channels_by_uniqueid.values()))
+
     def __len__(self):
         """
         Get the number of channels currently in the registry.
@@ -663,7 +1084,99 @@ class ChannelRegistry(object):
         return len(self._channels_by_name)
 
 
-class ChannelManager(object):
+class _ChannelPickler(pickle.Pickler):
+    """
+    Pickle channels without their ChannelManager, which holds the
+    reporter.
+    """
+    def __init__(self, fp, channel_manager):
+        super().__init__(fp, protocol=pickle.HIGHEST_PROTOCOL)
+        self.channel_manager = channel_manager
+
+    def persistent_id(self, obj):
+        if obj is self.channel_manager:
+            return 'channel_manager'
+        return None
+
+
+class _ChannelUnpickler(pickle.Unpickler):
+    """
+    Unpickle channels for another ChannelManager.
+    """
+    def __init__(self, fp, channel_manager):
+        super().__init__(fp)
+        self.channel_manager = channel_manager
+
+    def persistent_load(self, pid):
+        if pid != 'channel_manager':
+            raise pickle.UnpicklingError('Unexpected persistent id {!r}'.format(pid))
+        return self.channel_manager
+
+
+def handles(*event_names):
+    """
+    Register a ChannelManager method as the handler of AMI events.
+
+    The handler is called with the event as its only argument. A handler
+    registered in a subclass replaces the handler of its parent class for
+    the same event name.
+
+    Usage::
+
+        class MyChannelManager(ChannelManager):
+            @handles('Newexten')
+            def _on_newexten(self, event):
+                pass
+
+    Args:
+        *event_names (str): The names of the events to handle.
+    """
+    def decorator(func):
+        func.handled_events = event_names
+        return func
+    return decorator
+
+
+class ChannelManagerType(type):
+    """
+    Metaclass which builds the event handler table of a ChannelManager.
+
+    The table maps event names to the methods registered with
+    :func:`handles`. It is built once when the class is created. Unless a
+    class sets INTERESTING_EVENTS itself, INTERESTING_EVENTS is derived
+    from the table, so runners filter on exactly the handled events.
+    HANDLED_EVENTS holds the names in the table; the other interesting
+    events are only traced.
+    """
+    def __new__(mcs, name, bases, namespace):
+        cls = super().__new__(mcs, name, bases, namespace)
+
+        handler_names = {}
+        for base in reversed(cls.__mro__):
+            for attr, value in vars(base).items():
+                for event_name in getattr(value, 'handled_events', ()):
+                    handler_names[event_name] = attr
+
+        # Look up the handlers on the class, so a plain override of a
+        # handler method is used as well.
+        cls._event_handlers = {
+            event_name: getattr(cls, attr)
+            for event_name, attr in handler_names.items()
+        }
+        cls.HANDLED_EVENTS = frozenset(cls._event_handlers)
+
+        if 'INTERESTING_EVENTS' in namespace:
+            cls.INTERESTING_EVENTS = frozenset(namespace['INTERESTING_EVENTS'])
+        elif '*' in getattr(cls, 'INTERESTING_EVENTS', ()):
+            # Keep listening to everything, like our parent does.
+            cls.INTERESTING_EVENTS = frozenset(cls.INTERESTING_EVENTS) | frozenset(cls._event_handlers)
+        else:
+            cls.INTERESTING_EVENTS = frozenset(cls._event_handlers)
+
+        return cls
+
+
+class ChannelManager(object, metaclass=ChannelManagerType):
     """
     The ChannelManager translates AMI events to high level call events.
 
@@ -723,26 +1236,47 @@ class ChannelManager(object):
                 # After some of the events, one of the event hook methods
                 # is called.
                 manager.on_event(event)
+
+    The AMI events are dispatched through a handler table, which is
+    built from the methods decorated with :func:`handles`. The
+    INTERESTING_EVENTS frozenset holds the names in that table. We
+    require all of these events to function properly. (Except perhaps
+    the FullyBooted one, which tells us that we're connected.)
+
+    A channel whose Hangup is lost (after a reconnect or a crash of
+    Asterisk) would be tracked forever. Set MAX_CHANNEL_AGE and/or
+    MAX_CHANNELS in a subclass to evict such channels when channels come
+    in or hang up, and PURGE_ON_FULLY_BOOTED to evict all channels when
+    Asterisk (re)starts. When no events come in, call evict_stale() now
+    and then (the AmiRunner does). Every evicted channel is passed to the
+    on_channel_evicted hook.
+
+    Set INTERN_STRINGS in a subclass to keep the names and uniqueids of
+    the channels in an InternTable of at most MAX_INTERNED strings, which
+    are released when their channel hangs up, and to replace the equal
+    strings of the events by them. A capture which is kept in memory then
+    holds one copy of each.
     """
-    # We require all of these events to function properly. (Except
-    # perhaps the FullyBooted one.)
-    INTERESTING_EVENTS = (
-        # This tells us that we're connected. We should probably
-        # flush our channels at this point, because they aren't up
-        # to date.
-        'FullyBooted',
-        # These events all relate to low level channel setup and
-        # maintenance.
-        'Newchannel', 'Newstate', 'NewCallerid',
-        'NewAccountCode', 'LocalBridge', 'Rename',
-        'Bridge', 'Masquerade',
-        # Higher level channel info.
-        'DialBegin', 'Hangup', 'Transfer',
-        # Events related to tracking calls through queues.
-        'AgentCalled',
-        # UserEvents
-        'UserEvent'
-    )
+    # Evict channels which have seen no events for this many seconds.
+    MAX_CHANNEL_AGE = None
+
+    # Evict the least recently used channels above this many channels.
+    MAX_CHANNELS = None
+
+    # Evict all channels on FullyBooted. This is off by default, since
+    # FullyBooted is also sent when we (re)connect to a running Asterisk.
+    PURGE_ON_FULLY_BOOTED = False
+
+    # Intern the names and uniqueids of the channels, and share them
+    # with the events, in a table of at most this many strings.
+    INTERN_STRINGS = False
+    MAX_INTERNED = 100000
+
+    # The handled events which a runner may drop when it can't keep up
+    # (the 'drop' overflow policy), on top of the events which are only
+    # traced. Without them, the caller ids are not updated and
+    # on_user_event is not called, but the channels stay consistent.
+    DROPPABLE_EVENTS = frozenset(('NewCallerid', 'NewAccountCode', 'UserEvent'))
 
     def __init__(self, reporter):
         """
@@ -753,7 +1287,47 @@ class ChannelManager(object):
                 methods.
         """
         self._reporter = reporter
-        self._registry = ChannelRegistry()
+        self._interned = InternTable(self.MAX_INTERNED) if self.INTERN_STRINGS else None
+        self._registry = ChannelRegistry(
+            max_age=self.MAX_CHANNEL_AGE, max_size=self.MAX_CHANNELS, interned=self._interned)
+
+        # Reporters which don't want trace messages get none, and we
+        # don't spend any time formatting them either.
+        self._tracing = getattr(reporter, 'wants_trace_msg', True)
+
+        # The hooks which are called for every event are skipped if the
+        # reporter left them alone.
+        self._trace_ami = self._get_reporter_hook('trace_ami')
+        self._reporter_on_event = self._get_reporter_hook('on_event')
+
+    def _get_reporter_hook(self, name):
+        """
+        Get a hook of the reporter, unless it is the no-op of BaseReporter.
+
+        Args:
+            name (str): The name of the hook.
+
+        Returns:
+            callable: The bound hook, or None if it doesn't do anything.
+        """
+        overrides = getattr(self._reporter, 'overrides', None)
+        if overrides is not None and not overrides(name):
+            return None
+        return getattr(self._reporter, name)
+
+    def _trace(self, msg, *args):
+        """
+        Pass a diagnostic message to the reporter, if it wants it.
+
+        The message is formatted with args only when it is passed on, so
+        callers should pass the values instead of formatting them.
+
+        Args:
+            msg (str): A format string (or any object if no args are given).
+            *args: The arguments for the format string.
+        """
+        if self._tracing:
+            self._reporter.trace_msg(msg.format(*args) if args else msg)
 
     def on_event(self, event):
         """
@@ -763,157 +1337,397 @@ class ChannelManager(object):
         Args:
             event (dict): A dictionary containing an AMI event.
         """
+        if self._interned is not None:
+            self._interned.intern_event(event)
+
         try:
             self._on_event(event)
-        except MissingChannel as e:
+        except (MissingChannel, MissingUniqueid, BridgedError) as e:
+            self._on_event_error(e, event)
+
+        if self._reporter_on_event is not None:
+            self._reporter_on_event(event)
+
+    def on_events(self, events):
+        """
+        on_events processes many events, like calling `on_event` for every
+        event in INTERESTING_EVENTS, but in a single tight loop.
+
+        The events which aren't interesting are skipped. Use this to
+        replay captured events in bulk.
+
+        Args:
+            events (iterable): Dictionaries containing AMI events.
+        """
+        cls = type(self)
+        if cls.on_event is not ChannelManager.on_event or cls._on_event is not ChannelManager._on_event:
+            # Respect the subclass which hooks into the event handling.
+            listen_all = '*' in self.INTERESTING_EVENTS
+            for event in events:
+                if listen_all or event['Event'] in self.INTERESTING_EVENTS:
+                    self.on_event(event)
+            return
+
+        interesting = None if '*' in self.INTERESTING_EVENTS else self.INTERESTING_EVENTS
+        handlers = self._event_handlers
+        trace_ami = self._trace_ami
+        reporter_on_event = self._reporter_on_event
+        intern_event = self._interned.intern_event if self._interned is not None else None
+
+        for event in events:
+            event_name = event['Event']
+            if interesting is not None and event_name not in interesting:
+                continue
+
+            if intern_event is not None:
+                intern_event(event)
+
+            if trace_ami is not None:
+                trace_ami(event)
+
+            handler = handlers.get(event_name)
+            if handler is not None:
+                try:
+                    handler(self, event)
+                except (MissingChannel, MissingUniqueid, BridgedError) as e:
+                    self._on_event_error(e, event)
+
+            if reporter_on_event is not None:
+                reporter_on_event(event)
+
+    def _on_event_error(self, error, event):
+        """
+        Trace an error which is expected while handling an event.
+
+        Args:
+            error (Exception): The MissingChannel, MissingUniqueid or
+                BridgedError raised by the handler.
+            event (dict): The event which was handled.
+        """
+        if isinstance(error, MissingChannel):
             # If this is after a recent FullyBooted and/or start of
             # self, it is reasonable to expect that certain events will
             # fail.
-            self._reporter.trace_msg(
+            self._trace(
                 'Channel with name {} not in mem when processing event: '
-                '{!r}'.format(e.args[0], event))
-        except MissingUniqueid as e:
+                '{!r}', error.args[0], event)
+        elif isinstance(error, MissingUniqueid):
             # This too is reasonably expected.
-            self._reporter.trace_msg(
+            self._trace(
                 'Channel with Uniqueid {} not in mem when processing event: '
-                '{!r}'.format(e.args[0], event))
-        except BridgedError as e:
-            self._reporter.trace_msg(e)
-
-        self._reporter.on_event(event)
+                '{!r}', error.args[0], event)
+        else:
+            self._trace(error)
 
     def _on_event(self, event):
         """
         on_event takes an event, extract and store the appropriate state
         updates and if possible fire an event ourself.
 
+        The event is passed to the handler registered for its name in
+        the class's handler table (see :func:`handles`). Events without a
+        handler are only traced.
+
         Args:
             event (Dict): A dictionary with Asterisk AMI data.
         """
         # Write message to reporter, for debug/test purposes.
-        self._reporter.trace_ami(event)
-
-        event_name = event['Event']
-        if event_name == 'FullyBooted':
-            # Time to clear our channels because they are stale?
-            self._reporter.trace_msg('Connected to Asterisk')
-        elif event_name == 'Newchannel':
-            channel = Channel(event, channel_manager=self)
-            self._registry.add(channel)
-        elif event_name == 'Newstate':
-            channel = self._registry.get_by_name(event['Channel'])
-            channel.set_state(event)
-        elif event_name == 'NewCallerid':
-            channel = self._registry.get_by_name(event['Channel'])
-            channel.set_callerid(event)
-        elif event_name == 'NewAccountCode':
-            channel = self._registry.get_by_name(event['Channel'])
-            channel.set_accountcode(event)
-        elif event_name == 'LocalBridge':
-            channel = self._registry.get_by_name(event['LocalOneChannel'])
-            other = self._registry.get_by_name(event['LocalTwoChannel'])
-            channel.do_localbridge(other)
-        elif event_name == 'Rename':
-            channel = self._registry.get_by_name(event['Channel'])
-            self._registry.remove(channel)
-            channel.set_name(event['Newname'])
+        if self._trace_ami is not None:
+            self._trace_ami(event)
+
+        handler = self._event_handlers.get(event['Event'])
+        if handler is not None:
+            handler(self, event)
+
+    def dump_channels(self):
+        """
+        Serialize the open channels, with everything they are tied to, so
+        another ChannelManager can take over where this one is.
+
+        Returns:
+            bytes: The channels, for load_channels. These are pickled, so
+                only load them from a trusted place.
+        """
+        registry = self._registry
+        # Least recently used first, to evict them in the same order.
+        channels = list(registry._last_used) if registry._last_used is not None else list(registry)
+
+        fp = io.BytesIO()
+        _ChannelPickler(fp, self).dump(channels)
+        return fp.getvalue()
+
+    def load_channels(self, data):
+        """
+        Add the channels serialized by dump_channels to the registry.
+
+        They are tied to this ChannelManager from then on. Channels which
+        may be evicted count as used just now.
+
+        Args:
+            data (bytes): The result of dump_channels.
+
+        Returns:
+            list: The channels which were added.
+        """
+        channels = _ChannelUnpickler(io.BytesIO(data), self).load()
+        for channel in channels:
             self._registry.add(channel)
-        elif event_name in 'Bridge':
-            LocalOneChannel = self._registry.get_by_name(event['LocalOneChannel'])
-            LocalTwoChannel = self._registry.get_by_name(event['LocalTwoChannel'])
-
-            if event['Bridgestate'] == 'Link':
-                LocalOneChannel.do_link(LocalTwoChannel)
-            elif event['Bridgestate'] == 'Unlink':
-                LocalOneChannel.do_unlink(LocalTwoChannel)
-            else:
-                raise ValueError('Unrecognized Bridgestate: %s' % event)
-        elif event_name == 'Masquerade':
-            # A Masquerade destroys the Original and puts the guts of
-            # Clone into it. Afterwards, the Clone channel will be
-            # removed.
-            clone = self._registry.get_by_name(event['Clone'])
-            original = self._registry.get_by_name(event['Original'])
-
-            if event['CloneState'] != event['OriginalState']:
-                # For blonde transfers, the original state is Ring.
-                assert event['OriginalState'] in ('Ring', 'Ringing')
-                assert event['CloneState'] == 'Up', event
-
-                # This is a call pickup?
-                if event['OriginalState'] == 'Ringing':
-                    self._raw_call_pickup(clone, original)
-                    original._state = AST_STATE_UP
-                    self._raw_b_up(original)
-                elif event['OriginalState'] == 'Ring':
-                    # The channel state is changed from Ring to Up, change channel state and call _raw_a_up.
-                    original._state = AST_STATE_UP
-                    self._raw_a_up(original)
-
-            original.do_masquerade(clone)
-        elif event_name == 'Hangup':
-            channel = self._registry.get_by_name(event['Channel'])
-            self._raw_hangup(channel, event)
-
-        elif event_name == 'DialBegin':
-            source = self._registry.get_by_uniqueid(event['UniqueID'])
-            target = self._registry.get_by_uniqueid(event['DestUniqueID'])
-
-            # Verify target is not being dialed already.
-            assert not target.back_dial
-
-            # _fwd_dials is a list of channels being dialed by A.
-            source.fwd_dials.append(target)
-
-            # _back_dial is the channel dialing B.
-            target.back_dial = source
-        elif event_name  == 'DialEnd':
-            # This is cleaned up after Hangup.
-            pass
-
-        elif event_name == 'Transfer':
-            # Both TargetChannel and TargetUniqueid can be used to match
-            # the target channel; they can be used interchangeably.
-            channel = self._registry.get_by_name(event['Channel'])
-            target = self._registry.get_by_name(event['TargetChannel'])
-            assert target == self._registry.get_by_uniqueid(event['TargetUniqueid'])
-
-            if event['TransferType'] == 'Attended':
-                self._raw_attended_transfer(channel, target)
-            elif event['TransferType'] == 'Blind':
-                self._raw_blind_transfer(channel, target, event['TransferExten'])
+        return channels
+
+    # ===================================================================
+    # AMI event handlers
+    # ===================================================================
+
+    def resync(self, channels):
+        """
+        Add the channels which already exist in Asterisk to the registry.
+
+        When we connect to an Asterisk which is busy, we missed the events
+        which created the current channels, so every event for them would
+        be dropped. The CoreShowChannel events sent in response to a
+        CoreShowChannels action describe those channels. The channels
+        are added in bulk, along with their Local channel halves and their
+        bridges. The dials between them can't be recovered, so they are
+        not treated as ringing calls. Channels we already track are left
+        alone.
+
+        Args:
+            channels (list): CoreShowChannel events (Asterisk 11 or 13).
+
+        Returns:
+            list: The channels which were added.
+        """
+        added = []
+        bridges = defaultdict(list)
+
+        for event in channels:
+            uniqueid = event.get('Uniqueid') or event['UniqueID']
+            try:
+                self._registry.get_by_uniqueid(uniqueid)
+            except MissingUniqueid:
+                pass
             else:
-                raise NotImplementedError(event)
-
-        elif event_name == 'AgentCalled':
-            # The Queue app does not create regular dials for calls passing
-            # through it. So essentially, you've got an incoming channel,
-            # a local bridge and a destination channel, but no way to tie the
-            # incoming channel and local bridge together (until the incoming
-            # and destination channels are bridged). This in turn makes
-            # get_dialing_channel() return the back part of the local bridge
-            # (before the masquarade) or just the destination channel. This
-            # makes Cacofonisk call hooks with bogus data.
-            #
-            # The way to remedy this is by tracking the AgentCalled events,
-            # which, similar to the dials, tie the incoming channel and local
-            # bridge together.
-            #
-            # IMPORTANT: This requires the `eventwhencalled` parameter to be
-            # enabled on the Queue, or these events will not be raised (and
-            # you'll get bogus data).
-            source = self._registry.get_by_name(event['Channel'])
-            target = self._registry.get_by_name(event['DestChannel'])
-
-            assert not target.back_dial
-
-            source.fwd_dials.append(target)
-            target.back_dial = source
-
-        elif event_name == 'UserEvent':
-            self.on_user_event(event)
+                continue
+
+            channel = Channel({
+                'Channel': event['Channel'],
+                'Uniqueid': uniqueid,
+                'ChannelState': event['ChannelState'],
+                'Exten': event.get('Exten', event.get('Extension', '')),
+                'AccountCode': event.get('AccountCode', ''),
+                'CallerIDName': event.get('CallerIDName', event.get('CallerIDname', '')),
+                'CallerIDNum': event.get('CallerIDNum', event.get('CallerIDnum', '')),
+            }, channel_manager=self)
+            self._registry.add(channel)
+            added.append(channel)
+
+            # Asterisk 13 names the bridge, Asterisk 11 names the other
+            # channel in it.
+            if event.get('BridgeId'):
+                bridges[event['BridgeId']].append(channel)
+            elif event.get('BridgedUniqueID'):
+                bridges[frozenset((uniqueid, event['BridgedUniqueID']))].append(channel)
+
+        for channel in added:
+            if channel.is_local and channel.name.endswith(';1'):
+                try:
+                    other = self._registry.get_by_name(channel.name[:-1] + '2')
+                except MissingChannel:
+                    continue
+                if other._back_local_bridge is None:
+                    channel.do_localbridge(other)
+
+        for bridged in bridges.values():
+            for i, channel in enumerate(bridged):
+                for other in bridged[i + 1:]:
+                    channel.do_link(other)
+
+        self._trace('resynced {} of {} channels', len(added), len(channels))
+        return added
+
+    def invalidate(self, reason='disconnected', report_hangups=False):
+        """
+        Forget all channels, because their Hangups will never come.
+
+        This is used when the connection to Asterisk is lost: whatever
+        happened while we were away is not sent to us, and resync()
+        adds the channels which still exist after we reconnect. Every
+        channel is passed to on_channel_evicted.
+
+        Args:
+            reason (str): Why the channels are forgotten.
+            report_hangups (bool): Whether to report the calls which were
+                in progress as hung up first, with the reason 'lost'.
+
+        Returns:
+            int: The number of channels which were forgotten.
+        """
+        channels = list(self._registry)
+
+        if report_hangups:
+            for channel in channels:
+                if (channel.is_relevant and channel.is_calling_chan and
+                        not channel.has_flag(FLAG_IGNORE_A_HANGUP)):
+                    self.on_a_hangup(channel.uniqueid, channel.callerid, channel.exten, 'lost')
+
+        for channel in channels:
+            self._evict(channel, reason)
+
+        self._trace('invalidated {} channels', len(channels))
+        return len(channels)
+
+    def evict_stale(self):
+        """
+        Evict the channels which are too old or too many.
+
+        This is done when channels come in or hang up. Call it yourself
+        to evict old channels while no events come in.
+
+        Returns:
+            int: The number of channels which were evicted.
+        """
+        evicted = 0
+        stale, reason = self._registry.get_stale()
+        while stale is not None:
+            self._evict(stale, reason)
+            evicted += 1
+            stale, reason = self._registry.get_stale()
+        return evicted
+
+    @handles('FullyBooted')
+    def _on_fully_booted(self, event):
+        self._trace('Connected to Asterisk')
+
+        if self.PURGE_ON_FULLY_BOOTED:
+            # Time to clear our channels because they are stale.
+            for channel in self._registry:
+                self._evict(channel, 'fully-booted')
+
+    @handles('Newchannel')
+    def _on_newchannel(self, event):
+        channel = Channel(event, channel_manager=self)
+        self._registry.add(channel)
+        self.evict_stale()
+
+    @handles('Newstate')
+    def _on_newstate(self, event):
+        channel = self._registry.get_by_name(event['Channel'])
+        channel.set_state(event)
+
+    @handles('NewCallerid')
+    def _on_new_callerid(self, event):
+        channel = self._registry.get_by_name(event['Channel'])
+        channel.set_callerid(event)
+
+    @handles('NewAccountCode')
+    def _on_new_accountcode(self, event):
+        channel = self._registry.get_by_name(event['Channel'])
+        channel.set_accountcode(event)
+
+    @handles('LocalBridge')
+    def _on_local_bridge(self, event):
+        channel = self._registry.get_by_name(event['LocalOneChannel'])
+        other = self._registry.get_by_name(event['LocalTwoChannel'])
+        channel.do_localbridge(other)
+
+    @handles('Rename')
+    def _on_rename(self, event):
+        channel = self._registry.get_by_name(event['Channel'])
+        self._registry.remove(channel)
+        channel.set_name(event['Newname'])
+        self._registry.add(channel)
+
+    @handles('Bridge')
+    def _on_bridge(self, event):
+        LocalOneChannel = self._registry.get_by_name(event['LocalOneChannel'])
+        LocalTwoChannel = self._registry.get_by_name(event['LocalTwoChannel'])
+
+        if event['Bridgestate'] == 'Link':
+            LocalOneChannel.do_link(LocalTwoChannel)
+        elif event['Bridgestate'] == 'Unlink':
+            LocalOneChannel.do_unlink(LocalTwoChannel)
+        else:
+            raise ValueError('Unrecognized Bridgestate: %s' % event)
+
+    @handles('Masquerade')
+    def _on_masquerade(self, event):
+        # A Masquerade destroys the Original and puts the guts of
+        # Clone into it. Afterwards, the Clone channel will be
+        # removed.
+        clone = self._registry.get_by_name(event['Clone'])
+        original = self._registry.get_by_name(event['Original'])
+
+        if event['CloneState'] != event['OriginalState']:
+            # For blonde transfers, the original state is Ring.
+            assert event['OriginalState'] in ('Ring', 'Ringing')
+            assert event['CloneState'] == 'Up', event
+
+            # This is a call pickup?
+            if event['OriginalState'] == 'Ringing':
+                self._raw_call_pickup(clone, original)
+                original._state = AST_STATE_UP
+                self._raw_b_up(original)
+            elif event['OriginalState'] == 'Ring':
+                # The channel state is changed from Ring to Up, change channel state and call _raw_a_up.
+                original._state = AST_STATE_UP
+                self._raw_a_up(original)
+
+        original.do_masquerade(clone)
+
+    @handles('Hangup')
+    def _on_hangup(self, event):
+        channel = self._registry.get_by_name(event['Channel'])
+        self._raw_hangup(channel, event)
+        self.evict_stale()
+
+    @handles('DialBegin')
+    def _on_dial_begin(self, event):
+        source = self._registry.get_by_uniqueid(event['UniqueID'])
+        target = self._registry.get_by_uniqueid(event['DestUniqueID'])
+        source.do_dial(target)
+
+        # There is no DialEnd handler: the dial is cleaned up after Hangup.
+
+    @handles('Transfer')
+    def _on_transfer(self, event):
+        # Both TargetChannel and TargetUniqueid can be used to match
+        # the target channel; they can be used interchangeably.
+        channel = self._registry.get_by_name(event['Channel'])
+        target = self._registry.get_by_name(event['TargetChannel'])
+        assert target == self._registry.get_by_uniqueid(event['TargetUniqueid'])
+
+        if event['TransferType'] == 'Attended':
+            self._raw_attended_transfer(channel, target)
+        elif event['TransferType'] == 'Blind':
+            self._raw_blind_transfer(channel, target, event['TransferExten'])
         else:
-            pass
+            raise NotImplementedError(event)
+
+    @handles('AgentCalled')
+    def _on_agent_called(self, event):
+        # The Queue app does not create regular dials for calls passing
+        # through it. So essentially, you've got an incoming channel,
+        # a local bridge and a destination channel, but no way to tie the
+        # incoming channel and local bridge together (until the incoming
+        # and destination channels are bridged). This in turn makes
+        # get_dialing_channel() return the back part of the local bridge
+        # (before the masquarade) or just the destination channel. This
+        # makes Cacofonisk call hooks with bogus data.
+        #
+        # The way to remedy this is by tracking the AgentCalled events,
+        # which, similar to the dials, tie the incoming channel and local
+        # bridge together.
+        #
+        # IMPORTANT: This requires the `eventwhencalled` parameter to be
+        # enabled on the Queue, or these events will not be raised (and
+        # you'll get bogus data).
+        source = self._registry.get_by_name(event['Channel'])
+        target = self._registry.get_by_name(event['DestChannel'])
+        source.do_dial(target)
+
+    @handles('UserEvent')
+    def _on_user_event(self, event):
+        self.on_user_event(event)
 
     # ===================================================================
     # Event handler translators
@@ -944,22 +1758,21 @@ class ChannelManager(object):
         channel._side = 'B'
 
         if channel.is_sip:
-            if 'ignore_b_dial' in channel.custom:
+            if channel.pop_flag(FLAG_IGNORE_B_DIAL):
                 # Notifications were already sent for this channel.
                 # Unset the flag and move on.
-                del (channel.custom['ignore_b_dial'])
                 return
 
             a_chan = channel.get_dialing_channel()
             a_chan._side = 'A'
 
-            if 'raw_blind_transfer' in a_chan.custom:
+            redirector_chan = a_chan.pop_raw_blind_transfer()
+
+            if redirector_chan is not None:
                 # This is an interesting exception: we got a Blind
                 # Transfer message earlier and recorded it in this
                 # attribute. We'll translate this b_dial to first a
                 # on_b_dial and then the on_transfer event.
-                redirector_chan = a_chan.custom.pop('raw_blind_transfer')
-
                 redirector = redirector_chan.callerid
                 target_chans = a_chan.get_dialed_channels()
                 targets = [party.callerid for party in target_chans]
@@ -969,7 +1782,7 @@ class ChannelManager(object):
                     # we set a flag on all other channels except for the one
                     # starting to ring right now.
                     if target != channel:
-                        target.custom['ignore_b_dial'] = True
+                        target.set_flag(FLAG_IGNORE_B_DIAL)
 
                 # The dial from the transferree was setup by the transfer app,
                 # so it contains garbage codes like ID12345 as the extension
@@ -1031,17 +1844,20 @@ class ChannelManager(object):
                 # only send an event for the channel with the lowest uniqueid.
                 # if not a_chan.is_up:
                 open_dials = a_chan.get_dialed_channels()
-                targets = [dial.callerid for dial in open_dials]
+                targets = []
 
                 for b_chan in open_dials:
-                    if b_chan == channel:
-                        # Ensure a notification is only sent once.
-                        self.on_b_dial(a_chan.uniqueid, a_chan.callerid, a_chan.exten, targets)
-                    else:
+                    targets.append(b_chan.callerid)
+
+                    if b_chan is not channel:
                         # To prevent notifications from being sent multiple times,
                         # we set a flag on all other channels except for the one
                         # starting to ring right now.
-                        b_chan.custom['ignore_b_dial'] = True
+                        b_chan.set_flag(FLAG_IGNORE_B_DIAL)
+
+                if channel in open_dials:
+                    # Ensure a notification is only sent once.
+                    self.on_b_dial(a_chan.uniqueid, a_chan.callerid, a_chan.exten, targets)
 
     def _raw_attended_transfer(self, channel, target):
         """
@@ -1073,7 +1889,7 @@ class ChannelManager(object):
 
                 # Mark the channel as being transferred so we don't send
                 # hangup notifications for it.
-                channel.custom['ignore_a_hangup'] = True
+                channel.set_flag(FLAG_IGNORE_A_HANGUP)
 
             self.on_warm_transfer(target.uniqueid, old_a_chan.uniqueid,
                                   target.callerid, transferred_channel.callerid, c_chan.callerid)
@@ -1095,11 +1911,11 @@ class ChannelManager(object):
                 # Fortunately, there should only be one open dial left.
                 dialed_channels = channel.get_dialed_channels()
                 assert len(dialed_channels) == 1
-                new_caller = list(dialed_channels)[0]
+                new_caller = dialed_channels[0]
 
                 # Mark the channel as ignored so we don't send another
                 # hangup notification after the transfer.
-                channel.custom['ignore_a_hangup'] = True
+                channel.set_flag(FLAG_IGNORE_A_HANGUP)
             else:
                 # This channel doesn't have sides. Probably garbage data.
                 return
@@ -1121,14 +1937,11 @@ class ChannelManager(object):
             target (Channel): The target channel.
             transfer_exten (str): The phone number being transferred to.
         """
-        if channel.is_called_chan:
-            target.custom['raw_blind_transfer'] = channel
-        else:
-            target.custom['raw_blind_transfer'] = channel
+        target.set_raw_blind_transfer(channel)
 
         # Mark the original channel as ignored, so we don't report a hangup
         # just after the transfer.
-        channel.custom['ignore_a_hangup'] = True
+        channel.set_flag(FLAG_IGNORE_A_HANGUP)
         channel._exten = transfer_exten
 
     def _raw_call_pickup(self, winner, loser):
@@ -1203,15 +2016,15 @@ class ChannelManager(object):
         if channel.is_relevant:
             a_chan = channel.get_dialing_channel()
 
-            if 'raw_blind_transfer' in channel.custom:
+            redirector = channel.pop_raw_blind_transfer()
+
+            if redirector is not None:
                 # Panic! This channel had a blind transfer coming up but it's
                 # being hung up! That probably means the blind transfer target
                 # could not be reached.
                 # Ideally, we would simulate a full blind transfer having been
                 # completed but hanged up with an error. However, no channel
                 # to the third party has been created.
-                redirector = channel.custom.pop('raw_blind_transfer')
-
                 if redirector.is_calling_chan:
                     a_chan = redirector
                     b_chan = channel
@@ -1222,7 +2035,7 @@ class ChannelManager(object):
                 # TODO: Maybe give another status code than 'completed' here?
                 self.on_a_hangup(a_chan.uniqueid, a_chan.callerid, b_chan.callerid.number, 'completed')
 
-            elif 'ignore_a_hangup' in channel.custom:
+            elif channel.has_flag(FLAG_IGNORE_A_HANGUP):
                 # This is a calling channel which performed an attended
                 # transfer. Because the call has already been "hanged up"
                 # with the transfer, we shouldn't send a hangup notification.
@@ -1235,8 +2048,8 @@ class ChannelManager(object):
                 if callee.state != AST_STATE_DOWN:
                     # Depending on who hangs up, we get a different order of events,
                     # Setting these markers ensures only the first hangup is sent.
-                    callee.custom['ignore_a_hangup'] = True
-                    caller.custom['ignore_a_hangup'] = True
+                    callee.set_flag(FLAG_IGNORE_A_HANGUP)
+                    caller.set_flag(FLAG_IGNORE_A_HANGUP)
 
                     self.on_a_hangup(
                         a_chan._fwd_local_bridge.uniqueid,
@@ -1263,7 +2076,19 @@ class ChannelManager(object):
 
         # If we don't have any channels, check whether we're completely clean.
         if not len(self._registry):
-            self._reporter.trace_msg('(no channels left)')
+            self._trace(NO_CHANNELS_LEFT)
+
+    def _evict(self, channel, reason):
+        """
+        Forget a channel without having seen its Hangup.
+
+        Args:
+            channel (Channel): The channel to forget.
+            reason (str): Why the channel is evicted.
+        """
+        channel.do_evict()
+        self._registry.remove(channel)
+        self.on_channel_evicted(channel.uniqueid, channel.name, reason)
 
     def _hangup_reason(self, channel, event):
         """
@@ -1321,7 +2146,7 @@ class ChannelManager(object):
             to_number (str): The number which was dialed by the user.
             targets (list): A list of recipients of the call.
         """
-        self._reporter.trace_msg('{} ringing: {} --> {} ({})'.format(call_id, caller, to_number, targets))
+        self._trace('{} ringing: {} --> {} ({})', call_id, caller, to_number, targets)
         self._reporter.on_b_dial(call_id, caller, to_number, targets)
 
     def on_warm_transfer(self, call_id, merged_id, redirector, caller, destination):
@@ -1343,8 +2168,8 @@ class ChannelManager(object):
             destination (CallerId): The caller ID of the party which received the
                 transfer.
         """
-        self._reporter.trace_msg(
-            '{} <== {} attn xfer: {} <--> {} (through {})'.format(call_id, merged_id, caller, destination, redirector),
+        self._trace(
+            '{} <== {} attn xfer: {} <--> {} (through {})', call_id, merged_id, caller, destination, redirector,
         )
         self._reporter.on_warm_transfer(call_id, merged_id, redirector, caller, destination)
 
@@ -1377,8 +2202,8 @@ class ChannelManager(object):
             targets (list): A list of CallerId objects whose phones are
                 ringing for this transfer.
         """
-        self._reporter.trace_msg(
-            '{} <== {} bld xfer: {} <--> {} (through {})'.format(call_id, merged_id, caller, targets, redirector),
+        self._trace(
+            '{} <== {} bld xfer: {} <--> {} (through {})', call_id, merged_id, caller, targets, redirector,
         )
         self._reporter.on_cold_transfer(call_id, merged_id, redirector, caller, to_number, targets)
 
@@ -1392,7 +2217,7 @@ class ChannelManager(object):
         Args:
             event (Message): Dict-like object with all attributes in the event.
         """
-        self._reporter.trace_msg('user_event: {}'.format(event))
+        self._trace('user_event: {}', event)
         self._reporter.on_user_event(event)
 
     def on_up(self, call_id, caller, to_number, callee):
@@ -1409,7 +2234,7 @@ class ChannelManager(object):
             to_number (str): The number which was dialed by the user.
             callee (CallerId): The recipient of the call.
         """
-        self._reporter.trace_msg('{} up: {} --> {} ({})'.format(call_id, caller, to_number, callee))
+        self._trace('{} up: {} --> {} ({})', call_id, caller, to_number, callee)
         self._reporter.on_up(call_id, caller, to_number, callee)
 
     def on_a_hangup(self, call_id, caller, to_number, reason):
@@ -1426,13 +2251,25 @@ class ChannelManager(object):
             caller (CallerId): The initiator of the call.
             to_number (str): The number which was dialed by the user.
             reason (str): Why the call ended (completed, no-answer, busy,
-                failed, answered-elsewhere).
+                failed, answered-elsewhere, lost).
         """
-        self._reporter.trace_msg(
-            '{} hangup: {} --> {} (reason: {})'.format(call_id, caller, to_number, reason)
+        self._trace(
+            '{} hangup: {} --> {} (reason: {})', call_id, caller, to_number, reason
         )
         self._reporter.on_hangup(call_id, caller, to_number, reason)
 
+    def on_channel_evicted(self, uniqueid, name, reason):
+        """Gets invoked when a channel is forgotten without a Hangup.
+
+        Args:
+            uniqueid (str): The unique ID of the channel.
+            name (str): The name of the channel.
+            reason (str): Why the channel was evicted (max-age, max-size,
+                fully-booted, disconnected).
+        """
+        self._trace('{} evicted: {} (reason: {})', uniqueid, name, reason)
+        self._reporter.on_channel_evicted(uniqueid, name, reason)
+
 
 class DebugChannelManager(ChannelManager):
     """
@@ -1441,4 +2278,4 @@ class DebugChannelManager(ChannelManager):
     dropping all events that are deemed 'not interesting'. This is usefull for
     creating debug logs.
     """
-    INTERESTING_EVENTS = ('*',)
+    INTERESTING_EVENTS = frozenset(('*',))
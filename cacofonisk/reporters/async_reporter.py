@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import logging
+
+from .base_reporter import BaseReporter
+from .recording_reporter import RecordingReporter
+from .threaded_reporter import CALL_HOOKS
+
+
+class AsyncBaseReporter(BaseReporter):
+    """
+    AsyncBaseReporter is the baseclass for reporters whose hooks are
+    coroutines, so they can do I/O without blocking the event loop.
+
+    Override on_b_dial, on_up, on_warm_transfer, on_cold_transfer,
+    on_hangup and on_user_event with coroutine functions (``async def``
+    or ``@asyncio.coroutine``). The AmiRunner runs them as tasks on its
+    event loop, at most max_tasks at a time. A hook must be a coroutine
+    function itself: the calls which wait for a task to finish are kept
+    as arguments, and the coroutine is only created when it can run.
+    Other hooks, and hooks which aren't coroutine functions, are called
+    as usual, and what they return is ignored.
+
+    The hooks of one call (with the same call_id) run one after the
+    other, in the order they were called; the hooks of different calls
+    run at the same time.
+
+    Usage::
+
+        class WebhookReporter(AsyncBaseReporter):
+            async def on_hangup(self, call_id, caller, to_number, reason):
+                async with self.session.post(URL, json={'call_id': call_id, 'reason': reason}) as response:
+                    response.raise_for_status()
+
+        runner = AmiRunner(amihosts, WebhookReporter(), max_tasks=50)
+    """
+
+
+class TaskReporter(RecordingReporter):
+    """
+    Reporter that calls the coroutine hooks of an AsyncBaseReporter and
+    runs them as tasks on an event loop.
+
+    When max_tasks tasks are running, the next calls wait in order until
+    a task is done, and only then is their coroutine created. A call of
+    a call_id which has a task running or waiting is held until that
+    task is done, so the tasks of one call never overlap. At most
+    max_waiting calls wait or are held; the calls after that are
+    dropped, counted and logged. A task which raises is logged and
+    counted.
+    """
+    def __init__(self, reporter, loop=None, max_tasks=100, max_waiting=10000):
+        """
+        Args:
+            reporter (AsyncBaseReporter): The reporter to call.
+            loop (AbstractEventLoop): The event loop to run the tasks on.
+            max_tasks (int): The number of tasks to run at a time.
+            max_waiting (int): The number of calls which may wait for a
+                task to finish, or None for no limit.
+        """
+        super().__init__(RecordingReporter.for_reporter(reporter).hooks)
+        if max_tasks < 1:
+            raise ValueError('The number of tasks must be positive, not {!r}'.format(max_tasks))
+        if max_waiting is not None and max_waiting < 0:
+            raise ValueError('The number of waiting calls can not be negative, not {!r}'.format(max_waiting))
+
+        self.reporter = reporter
+        self.loop = loop or asyncio.get_event_loop()
+        self.max_tasks = max_tasks
+        self.max_waiting = max_waiting
+        self.logger = logging.getLogger(__name__)
+
+        # The hooks which are run as tasks.
+        self._coroutine_hooks = frozenset(
+            hook for hook in self.hooks if asyncio.iscoroutinefunction(getattr(reporter, hook)))
+
+        self.running = 0
+        self.high_water = 0
+        self.completed = 0
+        self.errors = 0
+        self.dropped = 0
+
+        # The calls which can start when a task is done, as (call_id,
+        # hook, args), and per call_id with a task running or waiting,
+        # the calls held until it is done.
+        self._waiting = collections.deque()
+        self._held = {}
+        self._held_count = 0
+        self._dropping = False
+        self._idle = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of running tasks and waiting calls, the
+                limits and the counters.
+        """
+        return {
+            'running': self.running,
+            'waiting': len(self._waiting) + self._held_count,
+            'max_tasks': self.max_tasks,
+            'max_waiting': self.max_waiting,
+            'high_water': self.high_water,
+            'completed': self.completed,
+            'errors': self.errors,
+            'dropped': self.dropped,
+        }
+
+    def _record(self, hook, *args):
+        if hook not in self.hooks:
+            return
+
+        if hook not in self._coroutine_hooks:
+            getattr(self.reporter, hook)(*args)
+            return
+
+        call_id = args[0] if hook in CALL_HOOKS else None
+        waiting = len(self._waiting) + self._held_count
+        if self.running >= self.max_tasks or call_id in self._held:
+            if self.max_waiting is not None and waiting >= self.max_waiting:
+                self.dropped += 1
+                if not self._dropping:
+                    # Log once, until the waiting calls have caught up.
+                    self._dropping = True
+                    self.logger.warning(
+                        '%d reporter calls are waiting, dropping %s and the next calls', waiting, hook)
+                return
+
+            if call_id in self._held:
+                # Wait for the task of the same call.
+                self._held[call_id].append((hook, args))
+                self._held_count += 1
+                return
+
+        if call_id is not None:
+            self._held[call_id] = collections.deque()
+        if self.running < self.max_tasks:
+            self._start(call_id, hook, args)
+        else:
+            self._waiting.append((call_id, hook, args))
+
+    def _start(self, call_id, hook, args):
+        self.running += 1
+        waiting = len(self._waiting) + self._held_count
+        if self.running + waiting > self.high_water:
+            self.high_water = self.running + waiting
+        task = asyncio.ensure_future(getattr(self.reporter, hook)(*args), loop=self.loop)
+        task.add_done_callback(lambda task: self._on_done(call_id, hook, task))
+
+    def _on_done(self, call_id, hook, task):
+        self.running -= 1
+        self.completed += 1
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+            self.logger.error('Reporter failed on %s', hook, exc_info=task.exception())
+
+        if call_id is not None:
+            held = self._held[call_id]
+            if held:
+                # The next call of the same call gets in line.
+                self._waiting.append((call_id,) + held.popleft())
+                self._held_count -= 1
+            else:
+                del self._held[call_id]
+
+        if self._waiting:
+            self._start(*self._waiting.popleft())
+            if not self._waiting and not self._held_count:
+                self._dropping = False
+        elif not self.running and self._idle is not None:
+            idle, self._idle = self._idle, None
+            idle.set_result(None)
+
+    def drain(self):
+        """
+        Wait for the running and waiting tasks.
+
+        Returns:
+            Future: Done when no tasks are left.
+        """
+        if self._idle is None:
+            self._idle = asyncio.Future(loop=self.loop)
+        if not self.running and not self._waiting and not self._held_count:
+            idle, self._idle = self._idle, None
+            idle.set_result(None)
+            return idle
+        return self._idle
+
+    def close(self):
+        """
+        Close the reporter. Run drain first to wait for the tasks.
+        """
+        self.reporter.close()
+
+
+def schedule_reporter(reporter, loop, max_tasks, max_waiting=10000):
+    """
+    Wrap a reporter in a TaskReporter if it is an AsyncBaseReporter.
+
+    Args:
+        reporter (Reporter): Any reporter.
+        loop (AbstractEventLoop): The event loop to run the tasks on.
+        max_tasks (int): The number of tasks to run at a time.
+        max_waiting (int): The number of calls which may wait for a task
+            to finish, or None for no limit.
+
+    Returns:
+        Reporter: The TaskReporter, or the reporter itself.
+    """
+    if isinstance(reporter, AsyncBaseReporter):
+        return TaskReporter(reporter, loop, max_tasks, max_waiting)
+    return reporter
@@ -20,6 +20,35 @@ class BaseReporter(object):
         """
         pass
 
+    @property
+    def wants_trace_msg(self):
+        """Whether trace_msg should be called at all.
+
+        The ChannelManager checks this once. If it is False, no trace
+        messages are formatted or passed on. By default it is True when
+        trace_msg has been overridden. Set it as a class attribute to
+        override that.
+
+        Returns:
+            bool: True if trace messages should be passed to trace_msg.
+        """
+        return self.overrides('trace_msg')
+
+    def overrides(self, hook):
+        """Whether a hook does something other than the no-op of BaseReporter.
+
+        The ChannelManager checks this once for the hooks which are called
+        for every event, and skips them if they aren't overridden.
+
+        Args:
+            hook (str): The name of the hook, like 'on_event'.
+
+        Returns:
+            bool: True if the hook has been overridden.
+        """
+        method = getattr(self, hook)
+        return getattr(method, '__func__', None) is not getattr(BaseReporter, hook)
+
     def close(self):
         """Called on end, so any buffered output can be flushed."""
         pass
@@ -141,3 +170,18 @@ class BaseReporter(object):
             reason (str): A textual reason as to why the call was ended.
         """
         pass
+
+    def on_channel_evicted(self, uniqueid, name, reason):
+        """
+        Track when a channel is forgotten without having seen its hangup.
+
+        This only happens when the ChannelManager is configured to evict
+        stale channels. No hangup is reported for the channel.
+
+        Args:
+            uniqueid (str): The unique ID of the channel.
+            name (str): The name of the channel.
+            reason (str): Why the channel was evicted (max-age, max-size,
+                fully-booted, disconnected).
+        """
+        pass
@@ -1,6 +1,8 @@
 import json
 import sys
+import time
 
+from ..runners.capture import ARRIVAL_KEY, create_capture
 from .base_reporter import BaseReporter
 
 
@@ -9,11 +11,41 @@ class JsonReporter(BaseReporter):
     Reporter that writes (overwrites!) all received AMI events to the file
     specified at path.
 
+    A path ending in .gz, .bz2 or .xz is compressed accordingly, and the
+    FileRunner decompresses it again when replaying.
+
+    With timestamps, every event gets the time it was received, under
+    'Received', so the FileRunner can replay the capture at its original
+    pace. That is the time trace_ami is called, so capture with the
+    events handled as they are read (no queue, no ThreadedReporter), or
+    the pace is that of the handling. An event which already has a
+    'Received' time keeps it.
+
+    With flush, every event is written out right away, so a FileRunner
+    can follow the capture while it is written.
+
     Usage:
         reporter = JsonReporter('path/to/file.json')
+        reporter = JsonReporter('path/to/file.json.gz')
+        reporter = JsonReporter('path/to/file.json', timestamps=True)
     """
-    def __init__(self, path='test.json', *args, **kwargs):
+    def __init__(self, path='test.json', *args, compression=None, timestamps=False, clock=time.time,
+                 flush=False, **kwargs):
+        """
+        Args:
+            path (str): The file to write the events to.
+            compression (str): 'gzip', 'bz2', 'xz' or '' for none. By
+                default it follows from the extension of path.
+            timestamps (bool): Whether to add the time each event was
+                received.
+            clock (callable): Returns the current time in seconds.
+            flush (bool): Whether to flush the file after every event.
+        """
         self.path = path
+        self.compression = compression
+        self.timestamps = timestamps
+        self.clock = clock
+        self.flush_events = flush
 
     def trace_ami(self, event):
         """
@@ -22,15 +54,27 @@ class JsonReporter(BaseReporter):
         the form of one dictionary per event.
         """
         if not hasattr(self, '_trace_ami_fp'):
-            self._trace_ami_fp = open(self.path, 'w')
+            self._trace_ami_fp = create_capture(self.path, self.compression)
             self._trace_ami_fp.write('[')
             self._trace_ami_count = 0
+        event = dict(event)
+        if self.timestamps and ARRIVAL_KEY not in event:
+            event[ARRIVAL_KEY] = self.clock()
         comma = ',' if self._trace_ami_count else ''
         self._trace_ami_fp.write('{}\n  {}'.format(
-            comma, json.dumps(dict(event))))
+            comma, json.dumps(event)))
+        if self.flush_events:
+            self._trace_ami_fp.flush()
         self._trace_ami_count += 1
         sys.stderr.write('{} written\r'.format(self._trace_ami_count))
 
+    def flush(self):
+        """
+        Write the events written so far out to the file.
+        """
+        if hasattr(self, '_trace_ami_fp'):
+            self._trace_ami_fp.flush()
+
     def close(self):
         """
         Close the file at ``self.path`` by writing a closing bracket ']' tothe
@@ -40,6 +84,6 @@ class JsonReporter(BaseReporter):
             self._trace_ami_fp.write('\n]\n')
             self._trace_ami_fp.close()
             print('Wrote {} AMI events to: {}'.format(
-                self._trace_ami_count, self._trace_ami_fp.name))
+                self._trace_ami_count, self.path))
             del self._trace_ami_count
             del self._trace_ami_fp
@@ -0,0 +1,110 @@
+from .base_reporter import BaseReporter
+
+# The hooks which the ChannelManager calls on its reporter.
+HOOKS = (
+    'trace_ami',
+    'trace_msg',
+    'on_event',
+    'on_b_dial',
+    'on_up',
+    'on_hangup',
+    'on_warm_transfer',
+    'on_cold_transfer',
+    'on_user_event',
+    'on_channel_evicted',
+)
+
+
+class RecordingReporter(BaseReporter):
+    """
+    Reporter that records the hook calls, to replay them on another
+    reporter later, possibly in another process.
+
+    Usage:
+        recorder = RecordingReporter.for_reporter(reporter)
+        ...
+        recorder.replay(reporter)
+    """
+    def __init__(self, hooks=HOOKS):
+        """
+        Args:
+            hooks (iterable): The names of the hooks to record. The others
+                are the no-ops of BaseReporter, so the ChannelManager
+                skips them like it would for the reporter they are
+                replayed on.
+        """
+        self.hooks = frozenset(hooks)
+        self.calls = []
+
+    @classmethod
+    def for_reporter(cls, reporter):
+        """
+        Create a RecordingReporter which records the hooks a reporter
+        wants.
+
+        Args:
+            reporter (Reporter): The reporter the calls will be replayed on.
+
+        Returns:
+            RecordingReporter: A new recorder.
+        """
+        overrides = getattr(reporter, 'overrides', None)
+        hooks = [
+            hook for hook in HOOKS
+            if hook != 'trace_msg' and (overrides is None or overrides(hook))
+        ]
+        if getattr(reporter, 'wants_trace_msg', True):
+            hooks.append('trace_msg')
+
+        return cls(hooks)
+
+    @property
+    def wants_trace_msg(self):
+        return 'trace_msg' in self.hooks
+
+    def overrides(self, hook):
+        return hook in self.hooks
+
+    def replay(self, reporter):
+        """
+        Call the recorded hooks on a reporter, in order.
+
+        Args:
+            reporter (Reporter): The reporter to pass the calls to.
+        """
+        for hook, args in self.calls:
+            getattr(reporter, hook)(*args)
+
+    def _record(self, hook, *args):
+        if hook in self.hooks:
+            self.calls.append((hook, args))
+
+    def trace_ami(self, event):
+        self._record('trace_ami', event)
+
+    def trace_msg(self, msg):
+        self._record('trace_msg', msg)
+
+    def on_event(self, event):
+        self._record('on_event', event)
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        self._record('on_b_dial', call_id, caller, to_number, targets)
+
+    def on_up(self, call_id, caller, to_number, callee):
+        self._record('on_up', call_id, caller, to_number, callee)
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        self._record('on_hangup', call_id, caller, to_number, reason)
+
+    def on_warm_transfer(self, call_id, merged_id, redirector, caller, destination):
+        self._record('on_warm_transfer', call_id, merged_id, redirector, caller, destination)
+
+    def on_cold_transfer(self, call_id, merged_id, redirector, caller, to_number, targets):
+        self._record('on_cold_transfer', call_id, merged_id, redirector, caller, to_number, targets)
+
+    def on_user_event(self, event):
+        self._record('on_user_event', event)
+
+    def on_channel_evicted(self, uniqueid, name, reason):
+        self._record('on_channel_evicted', uniqueid, name, reason)
@@ -0,0 +1,229 @@
+import collections
+import logging
+import queue
+import threading
+
+from ..runners.ingress import BLOCK, DROP
+from .recording_reporter import RecordingReporter
+
+# The hooks which get a call_id as their first argument.
+CALL_HOOKS = frozenset((
+    'on_b_dial',
+    'on_up',
+    'on_hangup',
+    'on_warm_transfer',
+    'on_cold_transfer',
+))
+
+# The hooks which merge the call of their second argument (merged_id)
+# into the call of their first.
+TRANSFER_HOOKS = frozenset((
+    'on_warm_transfer',
+    'on_cold_transfer',
+))
+
+# Internal calls which hold up a thread until another thread got to the
+# same point in its queue.
+_SIGNAL = object()
+_WAIT = object()
+
+
+class ThreadedReporter(RecordingReporter):
+    """
+    Reporter that passes the hook calls to another reporter on a pool of
+    threads, so a reporter which blocks (on HTTP or a database) doesn't
+    hold up the processing of events.
+
+    Every thread has its own bounded queue. The calls of one call go to
+    the same thread, chosen by the hash of the call_id, so they are made
+    in order, while the calls of different calls are made in parallel.
+    The hooks without a call_id (trace_ami, trace_msg, on_event,
+    on_user_event and on_channel_evicted) all go to the first thread, in
+    order. A transfer goes to the thread of its call_id, but waits until
+    the calls of its merged_id which were queued before it are made, and
+    the later calls of the merged_id go to the same thread, after it.
+
+    The hooks are called on the thread which handles the events, such as
+    the event loop of the AmiRunner, so they don't wait: with the 'drop'
+    overflow policy, a call for a thread whose queue is full is dropped,
+    counted and logged. With 'block', the hook waits until there is room,
+    so the events are not read faster than the reporter can keep up
+    with; use that for replays (FileRunner), not on an event loop.
+    Closing the reporter waits for the queued calls to be made, and then
+    closes the wrapped reporter.
+
+    Usage:
+        reporter = ThreadedReporter(MyReporter(), threads=8)
+        runner = AmiRunner(amihosts, reporter)
+    """
+    # The number of merged calls to remember the thread of.
+    MAX_ROUTES = 10000
+
+    def __init__(self, reporter, threads=4, maxsize=1000, overflow=DROP):
+        """
+        Args:
+            reporter (Reporter): The reporter to pass the calls to. Its
+                hooks must be safe to call from several threads at once.
+            threads (int): The number of threads.
+            maxsize (int): The number of calls to queue per thread.
+            overflow (str): What to do with a call when the queue of its
+                thread is full: 'drop' it or 'block' until there is room.
+        """
+        super().__init__(RecordingReporter.for_reporter(reporter).hooks)
+        if threads < 1:
+            raise ValueError('The number of threads must be positive, not {!r}'.format(threads))
+        if overflow not in (BLOCK, DROP):
+            raise ValueError('Unknown overflow policy {!r}, expected block or drop'.format(overflow))
+
+        self.reporter = reporter
+        self.overflow = overflow
+        self.logger = logging.getLogger(__name__)
+        self.errors = 0
+        self.dropped = 0
+
+        self._errors_lock = threading.Lock()
+        self._closed = False
+        self._dropping = False
+        # The thread of the calls which were merged into another call.
+        self._routes = collections.OrderedDict()
+        self._queues = [queue.Queue(maxsize) for _ in range(threads)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(calls,), name='cacofonisk-reporter-{}'.format(number),
+                             daemon=True)
+            for number, calls in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _record(self, hook, *args):
+        if hook not in self.hooks:
+            return
+        if self._closed:
+            raise RuntimeError('The reporter is closed')
+
+        if hook not in CALL_HOOKS:
+            self._put(0, hook, args)
+            return
+
+        index = self._route(args[0], hook == 'on_hangup')
+        if hook in TRANSFER_HOOKS:
+            merged = self._route(args[1], False)
+            if merged != index:
+                # The transfer waits for the calls of the merged call
+                # which were queued before it.
+                reached = threading.Event()
+                if self._put(merged, _SIGNAL, (reached,)):
+                    self._put(index, _WAIT, (reached,))
+            self._routes[args[1]] = index
+            if len(self._routes) > self.MAX_ROUTES:
+                self._routes.popitem(last=False)
+        self._put(index, hook, args)
+
+    def _route(self, call_id, forget):
+        """
+        Get the thread of a call.
+
+        Args:
+            call_id (str): The call.
+            forget (bool): Whether this is the last call of the call.
+
+        Returns:
+            int: The index of the thread.
+        """
+        index = self._routes.pop(call_id, None) if forget else self._routes.get(call_id)
+        if index is None:
+            index = hash(call_id) % len(self._queues)
+        return index
+
+    def _put(self, index, hook, args):
+        """
+        Queue a call for a thread, or drop it if the queue is full and
+        the policy is 'drop'.
+
+        Returns:
+            bool: False if the call was dropped.
+        """
+        calls = self._queues[index]
+        if self.overflow == BLOCK:
+            calls.put((hook, args))
+            return True
+
+        try:
+            calls.put_nowait((hook, args))
+        except queue.Full:
+            if hook is _SIGNAL or hook is _WAIT:
+                # Then the transfer doesn't wait for the merged call.
+                return False
+
+            self.dropped += 1
+            if not self._dropping:
+                # Log once, until the queues have room again.
+                self._dropping = True
+                self.logger.warning('The queue of reporter thread %d is full, dropping %s and the next calls',
+                                    index, hook)
+            return False
+
+        self._dropping = False
+        return True
+
+    def _work(self, calls):
+        """
+        Make the calls of one queue until the queue is closed.
+
+        Args:
+            calls (Queue): The queue of (hook, args) tuples.
+        """
+        while True:
+            call = calls.get()
+            try:
+                if call is None:
+                    return
+
+                hook, args = call
+                if hook is _SIGNAL:
+                    args[0].set()
+                    continue
+                if hook is _WAIT:
+                    args[0].wait()
+                    continue
+
+                try:
+                    getattr(self.reporter, hook)(*args)
+                except Exception:
+                    self.logger.exception('Reporter failed on %s', hook)
+                    with self._errors_lock:
+                        self.errors += 1
+            finally:
+                calls.task_done()
+
+    def join(self):
+        """
+        Wait until the calls queued so far have been made.
+        """
+        for calls in self._queues:
+            calls.join()
+
+    def flush(self):
+        """
+        Wait until the calls queued so far have been made, and flush the
+        wrapped reporter if it has a flush() method.
+        """
+        self.join()
+        flush = getattr(self.reporter, 'flush', None)
+        if callable(flush):
+            flush()
+
+    def close(self):
+        """
+        Make the queued calls, stop the threads and close the wrapped
+        reporter.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        for calls in self._queues:
+            calls.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.reporter.close()
@@ -0,0 +1,345 @@
+"""
+A lean asyncio client for the Asterisk Manager Interface.
+
+The AmiRunner can use the AmiClient instead of panoramisk's Manager. It
+offers the part of the Manager API the runner uses (register_event,
+send_action, connect and close), and takes the same arguments.
+
+Asterisk sends every event to every client that asked for events, and
+most of them (VarSet, Newexten, RTCP...) are of no interest. The
+AmiProtocol splits the stream into messages in a single buffer, looks
+at the name of every event first, and only decodes and parses the
+events that were registered. Messages which belong to an action are
+always parsed.
+"""
+import asyncio
+import itertools
+import logging
+
+EOL = b'\r\n'
+EOM = b'\r\n\r\n'
+
+# How an event starts, as Asterisk writes it.
+_EVENT_PREFIX = b'Event: '
+
+
+def parse_message(data):
+    """
+    Parse the lines of an AMI message, like panoramisk does: a key
+    which occurs more than once gets a list of values.
+
+    Args:
+        data (str): The lines of the message, without the empty line.
+
+    Returns:
+        dict: The keys and values of the message.
+    """
+    message = {}
+    for line in data.split('\r\n'):
+        key, sep, value = line.partition(': ')
+        if not sep:
+            continue
+        if key in message:
+            values = message[key]
+            if not isinstance(values, list):
+                values = message[key] = [values]
+            values.append(value)
+        else:
+            message[key] = value
+    return message
+
+
+def format_action(action):
+    """
+    Format an action for the wire.
+
+    Args:
+        action (dict): The keys and values of the action.
+
+    Returns:
+        str: The action, including the empty line which ends it.
+    """
+    return ''.join('{}: {}\r\n'.format(key, value) for key, value in action.items()) + '\r\n'
+
+
+class AmiProtocol(asyncio.Protocol):
+    """
+    AmiProtocol splits the data from Asterisk into messages and passes
+    them to its AmiClient.
+    """
+    def __init__(self, client):
+        """
+        Args:
+            client (AmiClient): The client to pass the messages to.
+        """
+        self.client = client
+        self.transport = None
+        self.version = None
+        self._buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client.connection_made(self)
+
+    def connection_lost(self, exc):
+        self.client.connection_lost(self, exc)
+
+    def send(self, action):
+        """
+        Send an action to Asterisk.
+
+        Args:
+            action (dict): The keys and values of the action.
+        """
+        self.transport.write(format_action(action).encode(self.client.encoding))
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf += data
+        start = 0
+
+        if self.version is None:
+            # The banner is a single line: Asterisk Call Manager/2.10.3
+            end = buf.find(EOL)
+            if end == -1:
+                return
+            self.version = buf[:end].decode(self.client.encoding, 'replace').partition('/')[2]
+            start = end + len(EOL)
+
+        events = self.client.events
+        listen_all = self.client.listen_all
+        expect_list = self.client.has_list_actions
+
+        while True:
+            end = buf.find(EOM, start)
+            if end == -1:
+                break
+
+            # Skip the events nobody wants without decoding them. Events
+            # which are part of a list response must be looked at, since
+            # they carry an ActionID.
+            if not listen_all and not expect_list and buf.startswith(_EVENT_PREFIX, start):
+                name_end = buf.find(EOL, start, end)
+                if name_end == -1:
+                    name_end = end
+                if bytes(buf[start + len(_EVENT_PREFIX):name_end]) not in events:
+                    start = end + len(EOM)
+                    continue
+
+            message = parse_message(buf[start:end].decode(self.client.encoding, 'replace').strip())
+            start = end + len(EOM)
+            if message:
+                self.client.handle_message(message)
+                expect_list = self.client.has_list_actions
+
+        del buf[:start]
+
+
+class AmiClient(object):
+    """
+    AmiClient connects to Asterisk, logs in and passes the registered
+    events to their callbacks, like panoramisk's Manager.
+
+    Usage::
+
+        client = AmiClient(loop=loop, host='127.0.0.1', port=5038, username='cacofonisk', secret='secret')
+        client.register_event('Newchannel', on_event)
+        asyncio.ensure_future(client.connect())
+
+    Callbacks are called with the client and the event (a dict). Events
+    are registered by name, or with '*' for all events.
+    """
+    def __init__(self, loop=None, host='127.0.0.1', port=5038, username=None, secret=None, ssl=False,
+                 encoding='utf8', log=None, on_disconnect=None, **kwargs):
+        """
+        Args:
+            loop (AbstractEventLoop): The event loop to connect on.
+            host (str): The Asterisk to connect to.
+            port (int): The AMI port.
+            username (str): The AMI user.
+            secret (str): The password of the AMI user.
+            ssl (bool): Whether to connect with TLS.
+            encoding (str): The encoding of the messages.
+            log (Logger): The logger for connection problems.
+            on_disconnect (callable): Called with the client and the
+                exception when the connection is lost, like panoramisk's
+                on_disconnect. The client does not reconnect by itself.
+            **kwargs: Other Manager arguments, which are ignored.
+        """
+        self.loop = loop or asyncio.get_event_loop()
+        self.host = host
+        self.port = port
+        self.username = username
+        self.secret = secret
+        self.ssl = ssl
+        self.encoding = encoding
+        self.log = log if log is not None else logging.getLogger(__name__)
+        self.on_disconnect = on_disconnect
+
+        self.protocol = None
+        self.authenticated = False
+        self.callbacks = {}
+        self.events = frozenset()
+        self.listen_all = False
+
+        self._action_ids = ('cacofonisk-{}-{}'.format(id(self), number) for number in itertools.count(1))
+        self._pending = {}
+        self._list_actions = 0
+
+    @property
+    def has_list_actions(self):
+        """
+        Returns:
+            bool: Whether responses with lists of events are expected.
+        """
+        return self._list_actions > 0
+
+    def register_event(self, name, callback):
+        """
+        Call callback(client, event) for every event with this name.
+
+        Args:
+            name (str): The name of the event, or '*' for all events.
+            callback (callable): The function to call.
+        """
+        self.callbacks.setdefault(name, []).append(callback)
+        self.listen_all = '*' in self.callbacks
+        self.events = frozenset(name.encode(self.encoding) for name in self.callbacks)
+
+    def connect(self):
+        """
+        Connect to Asterisk and log in.
+
+        Returns:
+            Future: Done when connected, with the protocol. The login
+                follows.
+        """
+        future = asyncio.ensure_future(self.loop.create_connection(
+            lambda: AmiProtocol(self), self.host, self.port, ssl=self.ssl or None), loop=self.loop)
+        future.add_done_callback(self._on_connected)
+        return future
+
+    def _on_connected(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.log.error('Could not connect to %s:%s: %r', self.host, self.port, future.exception())
+
+    def connection_made(self, protocol):
+        self.protocol = protocol
+        login = self.send_action({
+            'Action': 'Login',
+            'Username': self.username,
+            'Secret': self.secret,
+            'Events': 'on',
+        })
+        login.add_done_callback(self._on_login)
+
+    def _on_login(self, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None or future.result().get('Response') != 'Success':
+            self.log.error('Could not log in to %s:%s: %r', self.host, self.port,
+                           future.exception() or future.result())
+            self.close()
+            return
+        self.authenticated = True
+
+    def connection_lost(self, protocol, exc):
+        if protocol is not self.protocol:
+            return
+        self.protocol = None
+        self.authenticated = False
+        self._fail_pending(ConnectionError('Lost the connection to {}:{}'.format(self.host, self.port)))
+        if self.on_disconnect is not None:
+            self.loop.call_soon(self.on_disconnect, self, exc)
+
+    def close(self):
+        """
+        Disconnect from Asterisk. Actions which are waiting for a response
+        are cancelled.
+        """
+        protocol, self.protocol = self.protocol, None
+        self.authenticated = False
+        for action_id in list(self._pending):
+            self._pop_pending(action_id)[0].cancel()
+        if protocol is not None:
+            protocol.transport.close()
+
+    def send_action(self, action, as_list=False):
+        """
+        Send an action to Asterisk.
+
+        Args:
+            action (dict): The keys and values of the action. An ActionID
+                is added.
+            as_list (bool): Whether the response is a list of events,
+                ended by an event with 'EventList: Complete'.
+
+        Returns:
+            Future: The response (a dict), or with as_list, all messages
+                of the response (a list). A response which is not a list
+                (like an error) is the result as is.
+        """
+        future = asyncio.Future(loop=self.loop)
+        if self.protocol is None:
+            future.set_exception(ConnectionError('Not connected to {}:{}'.format(self.host, self.port)))
+            return future
+
+        action = dict(action)
+        action_id = action.setdefault('ActionID', next(self._action_ids))
+        self._pending[action_id] = (future, [] if as_list else None)
+        if as_list:
+            self._list_actions += 1
+
+        self.protocol.send(action)
+        return future
+
+    def _pop_pending(self, action_id):
+        pending = self._pending.pop(action_id)
+        if pending[1] is not None:
+            self._list_actions -= 1
+        return pending
+
+    def _fail_pending(self, exc):
+        for action_id in list(self._pending):
+            future = self._pop_pending(action_id)[0]
+            if not future.done():
+                future.set_exception(exc)
+
+    def handle_message(self, message):
+        """
+        Pass a message to the action it belongs to, or to the callbacks.
+
+        Args:
+            message (dict): The keys and values of the message.
+        """
+        action_id = message.get('ActionID')
+        pending = self._pending.get(action_id) if action_id is not None else None
+
+        if pending is not None:
+            future, messages = pending
+            if messages is None:
+                self._pop_pending(action_id)
+                if not future.done():
+                    future.set_result(message)
+                return
+
+            messages.append(message)
+            if len(messages) == 1 and 'EventList' not in message:
+                # An error, or a response without a list.
+                self._pop_pending(action_id)
+                if not future.done():
+                    future.set_result(message)
+            elif message.get('EventList', '').lower() == 'complete':
+                self._pop_pending(action_id)
+                if not future.done():
+                    future.set_result(messages)
+            return
+
+        name = message.get('Event')
+        if name is None:
+            return
+
+        for callback in self.callbacks.get(name, ()):
+            callback(self, message)
+        for callback in self.callbacks.get('*', ()):
+            callback(self, message)
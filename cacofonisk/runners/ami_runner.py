@@ -1,28 +1,196 @@
 import asyncio
 import logging
+import random
 import signal
 import sys
+from functools import lru_cache, partial
 
 from panoramisk import Manager
 
 from ..channel import ChannelManager
+from ..reporters.async_reporter import schedule_reporter
+from .ingress import BLOCK, IngressQueue
+from .supervisor import Supervisor
+
+
+def event_filter(event_names):
+    """
+    Build the regular expression of an AMI Filter which lets only the
+    named events through.
+
+    Asterisk matches a filter against the text of the event, which
+    starts with the Event line, with POSIX extended regular expressions.
+
+    Args:
+        event_names (iterable): The names of the events, as in
+            INTERESTING_EVENTS.
+
+    Returns:
+        str: The filter, or None if all events are wanted ('*').
+    """
+    if '*' in event_names:
+        return None
+    return '^Event: ({})[[:space:]]'.format('|'.join(sorted(event_names)))
+
+
+class RunnerManagerMixin(object):
+    """
+    Leaves the reconnects of panoramisk's Manager to the AmiRunner.
+
+    Like AmiClient, the manager doesn't reconnect by itself when the
+    connection is lost or a connect fails, and the actions which were
+    waiting for a response fail with a ConnectionError, instead of being
+    sent again when the next connection is FullyBooted: the runner adds
+    its Filter and asks for the channels again itself.
+    """
+    def connection_made(self, f):
+        if f.cancelled() or f.exception() is not None:
+            # AmiRunner.on_connect tries again.
+            return
+        super().connection_made(f)
+
+    def connection_lost(self, exc):
+        self._connected = False
+        self.log.error('Connection lost')
+        self.loop.call_soon(self.on_disconnect, self, exc)
+        if self.pinger:
+            self.pinger.cancel()
+            self.pinger = None
+
+        while self.awaiting_actions:
+            action = self.awaiting_actions.popleft()
+            if not action.future.done():
+                action.future.set_exception(ConnectionError('Lost the connection'))
+
+
+@lru_cache(maxsize=None)
+def runner_manager_class(manager_class):
+    """
+    Get the manager_class with RunnerManagerMixin, if it is panoramisk's
+    Manager (or a subclass of it) without it.
+
+    Args:
+        manager_class (type): The AMI client class.
+
+    Returns:
+        type: The AMI client class for AmiRunner.
+    """
+    if not issubclass(manager_class, Manager) or issubclass(manager_class, RunnerManagerMixin):
+        return manager_class
+    return type(manager_class.__name__, (RunnerManagerMixin, manager_class), {})
 
 
 class AmiRunner(object):
     """
     A Runner which reads Asterisk AMI events and passes them to a
     ChannelManager instance.
+
+    By default the events are handled in the callback of the AMI client,
+    so a slow reporter holds up reading from Asterisk. With a queue_size,
+    the events are put in an IngressQueue and handled from the event
+    loop, in batches. The overflow policy of the queue decides what
+    happens when it is full; see cacofonisk.runners.ingress. The queue
+    and its counters are in the queue attribute.
+
+    With processes, the hosts are spread over worker processes, which
+    are restarted when they exit; see cacofonisk.runners.supervisor.
+
+    With filter_events, the runner adds an AMI Filter for the
+    INTERESTING_EVENTS of the ChannelManager when Asterisk says it is
+    FullyBooted (right after the login), so Asterisk doesn't send the
+    other events at all. The AMI user needs the system write permission
+    for this; without it, the events are still filtered in the client.
+
+    An AsyncBaseReporter is wrapped in a TaskReporter, which runs its
+    coroutine hooks as tasks on the event loop, at most max_tasks at a
+    time, with at most max_waiting calls waiting for them. The
+    TaskReporter is the reporter attribute then; its stats() has the
+    counters.
+
+    When the connection to a host is lost, the channels of its
+    ChannelManager are invalidated (with report_lost, the calls which
+    were in progress are reported as hung up with the reason 'lost'),
+    and the runner reconnects after a delay, after which the channels
+    which still exist are resynced. See reconnect_delay.
+
+    With a ChannelManager which has a MAX_CHANNEL_AGE, the old channels
+    are evicted every EVICT_INTERVAL seconds, also when no events come in.
     """
-    def __init__(self, amihosts, reporter, channel_manager=ChannelManager, logger=None):
+    # The number of queued events to handle before giving the event loop
+    # a chance to read more.
+    BATCH_SIZE = 100
+
+    # The delay before reconnecting to a host, which doubles with every
+    # attempt up to MAX_RECONNECT_DELAY, until the host is FullyBooted.
+    RECONNECT_DELAY = 1.0
+    MAX_RECONNECT_DELAY = 60.0
+
+    # How often to evict the channels older than MAX_CHANNEL_AGE.
+    EVICT_INTERVAL = 10.0
+
+    def __init__(self, amihosts, reporter, channel_manager=ChannelManager, logger=None, resync=True,
+                 manager_class=Manager, queue_size=None, overflow=BLOCK, spill_dir=None, processes=1,
+                 reporter_factory=None, filter_events=True, max_tasks=100, report_lost=False,
+                 max_waiting=10000, max_spill=1000000):
         """
         Args:
             amihosts [dict]: A list of dictionaries.
+            resync (bool): Whether to add the channels which already exist
+                to the ChannelManager after (re)connecting.
+            manager_class: The AMI client, panoramisk's Manager or the
+                leaner cacofonisk.runners.ami_client.AmiClient, which
+                skips the events we don't handle before parsing them.
+                panoramisk's Manager gets the RunnerManagerMixin.
+            queue_size (int): The number of events to queue before the
+                overflow policy applies, or None to handle the events
+                as they come in.
+            overflow (str): What to do when the queue is full: 'block'
+                (stop reading from Asterisk), 'drop' (drop the events
+                which are only traced and the DROPPABLE_EVENTS of the
+                channel manager, and stop reading when the others
+                overflow the queue) or 'spill' (queue on disk).
+            spill_dir (str): The directory for the spill file.
+            max_spill (int): The number of events to spill, after which
+                reading stops until the queue is half empty.
+            processes (int): The number of worker processes to run the
+                hosts in, None for a process per host, or 1 to run them
+                in this process.
+            reporter_factory (callable): With processes, called in every
+                worker to create a reporter of its own. If None, the
+                reporter calls of the workers are sent to this process
+                and passed to reporter.
+            filter_events (bool): Whether to ask Asterisk to only send
+                the INTERESTING_EVENTS.
+            max_tasks (int): The number of coroutine hooks of an
+                AsyncBaseReporter to run at a time.
+            max_waiting (int): The number of coroutine hook calls which
+                may wait for a task to finish, after which they are
+                dropped, or None for no limit.
+            report_lost (bool): Whether to report the calls which were in
+                progress when the connection to their host was lost as
+                hung up, with the reason 'lost'.
         """
         self.amihosts = amihosts
-        self.reporter = reporter
         self.channel_manager = channel_manager
+        self.resync = resync
+        self.manager_class = manager_class
+        self.filter_events = filter_events
+        self.report_lost = report_lost
         self.loop = asyncio.get_event_loop()
         self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.max_tasks = max_tasks
+        self.max_waiting = max_waiting
+        self.reporter = schedule_reporter(reporter, self.loop, max_tasks, max_waiting)
+
+        self.queue = None if queue_size is None else IngressQueue(queue_size, overflow, spill_dir, max_spill)
+        self._draining = False
+        self._paused = False
+
+        self.processes = processes
+        self.reporter_factory = reporter_factory
+        self.supervisor = None
+        self._closing = False
+        self._evict_handle = None
 
     def attach_all(self):
         """
@@ -32,10 +200,20 @@ class AmiRunner(object):
         assert not hasattr(self, 'amimgrs')
         assert not hasattr(self, 'channel_managers')
         self.amimgrs = {}
+        self._amimgr_list = []
+        self._amimgr_indexes = {}
+        self._kept_events = {}
+        self._reconnect_attempts = {}
+        self._reconnects = {}
+        self._addresses = {}
+        self._resyncs = {}
 
         for amihost in self.amihosts:
             self.attach(amihost)
 
+        if getattr(self.channel_manager, 'MAX_CHANNEL_AGE', None) is not None:
+            self._evict_handle = self.loop.call_later(self.EVICT_INTERVAL, self.evict_stale)
+
     def attach(self, amihost):
         """
         attach amihost to a ChannelManager.
@@ -44,11 +222,11 @@ class AmiRunner(object):
             amihost (dict): A dictionary containing the connection settings for
                 an AMI host.
         """
-        # Create Panoramisk asterisk AMI manager.
-        amimgr = Manager(
+        # Create the asterisk AMI manager.
+        amimgr = runner_manager_class(self.manager_class)(
             loop=self.loop, host=amihost['host'], port=amihost['port'],
             username=amihost['username'], secret=amihost['password'],
-            ssl=False, encoding='utf8', log=self.logger)
+            ssl=False, encoding='utf8', log=self.logger, on_disconnect=self.on_disconnect)
 
         # Create our own channel manager.
         channel_manager = self.channel_manager(
@@ -60,10 +238,131 @@ class AmiRunner(object):
             amimgr.register_event(event_name, self.on_event)
 
         # Record them for later use.
+        self._add_amimgr(amimgr, channel_manager)
+        self._addresses[amimgr] = '{}:{}'.format(amihost['host'], amihost['port'])
+        self._reset_backoff(amimgr)
+
+        self.connect(amimgr)
+
+    def _add_amimgr(self, amimgr, channel_manager):
         self.amimgrs[amimgr] = channel_manager
+        self._amimgr_indexes[amimgr] = len(self._amimgr_list)
+        self._amimgr_list.append(amimgr)
+        # The events the drop policy must queue, even when the queue is
+        # full.
+        self._kept_events[amimgr] = channel_manager.HANDLED_EVENTS - channel_manager.DROPPABLE_EVENTS
+
+    def connect(self, amimanager):
+        """
+        Connect to a host. If the connection fails, try again later.
 
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+        """
         # Tell asyncio what to work on.
-        asyncio.ensure_future(amimgr.connect())
+        future = asyncio.ensure_future(amimanager.connect(), loop=self.loop)
+        future.add_done_callback(partial(self.on_connect, amimanager))
+
+    def on_connect(self, amimanager, future):
+        """When a connection attempt is done, try again if it failed.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+            future (Future): The result of the connection attempt.
+        """
+        if future.cancelled():
+            return
+
+        if future.exception() is not None:
+            self.schedule_reconnect(amimanager)
+
+    def on_disconnect(self, amimanager, exc):
+        """When the connection to a host is lost, forget its channels
+        and reconnect.
+
+        The events of the host which were queued are handled first. The
+        Hangups of the channels which existed will never come, so the
+        channels are invalidated, and resynced after the reconnect.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+            exc (Exception): Why the connection was lost, or None.
+        """
+        if amimanager not in self.amimgrs or self._closing:
+            return
+
+        self.logger.warning('Lost the connection to %s: %r', self._addresses.get(amimanager), exc)
+
+        if self.queue is not None:
+            self._handle_queued(len(self.queue))
+
+        # Asterisk won't finish a channel list on this connection.
+        self._resyncs.pop(amimanager, None)
+        self.amimgrs[amimanager].invalidate('disconnected', report_hangups=self.report_lost)
+        self.schedule_reconnect(amimanager)
+
+    def schedule_reconnect(self, amimanager):
+        """
+        Reconnect to a host after reconnect_delay.
+
+        This goes for panoramisk's Manager too, which doesn't reconnect
+        by itself with the RunnerManagerMixin.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+        """
+        if self._closing or amimanager in self._reconnects:
+            return
+
+        attempts = self._reconnect_attempts[amimanager] + 1
+        self._reconnect_attempts[amimanager] = attempts
+
+        delay = self.reconnect_delay(attempts - 1)
+        self.logger.info('Reconnecting to %s in %.1f s', self._addresses.get(amimanager), delay)
+        self._reconnects[amimanager] = self.loop.call_later(delay, self._reconnect, amimanager)
+
+    def _reconnect(self, amimanager):
+        del self._reconnects[amimanager]
+        self.connect(amimanager)
+
+    def reconnect_delay(self, attempts):
+        """
+        Get the delay before a reconnect.
+
+        The delay doubles with every attempt, from RECONNECT_DELAY up to
+        MAX_RECONNECT_DELAY. A random part of up to half of it is taken
+        off, so the runners which lost their connections at the same
+        time (when Asterisk restarts) don't all come back at once.
+
+        Args:
+            attempts (int): The number of attempts which failed before.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = min(self.RECONNECT_DELAY * 2 ** min(attempts, 32), self.MAX_RECONNECT_DELAY)
+        return random.uniform(delay / 2, delay)
+
+    def _reset_backoff(self, amimanager):
+        self._reconnect_attempts[amimanager] = 0
+
+    def evict_stale(self):
+        """
+        Evict the old channels of all channel managers, and do it again
+        after EVICT_INTERVAL.
+
+        This is skipped while events are queued, since they may be about
+        the old channels.
+        """
+        self._evict_handle = self.loop.call_later(self.EVICT_INTERVAL, self.evict_stale)
+        if self.queue is not None and len(self.queue):
+            return
+
+        for channel_manager in self.amimgrs.values():
+            try:
+                channel_manager.evict_stale()
+            except Exception:
+                self.logger.exception('Could not evict the old channels')
 
     def on_event(self, amimanager, amievent):
         """When an event comes in, pass it to the relevant channel manager.
@@ -73,13 +372,217 @@ class AmiRunner(object):
             amievent (Event): AMI event (a dict-like object with event data).
         """
         assert amimanager in self.amimgrs
+        if amievent['Event'] == 'FullyBooted':
+            self._reset_backoff(amimanager)
+
+            if self.filter_events:
+                # Filters last as long as the connection, so they are
+                # added again after every login.
+                self.add_filter(amimanager)
+
+        resync = self._resyncs.get(amimanager)
+        if resync is not None:
+            if resync[0].done():
+                # The channel list is complete, but on_channels hasn't run
+                # yet. This event came after the list, so it is handled
+                # after the resync.
+                resync[1].append(amievent)
+                return
+
+            if amievent['Event'] == 'Hangup':
+                # The channel may be in the list, which Asterisk may have
+                # made before it hung up. It isn't resynced then.
+                resync[2].add(amievent.get('Uniqueid'))
+
+        self._dispatch(amimanager, amievent)
+
+    def _dispatch(self, amimanager, amievent):
+        """Handle an event, or queue it if there is a queue.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+            amievent (Event): AMI event (a dict-like object with event data).
+        """
+        if self.queue is None:
+            self.handle_event(amimanager, amievent)
+            return
+
+        droppable = amievent['Event'] not in self._kept_events[amimanager]
+        self.queue.put((self._amimgr_indexes[amimanager], amievent), droppable)
+
+        if not self._paused and self.queue.overflowing:
+            self._set_reading(False)
+
+        if not self._draining:
+            self._draining = True
+            self.loop.call_soon(self._drain)
+
+    def handle_event(self, amimanager, amievent):
+        """Pass an event to the relevant channel manager.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+            amievent (Event): AMI event (a dict-like object with event data).
+        """
         self.amimgrs[amimanager].on_event(amievent)
 
+        if self.resync and amievent['Event'] == 'FullyBooted':
+            self.request_channels(amimanager)
+
+    def _drain(self):
+        """Handle a batch of queued events, and schedule the next batch.
+        """
+        self._handle_queued(self.BATCH_SIZE)
+
+        if len(self.queue):
+            self.loop.call_soon(self._drain)
+        else:
+            self._draining = False
+
+    def _handle_queued(self, count):
+        """Handle queued events, and resume reading when there is room.
+
+        Args:
+            count (int): The number of events to handle at most.
+        """
+        for _ in range(count):
+            try:
+                index, amievent = self.queue.get()
+            except IndexError:
+                break
+
+            try:
+                self.handle_event(self._amimgr_list[index], amievent)
+            except Exception:
+                self.logger.exception('Could not handle %r', amievent)
+
+        if self._paused and len(self.queue) <= self.queue.maxsize // 2:
+            self._set_reading(True)
+
+    def _set_reading(self, reading):
+        """Stop or resume reading from all AMI connections.
+
+        Args:
+            reading (bool): Whether to read.
+        """
+        self._paused = not reading
+        for amimgr in self._amimgr_list:
+            transport = getattr(getattr(amimgr, 'protocol', None), 'transport', None)
+            if transport is None:
+                continue
+            try:
+                if reading:
+                    transport.resume_reading()
+                else:
+                    transport.pause_reading()
+            except RuntimeError:
+                # Already paused or resumed, or closing.
+                pass
+
+    def add_filter(self, amimanager):
+        """
+        Ask Asterisk to send only the events the channel manager is
+        interested in on this connection.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+        """
+        pattern = event_filter(self.amimgrs[amimanager].INTERESTING_EVENTS)
+        if pattern is None:
+            return
+
+        future = amimanager.send_action({'Action': 'Filter', 'Operation': 'Add', 'Filter': pattern})
+        future.add_done_callback(self.on_filter)
+
+    def on_filter(self, future):
+        """When Asterisk answers the Filter action, log a failure.
+
+        Args:
+            future (Future): The result of the Filter action.
+        """
+        if future.cancelled():
+            return
+
+        if future.exception() is not None:
+            self.logger.warning('Could not add the event filter: %r', future.exception())
+        elif future.result().get('Response') != 'Success':
+            self.logger.warning('Could not add the event filter: %r', dict(future.result()))
+
+    def request_channels(self, amimanager):
+        """
+        Ask Asterisk for the channels which exist right now.
+
+        The CoreShowChannel events in the response are passed to
+        ChannelManager.resync(), so calls which were in progress when we
+        connected are tracked from here on.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+        """
+        future = amimanager.send_action({'Action': 'CoreShowChannels'}, as_list=True)
+        # The events which are read between the end of the list and
+        # on_channels are kept here, with the uniqueids of the channels
+        # which hung up while the list was on its way.
+        self._resyncs[amimanager] = (future, [], set())
+        future.add_done_callback(partial(self.on_channels, amimanager))
+
+    def on_channels(self, amimanager, future):
+        """When the channel list comes in, pass it to the channel manager.
+
+        The events which were read before the list are handled first, and
+        the events which were read after it are handled after it. The
+        channels which hung up before the list was complete are left out
+        of it, since their Hangup was handled before they were resynced.
+
+        Args:
+            amimanager (Manager): The AMI manager from Panoramisk.
+            future (Future): The result of the CoreShowChannels action.
+        """
+        resync = self._resyncs.get(amimanager)
+        if resync is None or resync[0] is not future:
+            # The connection was lost, or the list was asked for again.
+            return
+
+        if self.queue is not None:
+            self._handle_queued(len(self.queue))
+
+        try:
+            self._resync(amimanager, future, resync[2])
+        finally:
+            del self._resyncs[amimanager]
+            for amievent in resync[1]:
+                self._dispatch(amimanager, amievent)
+
+    def _resync(self, amimanager, future, hung_up):
+        if future.cancelled():
+            return
+
+        if future.exception() is not None:
+            self.logger.warning('Could not list the channels: %r', future.exception())
+            return
+
+        response = future.result()
+        if not isinstance(response, list):
+            # A single message, which means an error.
+            self.logger.warning('Could not list the channels: %r', dict(response))
+            return
+
+        channels = [
+            message for message in response
+            if message.get('Event') == 'CoreShowChannel' and
+            (message.get('Uniqueid') or message.get('UniqueID')) not in hung_up
+        ]
+        self.amimgrs[amimanager].resync(channels)
+
     def run(self):
         """
         Start the runner and run until halted.
         """
-        self.attach_all()
+        if self.processes != 1:
+            self.supervisor = Supervisor(self, self.processes, self.reporter_factory)
+            self.supervisor.start()
+        else:
+            self.attach_all()
 
         # signal.signal(signal.SIGINT, self._close)
 
@@ -89,7 +592,20 @@ class AmiRunner(object):
         """Clean shutdown the runner.
         """
         print('Disconnecting from Asterisk...')
-        for amimgr in self.amimgrs:
+        self._closing = True
+        for handle in getattr(self, '_reconnects', {}).values():
+            handle.cancel()
+        if self._evict_handle is not None:
+            self._evict_handle.cancel()
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        for amimgr in getattr(self, 'amimgrs', ()):
             amimgr.close()
-        self.reporter.close()
+        if self.queue is not None:
+            self.queue.close()
+        if self.reporter is not None:
+            drain = getattr(self.reporter, 'drain', None)
+            if drain is not None:
+                self.loop.run_until_complete(drain())
+            self.reporter.close()
         sys.exit(0)
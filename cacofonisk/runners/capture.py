@@ -0,0 +1,707 @@
+"""
+Read captured AMI events from a file, one event at a time.
+
+Two formats are supported:
+
+* A JSON array of events, as written by the JsonReporter::
+
+    [
+      {"Event": "FullyBooted", ...},
+      {"Event": "Newchannel", ...}
+    ]
+
+* Line-delimited JSON (NDJSON), one event per line::
+
+    {"Event": "FullyBooted", ...}
+    {"Event": "Newchannel", ...}
+
+The events are parsed as they are read, so only a small part of the
+file is kept in memory, no matter how large the capture is.
+
+Captures may be compressed with gzip, bzip2 or xz. open_capture detects
+the compression from the first bytes of the file and decompresses while
+reading, and create_capture compresses while writing.
+
+Uncompressed line-delimited captures can also be memory-mapped with
+map_events, which skips the events that aren't wanted before decoding
+them.
+
+A capture which is still being written can be followed with
+follow_events, which waits for more events at the end of the file and
+reopens it when it is rotated.
+
+The JsonReporter adds the time each event was received (in seconds
+since the epoch) under ARRIVAL_KEY, so a capture can be replayed at the
+pace it was recorded at.
+"""
+import bz2
+import gzip
+import io
+import json
+import lzma
+import mmap
+import os
+import re
+import threading
+from operator import itemgetter
+
+CHUNK_SIZE = 64 * 1024
+
+#: The shortest and longest wait for more data when following a capture.
+#: The wait doubles every time nothing was written in the meantime.
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 2.0
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'\s*')
+_separator = re.compile(r'\s*,\s*')
+
+#: The key of the time an event was received, as added by the
+#: JsonReporter.
+ARRIVAL_KEY = 'Received'
+
+#: The key of the event name, as json.dumps writes it. Lines written
+#: differently are always decoded.
+EVENT_KEY = b'"Event": "'
+_event_key = re.compile(re.escape(EVENT_KEY))
+_newline = re.compile(b'\n')
+_non_ascii = re.compile('[^\x00-\x7f]')
+
+#: How to open a capture, by compression.
+OPENERS = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+#: The bytes which a compressed capture starts with.
+MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+)
+
+#: The compression of a capture, by file name extension.
+SUFFIXES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+}
+
+
+def detect_compression(path):
+    """
+    Detect the compression of a file from its first bytes.
+
+    Args:
+        path (str): The name of the file.
+
+    Returns:
+        str: 'gzip', 'bz2' or 'xz', or None if the file is not compressed.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(max(len(magic) for magic, compression in MAGIC))
+
+    for magic, compression in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_capture(path):
+    """
+    Open a capture for reading, decompressing it if needed.
+
+    Args:
+        path (str): The name of the capture.
+
+    Returns:
+        file: The capture, opened in text mode.
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, 'r')
+    return OPENERS[compression](path, 'rt')
+
+
+def create_capture(path, compression=None):
+    """
+    Create (or overwrite) a capture for writing, compressing it if needed.
+
+    Args:
+        path (str): The name of the capture.
+        compression (str): 'gzip', 'bz2', 'xz' or '' for none. By
+            default it follows from the extension of path.
+
+    Returns:
+        file: The capture, opened in text mode.
+
+    Raises:
+        ValueError: If the compression is not supported.
+    """
+    if compression is None:
+        compression = SUFFIXES.get(os.path.splitext(path)[1].lower(), '')
+
+    if not compression:
+        return open(path, 'w')
+    if compression not in OPENERS:
+        raise ValueError('Unsupported compression {!r}, expected one of {}'.format(
+            compression, ', '.join(sorted(OPENERS))))
+    return OPENERS[compression](path, 'wt')
+
+
+def read_events(fp, chunk_size=CHUNK_SIZE):
+    """
+    Read the events from a capture, detecting its format.
+
+    A capture which starts with '[' is read as a JSON array, any other
+    capture as line-delimited JSON.
+
+    Args:
+        fp (file): A capture, opened in text mode.
+        chunk_size (int): The number of characters to read at a time.
+
+    Returns:
+        generator: The events (dicts).
+    """
+    first = fp.read(1)
+    while first and first.isspace():
+        first = fp.read(1)
+
+    if first == '[':
+        return iter_json_array(fp, chunk_size=chunk_size, started=True)
+    return iter_ndjson(fp, first)
+
+
+def iter_ndjson(fp, head=''):
+    """
+    Read the events from a line-delimited JSON capture.
+
+    Args:
+        fp (file): A capture, opened in text mode.
+        head (str): Text which was already read from the first line.
+
+    Yields:
+        dict: The events, in order.
+    """
+    decode = _decoder.raw_decode
+
+    if head:
+        head += fp.readline()
+        if head.strip():
+            yield json.loads(head)
+
+    for line in fp:
+        # Most lines hold just an event, so we skip the checks which
+        # json.loads does unless that fails.
+        try:
+            event, end = decode(line)
+        except ValueError:
+            if line.strip():
+                yield json.loads(line)
+            continue
+
+        if end != len(line) and not line[end:].isspace():
+            json.loads(line)  # Raises the error about the extra data.
+        yield event
+
+
+def iter_json_array(fp, chunk_size=CHUNK_SIZE, started=False):
+    """
+    Read the events from a capture holding a JSON array, incrementally.
+
+    Args:
+        fp (file): A capture, opened in text mode.
+        chunk_size (int): The number of characters to read at a time.
+        started (bool): Whether the opening '[' was already read.
+
+    Returns:
+        iterator: The events (dicts), in order.
+
+    Raises:
+        ValueError: If the capture is not a JSON array, or if it ends
+            before the array is closed. The events before that point are
+            yielded first.
+    """
+    return map(itemgetter(0), _iter_json_array(fp, chunk_size, started))
+
+
+def _iter_json_array(fp, chunk_size, started, resumed=False, position=0, recode=False):
+    """
+    Read the events from a capture holding a JSON array, with the
+    position in fp after every event.
+
+    Args:
+        fp (file): A capture, opened in text mode.
+        chunk_size (int): The number of characters to read at a time.
+        started (bool): Whether the opening '[' was already read.
+        resumed (bool): Whether fp is right after an event, so a ','
+            or the closing ']' comes first.
+        position (int): The position of fp, in characters.
+        recode (bool): Whether fp is UTF-8 read as latin-1, so the
+            events with other characters than ASCII must be decoded
+            again.
+
+    Yields:
+        tuple: Every event (dict) and the position after it (int).
+    """
+    decode = _decoder.raw_decode
+    buf = ''
+    pos = 0
+    expect_value = not resumed
+    at_start = not resumed
+
+    if not started:
+        buf = fp.read(chunk_size)
+        pos = _whitespace.match(buf).end()
+        if buf[pos:pos + 1] != '[':
+            raise ValueError('Expected a JSON array at the start of the capture')
+        pos += 1
+
+    while True:
+        pos = _whitespace.match(buf, pos).end()
+
+        if pos == len(buf):
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                raise ValueError('The JSON array in the capture is not closed')
+            position += pos
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        char = buf[pos]
+        if char == ']' and (at_start or not expect_value):
+            return
+
+        if not expect_value:
+            if char != ',':
+                raise ValueError('Expected "," or "]" in the JSON array, got {!r}'.format(char))
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            event, end = decode(buf, pos)
+        except ValueError:
+            # The event is cut off by the end of the chunk.
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                raise
+            position += pos
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        if recode and _non_ascii.search(buf, pos, end) is not None:
+            event = json.loads(buf[pos:end].encode('latin-1').decode('utf8'))
+
+        yield event, position + end
+        at_start = False
+
+        # Usually the next event follows right away.
+        separator = _separator.match(buf, end)
+        if separator is not None and separator.end() < len(buf):
+            pos = separator.end()
+        else:
+            pos = end
+            expect_value = False
+
+
+def iter_event_offsets(path, offset=0):
+    """
+    Read the events from a capture, compressed or not, with the offset
+    after every event, so reading can be continued from there.
+
+    Both JSON arrays and line-delimited captures are read. The offset
+    after an event in a JSON array is right after its closing brace; in
+    a line-delimited capture it is the start of the next line.
+
+    Args:
+        path (str): The name of the capture.
+        offset (int): The offset to start at, in bytes of the
+            uncompressed capture. It must be 0 or an offset yielded
+            before.
+
+    Yields:
+        tuple: Every event (dict) and the offset after it (int).
+    """
+    compression = detect_compression(path)
+    opener = open if compression is None else OPENERS[compression]
+
+    with opener(path, 'rb') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(offset)
+
+        if first == b'[':
+            # In latin-1 every byte is a character, so the positions in
+            # the text are offsets in the file.
+            fp = io.TextIOWrapper(f, encoding='latin-1', newline='')
+            for item in _iter_json_array(fp, CHUNK_SIZE, offset != 0, offset != 0, offset, True):
+                yield item
+            return
+
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                yield json.loads(line.decode('utf8')), offset
+
+
+def is_mappable(path):
+    """
+    Check whether a capture can be memory-mapped: it is uncompressed and
+    holds line-delimited JSON.
+
+    Args:
+        path (str): The name of the capture.
+
+    Returns:
+        bool: True if map_events and find_spans can read the capture.
+    """
+    if detect_compression(path) is not None:
+        return False
+
+    with open(path, 'rb') as f:
+        head = f.read(CHUNK_SIZE)
+        while head and head.isspace():
+            head = f.read(CHUNK_SIZE)
+    head = head.lstrip()
+    return bool(head) and not head.startswith(b'[')
+
+
+def map_events(path, names=None):
+    """
+    Read the events from an uncompressed line-delimited JSON capture, by
+    memory-mapping it.
+
+    The name of every event is looked up in the mapped bytes, and the
+    events with other names are skipped without decoding them. Since
+    VarSet, Newexten and the like make up most of a capture, this is
+    faster than decoding every event. Captures which are compressed or
+    hold a JSON array are read with read_events instead.
+
+    Args:
+        path (str): The name of the capture.
+        names (set): The names of the events to read, or None for all
+            events.
+
+    Yields:
+        dict: The events with one of the names, in order.
+    """
+    if not is_mappable(path):
+        with open_capture(path) as f:
+            for event in read_events(f):
+                if names is None or event['Event'] in names:
+                    yield event
+        return
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            spans = find_spans(mapped, names)
+            events = decode_spans(mapped, spans, names)
+            try:
+                for event in events:
+                    yield event
+            finally:
+                # The map can only be closed once nothing refers to it.
+                events.close()
+                spans.close()
+
+
+def find_spans(mapped, names=None):
+    """
+    Find the lines of a memory-mapped line-delimited capture which may
+    hold one of the events with the given names.
+
+    Lines holding an event with another name, as json.dumps writes it,
+    are skipped. The other lines (empty ones, or those written
+    differently) are not, so the result must be decoded and checked.
+
+    Args:
+        mapped (mmap): The capture.
+        names (set): The names of the events, or None for all lines.
+
+    Yields:
+        tuple: The start and end offset of each line.
+    """
+    if names is None:
+        return _iter_lines(mapped, None)
+    return _iter_named_lines(mapped, names)
+
+
+def decode_spans(mapped, spans, names=None):
+    """
+    Decode the events on the lines of a memory-mapped capture.
+
+    The lines are decoded straight from the map, without copying them
+    to bytes first.
+
+    Args:
+        mapped (mmap): The capture.
+        spans (iterable): The start and end offset of each line.
+        names (set): The names of the events to return, or None for all
+            events.
+
+    Yields:
+        dict: The events, in the order of the spans.
+    """
+    with memoryview(mapped) as view:
+        for start, end in spans:
+            event = _decode_line(str(view[start:end], 'utf8'))
+            if event is not None and (names is None or event['Event'] in names):
+                yield event
+
+
+def _iter_named_lines(mapped, names):
+    """
+    Find the lines of the wanted events with a single regular expression
+    over the map, which skips the other lines without looking at them
+    one by one.
+
+    The lines between two wanted events are only skipped if there are as
+    many event names (as json.dumps writes them) as lines. Otherwise
+    those lines are looked at one by one.
+    """
+    pattern = re.compile(re.escape(EVENT_KEY) + b'(?:' + b'|'.join(
+        re.escape(name.encode('utf8')) for name in sorted(names)) + b')"')
+    find = mapped.find
+    rfind = mapped.rfind
+    pos = 0
+
+    for match in pattern.finditer(mapped):
+        if match.start() < pos:
+            continue  # The name is in a line which was already found.
+
+        # Count the lines and names in the map, without copying them.
+        start = max(rfind(b'\n', pos, match.start()) + 1, pos)
+        if len(_newline.findall(mapped, pos, start)) != len(_event_key.findall(mapped, pos, start)):
+            for span in _iter_lines(mapped, names, pos, start):
+                yield span
+
+        end = find(b'\n', match.end())
+        if end == -1:
+            end = len(mapped)
+        pos = end + 1
+
+        yield start, end
+
+    if pos < len(mapped):
+        for span in _iter_lines(mapped, names, pos, len(mapped)):
+            yield span
+
+
+def _iter_lines(mapped, names, start=0, stop=None):
+    """
+    Find the lines of the map one by one, skipping the ones with an
+    event name which isn't wanted.
+    """
+    find = mapped.find
+    wanted = None if names is None else frozenset(name.encode('utf8') for name in names)
+    key_size = len(EVENT_KEY)
+    stop = len(mapped) if stop is None else stop
+
+    while start < stop:
+        end = find(b'\n', start, stop)
+        if end == -1:
+            end = stop
+
+        if wanted is not None:
+            name_start = find(EVENT_KEY, start, end)
+            if name_start != -1:
+                name_start += key_size
+                name_end = find(b'"', name_start, end)
+                if name_end != -1:
+                    name = mapped[name_start:name_end]
+                    if name not in wanted and b'\\' not in name:
+                        start = end + 1
+                        continue
+
+        yield start, end
+        start = end + 1
+
+
+def _decode_line(line):
+    """
+    Decode the event on a line, or return None for a blank line.
+    """
+    try:
+        event, stop = _decoder.raw_decode(line)
+    except ValueError:
+        if not line.strip():
+            return None
+        return json.loads(line)
+
+    if stop != len(line) and not line[stop:].isspace():
+        json.loads(line)  # Raises the error about the extra data.
+    return event
+
+
+class FollowFile(object):
+    """
+    FollowFile reads a capture which is still being written, like
+    ``tail -F`` does.
+
+    At the end of the file, read and readline wait for more data instead
+    of returning what they have, polling with a growing interval. They
+    do return at the end once the file is rotated (another file was
+    moved to the path, or the file was truncated) or stop is set, after
+    which ended is True.
+
+    Usage::
+
+        with FollowFile('capture.ndjson', stop) as fp:
+            for event in read_events(fp):
+                ...
+    """
+    def __init__(self, path, stop=None, poll_interval=POLL_INTERVAL, max_poll_interval=MAX_POLL_INTERVAL):
+        """
+        Open the file, waiting for it to be created if needed.
+
+        Args:
+            path (str): The name of the uncompressed capture.
+            stop (threading.Event): Set it to stop waiting.
+            poll_interval (float): The first wait for more data, in seconds.
+            max_poll_interval (float): The longest wait for more data.
+        """
+        self.path = path
+        self.stop = stop if stop is not None else threading.Event()
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.ended = False
+        self._interval = poll_interval
+        self._fp = None
+        self._inode = None
+
+        while self._fp is None:
+            try:
+                self._fp = open(path, 'r')
+            except FileNotFoundError:
+                if not self._wait():
+                    self._fp = io.StringIO()
+                    self.ended = True
+            else:
+                self._inode = os.fstat(self._fp.fileno()).st_ino
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self._fp.close()
+
+    def read(self, size=-1):
+        """
+        Read up to size characters, waiting for at least one.
+
+        Returns:
+            str: The characters, or '' if the follow ended.
+        """
+        while True:
+            data = self._fp.read(size)
+            if data:
+                self._interval = self.poll_interval
+                return data
+            if self.ended:
+                return data
+            self._poll()
+
+    def readline(self):
+        """
+        Read a whole line, waiting for its end.
+
+        Returns:
+            str: The line, or the rest of the file if the follow ended.
+        """
+        line = ''
+        while True:
+            chunk = self._fp.readline()
+            if chunk:
+                self._interval = self.poll_interval
+                line += chunk
+            if line.endswith('\n') or self.ended:
+                return line
+            self._poll()
+
+    def _wait(self):
+        """
+        Wait for the next poll, and make the one after that longer.
+
+        Returns:
+            bool: False if stop was set.
+        """
+        if self.stop.wait(self._interval):
+            return False
+        self._interval = min(self._interval * 2, self.max_poll_interval)
+        return True
+
+    def _poll(self):
+        """
+        Called at the end of the file: wait for more data, or end the
+        follow if the file was rotated or stop was set. Either way the
+        caller reads once more, so nothing written before the rotation
+        is lost.
+        """
+        if self._rotated() or not self._wait():
+            self.ended = True
+
+    def _rotated(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Moved away, but the new file isn't there yet. The writer
+            # may still append to the old one.
+            return False
+
+        if stat.st_ino != self._inode:
+            return True
+        return stat.st_size < os.lseek(self._fp.fileno(), 0, os.SEEK_CUR)
+
+
+def follow_events(path, stop=None, poll_interval=POLL_INTERVAL, max_poll_interval=MAX_POLL_INTERVAL):
+    """
+    Read the events from a capture which is still being written, until
+    stop is set.
+
+    New events are yielded as soon as they are written, line-delimited
+    or in a JSON array, as the JsonReporter writes it. When the capture
+    is rotated, the new file is read from the start. A JSON array which
+    is closed ends the file, and a cut off event at the end of a rotated
+    file is skipped.
+
+    Args:
+        path (str): The name of the uncompressed capture.
+        stop (threading.Event): Set it to stop following.
+        poll_interval (float): The first wait for more data, in seconds.
+        max_poll_interval (float): The longest wait for more data.
+
+    Yields:
+        dict: The events, in order.
+    """
+    if stop is None:
+        stop = threading.Event()
+
+    while not stop.is_set():
+        with FollowFile(path, stop, poll_interval, max_poll_interval) as fp:
+            try:
+                for event in read_events(fp):
+                    yield event
+            except ValueError:
+                if not fp.ended:
+                    raise
+
+            # Wait for the rotation after a closed JSON array.
+            while fp.read(CHUNK_SIZE):
+                pass
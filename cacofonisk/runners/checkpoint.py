@@ -0,0 +1,69 @@
+"""
+Persist how far a FileRunner got, so a replay can continue after a
+restart.
+
+A checkpoint holds the file being replayed, the offset of the next event
+in it and the channels which were open at that point, serialized by
+ChannelManager.dump_channels. It is replaced atomically, so a crash
+while saving leaves the previous checkpoint.
+"""
+import os
+import pickle
+from collections import namedtuple
+
+#: The version of the checkpoint format.
+VERSION = 1
+
+
+class Checkpoint(namedtuple('CheckpointBase', 'filename offset channels')):
+    """
+    Checkpoint records how far a file was replayed.
+
+    Attributes:
+        filename (str): The file being replayed.
+        offset (int): The offset of the next event, in bytes of the
+            uncompressed file.
+        channels (bytes): The open channels, from
+            ChannelManager.dump_channels, or None at the start of a file.
+    """
+    __slots__ = ()
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Write a checkpoint to disk, replacing the previous one.
+
+    Args:
+        path (str): The name of the checkpoint file.
+        checkpoint (Checkpoint): The checkpoint to write.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        pickle.dump((VERSION, tuple(checkpoint)), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    """
+    Read a checkpoint from disk.
+
+    Args:
+        path (str): The name of the checkpoint file.
+
+    Returns:
+        Checkpoint: The checkpoint, or None if there is none.
+
+    Raises:
+        ValueError: If the file is not a checkpoint of this version.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+    if not isinstance(data, tuple) or len(data) != 2 or data[0] != VERSION:
+        raise ValueError('{} is not a version {} checkpoint'.format(path, VERSION))
+    return Checkpoint(*data[1])
@@ -5,16 +5,56 @@ the ChannelManager accordingly.
 If the main application desires to replay previously stored events (an
 event replay log), the FileRunner is the runner to use.
 
-Events are loaded from a ``.json`` file which holds a list of
-dictionaries.
+Events are read from a ``.json`` file which holds a list of
+dictionaries, or from a file with one JSON dictionary per line. The
+events are passed on while the file is read, so captures of any size can
+be replayed. Files compressed with gzip, bzip2 or xz are decompressed
+while they are read.
+
+With use_mmap, line-delimited captures are memory-mapped and the events
+which the ChannelManager doesn't handle are skipped before they are
+decoded. That is faster for uncompressed captures on local disks.
+
+With processes, the files are replayed in a pool of worker processes.
+The hook calls of each file are recorded in the worker and passed to the
+reporter in the parent, one file after the other, in the order of the
+files.
+
+With speed, the events are replayed on an asyncio loop at the pace they
+were received at, as recorded by the JsonReporter, sped up by that
+factor. That drives the reporter with the bursts of real traffic.
+Events without a time are replayed right after the previous one.
+
+With follow, a single capture which is still being written is followed
+like ``tail -F`` does, by one ChannelManager, until stop is called. See
+cacofonisk.runners.capture.follow_events.
+
+With checkpoint, the runner saves how far it got every so many events:
+the file, the offset in it and the open channels. A run with the same
+checkpoint file continues right after the last checkpoint, so the
+reporter gets the calls which would have followed, and none of the
+calls before the checkpoint again. The calls made between the last
+checkpoint and a crash are made again. A reporter which has a flush()
+method (the JsonReporter, the ThreadedReporter) is flushed before every
+checkpoint, so what it wrote before the checkpoint is not lost.
 """
-from json import load
+import asyncio
+import copy
+import multiprocessing
+import os
+import threading
 
 from ..channel import ChannelManager
+from ..reporters.async_reporter import AsyncBaseReporter, TaskReporter, schedule_reporter
+from ..reporters.recording_reporter import RecordingReporter
+from .capture import ARRIVAL_KEY, follow_events, iter_event_offsets, map_events, open_capture, read_events
+from .checkpoint import Checkpoint, load_checkpoint, save_checkpoint
 
 
 class FileRunner(object):
-    def __init__(self, files, reporter, channel_manager_class=ChannelManager):
+    def __init__(self, files, reporter, channel_manager_class=ChannelManager, use_mmap=False, processes=1,
+                 speed=None, loop=None, follow=False, checkpoint=None, checkpoint_interval=10000, max_tasks=100,
+                 max_waiting=10000):
         """
         FileRunner is a Runner that reads from one or more files.
 
@@ -24,6 +64,40 @@ class FileRunner(object):
             reporter (Reporter): The reporter to use for this Runner.
             channel_manager_class: The ChannelManager to instantiate for this
                 Runner.
+            use_mmap (bool): Whether to memory-map line-delimited files
+                and skip the uninteresting events before decoding them.
+            processes (int): The number of worker processes to replay the
+                files in, None for one per CPU. With more than one, the
+                channel_manager_class must be picklable, and the
+                ChannelManagers stay in the workers, so channel_managers
+                is not filled.
+            speed (float): Replay the events at their original pace,
+                this many times faster (1, 10, 100...). None replays
+                them as fast as possible.
+            loop (AbstractEventLoop): The loop to replay at a speed on,
+                by default the current event loop. After the replay,
+                max_lag holds the most seconds an event was late.
+            follow (bool): Keep reading the (single, uncompressed) file
+                as it grows, and reopen it when it is rotated, until
+                stop is called.
+            checkpoint (str): The file to save checkpoints in, and to
+                continue from if it exists. It is removed when all files
+                are replayed.
+            checkpoint_interval (int): The number of events between
+                checkpoints.
+            max_tasks (int): The number of coroutine hooks of an
+                AsyncBaseReporter to run at a time, when replaying at a
+                speed.
+            max_waiting (int): The number of coroutine hook calls which
+                may wait for a task to finish, or None for no limit.
+
+        Raises:
+            ValueError: If speed is not positive, or combined with
+                processes, or follow is combined with more than one
+                file or any of the other modes, or checkpoint is
+                combined with any of the other modes, or the reporter
+                is an AsyncBaseReporter and there is no speed: its
+                coroutines only run on the event loop of a paced replay.
         """
         if type(files) == str:
             self.files = [files]
@@ -33,36 +107,320 @@ class FileRunner(object):
             raise TypeError('Expected string or list for files argument')
         self.reporter = reporter
         self.channel_manager_class = channel_manager_class
+        self.use_mmap = use_mmap
+        self.processes = processes
+        self.speed = speed
+        self.loop = loop
         self.channel_managers = []
+        self.max_lag = None
+        self.follow = follow
+        self._stop = threading.Event() if follow else None
+
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.max_tasks = max_tasks
+        self.max_waiting = max_waiting
+
+        if isinstance(reporter, AsyncBaseReporter) and speed is None:
+            raise ValueError('An AsyncBaseReporter can only be used with a speed, which replays on an event loop')
+
+        if follow and (len(self.files) != 1 or use_mmap or processes != 1 or speed is not None):
+            raise ValueError('Only a single file can be followed, without use_mmap, processes or speed')
+
+        if checkpoint is not None and (use_mmap or processes != 1 or speed is not None or follow):
+            raise ValueError('Checkpoints can not be combined with use_mmap, processes, speed or follow')
+
+        if speed is not None:
+            if speed <= 0:
+                raise ValueError('The speed must be positive, not {!r}'.format(speed))
+            if processes != 1:
+                raise ValueError('Files can not be replayed at a speed in multiple processes')
 
     def _load_events_from_disk(self, filename):
         """
-        Read the file with the given file name and return the JSON contents.
+        Read the events from the file with the given file name.
+
+        With use_mmap only the events in INTERESTING_EVENTS of the
+        channel_manager_class are read.
 
         Args:
             filename (str): The name of the file to read.
 
-        Returns:
-            A JSON object.
+        Yields:
+            dict: The events, read as they are needed.
         """
-        with open(filename, 'r') as f:
-            events = load(f)
-        return events
+        if self.use_mmap:
+            names = self.channel_manager_class.INTERESTING_EVENTS
+            for event in map_events(filename, None if '*' in names else names):
+                yield event
+            return
+
+        with open_capture(filename) as f:
+            for event in read_events(f):
+                yield event
 
     def run(self):
         """
         Read all the events from the files and pass them to channel_manager.
         """
+        if self.checkpoint is not None:
+            self._run_checkpointed()
+            self.reporter.close()
+            return
+
+        if self.follow:
+            channel_manager = self.channel_manager_class(reporter=self.reporter)
+            self.channel_managers.append(channel_manager)
+            channel_manager.on_events(follow_events(self.files[0], self._stop))
+            self.reporter.close()
+            return
+
+        if self.speed is not None:
+            loop = self.loop or asyncio.get_event_loop()
+            loop.run_until_complete(self.replay_paced(loop))
+            if isinstance(self.reporter, TaskReporter):
+                loop.run_until_complete(self.reporter.drain())
+            self.reporter.close()
+            return
+
+        if self.processes != 1 and len(self.files) > 1:
+            self._run_in_pool()
+            self.reporter.close()
+            return
+
         for filename in self.files:
             events = self._load_events_from_disk(filename)
             channel_manager = self.channel_manager_class(reporter=self.reporter)
-
-            for event in events:
-                if (
-                        '*' in channel_manager.INTERESTING_EVENTS or
-                        event['Event'] in channel_manager.INTERESTING_EVENTS
-                   ):
-                    channel_manager.on_event(event)
+            channel_manager.on_events(events)
 
             self.channel_managers.append(channel_manager)
         self.reporter.close()
+
+    def _run_in_pool(self):
+        """
+        Replay every file in a worker process, with a copy of this runner
+        which records the hook calls, and replay those on the reporter.
+        """
+        runners = []
+        for filename in self.files:
+            runner = copy.copy(self)
+            runner.files = [filename]
+            runner.reporter = RecordingReporter.for_reporter(self.reporter)
+            runner.processes = 1
+            runner.channel_managers = []
+            runners.append(runner)
+
+        with multiprocessing.Pool(self.processes) as pool:
+            # imap returns the recordings in the order of the files, while
+            # the workers continue with the next files.
+            for recorder in pool.imap(_replay_recorded, runners):
+                recorder.replay(self.reporter)
+
+    def _run_checkpointed(self):
+        """
+        Replay the files from the last checkpoint, saving checkpoints
+        along the way.
+
+        Raises:
+            ValueError: If the checkpoint is for a file which is not
+                replayed.
+        """
+        checkpoint = load_checkpoint(self.checkpoint)
+        if checkpoint is None:
+            checkpoint = Checkpoint(self.files[0], 0, None)
+        elif checkpoint.filename not in self.files:
+            raise ValueError('The checkpoint in {} is for {}, which is not replayed'.format(
+                self.checkpoint, checkpoint.filename))
+
+        for filename in self.files[self.files.index(checkpoint.filename):]:
+            channel_manager = self.channel_manager_class(reporter=self.reporter)
+            offset = 0
+            if filename == checkpoint.filename:
+                offset = checkpoint.offset
+                if checkpoint.channels is not None:
+                    channel_manager.load_channels(checkpoint.channels)
+
+            self._save_checkpoint(filename, offset, channel_manager)
+            channel_manager.on_events(self._checkpointed_events(filename, offset, channel_manager))
+            self.channel_managers.append(channel_manager)
+
+        os.remove(self.checkpoint)
+
+    def _checkpointed_events(self, filename, offset, channel_manager):
+        """
+        Read the events of a file from an offset, and save a checkpoint
+        every checkpoint_interval events, once the event before it is
+        handled.
+        """
+        count = 0
+        for event, offset in iter_event_offsets(filename, offset):
+            yield event
+
+            # The event has been handled when the next one is asked for.
+            count += 1
+            if count == self.checkpoint_interval:
+                count = 0
+                self._save_checkpoint(filename, offset, channel_manager)
+
+    def _save_checkpoint(self, filename, offset, channel_manager):
+        """
+        Flush the reporter, if it can be, and save a checkpoint.
+        """
+        flush = getattr(self.reporter, 'flush', None)
+        if callable(flush):
+            flush()
+        save_checkpoint(self.checkpoint, Checkpoint(filename, offset, channel_manager.dump_channels()))
+
+    def stop(self):
+        """
+        Stop following the file. run returns after the event it is
+        handling, if any. This may be called from another thread or a
+        signal handler.
+        """
+        self._stop.set()
+
+    def replay_paced(self, loop=None):
+        """
+        Start replaying the files at speed on an event loop, which may be
+        running already. The reporter is not closed afterwards.
+
+        An AsyncBaseReporter is wrapped in a TaskReporter on the loop
+        first, which is the reporter attribute then; wait for its drain()
+        to let the last tasks finish.
+
+        Args:
+            loop (AbstractEventLoop): The loop, by default self.loop or
+                the current event loop.
+
+        Returns:
+            Future: Done when all events are replayed. Cancel it to stop
+                the replay.
+        """
+        loop = loop or self.loop or asyncio.get_event_loop()
+        self.reporter = schedule_reporter(self.reporter, loop, self.max_tasks, self.max_waiting)
+        return PacedReplay(self, loop).start()
+
+
+class PacedReplay(object):
+    """
+    PacedReplay passes the events of a FileRunner to its ChannelManagers
+    at the time they are due, with callbacks on an event loop.
+
+    The events of every file are due at the time they were received,
+    relative to the first event of the file, divided by the speed.
+    Events which are late (because the previous ones took too long) are
+    passed on right away, and the largest lag in seconds is kept in the
+    max_lag of the runner.
+    """
+    def __init__(self, runner, loop):
+        """
+        Args:
+            runner (FileRunner): The runner, with a speed.
+            loop (AbstractEventLoop): The loop to replay on.
+        """
+        self.runner = runner
+        self.loop = loop
+        self.done = asyncio.Future(loop=loop)
+        runner.max_lag = 0.0
+
+        self._files = iter(runner.files)
+        self._events = None
+        self._event = None
+        self._handle = None
+
+    def start(self):
+        """
+        Schedule the first event.
+
+        Returns:
+            Future: Done when all events are replayed.
+        """
+        self._handle = self.loop.call_soon(self._step)
+        self.done.add_done_callback(self._on_done)
+        return self.done
+
+    def _next_file(self):
+        filename = next(self._files, None)
+        if filename is None:
+            return False
+
+        self._events = iter(self.runner._load_events_from_disk(filename))
+        self._channel_manager = self.runner.channel_manager_class(reporter=self.runner.reporter)
+        self.runner.channel_managers.append(self._channel_manager)
+        self._origin = None
+        return True
+
+    def _due(self, event):
+        """
+        Return the loop time an event is due at, or None if it is due now.
+        """
+        received = event.get(ARRIVAL_KEY)
+        if received is None:
+            return None
+
+        if self._origin is None:
+            self._origin = (received, self.loop.time())
+
+        received_origin, loop_origin = self._origin
+        return loop_origin + (received - received_origin) / self.runner.speed
+
+    def _step(self):
+        self._handle = None
+        try:
+            self._replay()
+        except Exception as e:
+            self._close()
+            self.done.set_exception(e)
+
+    def _replay(self):
+        """
+        Pass on the events which are due, and schedule the next one.
+        """
+        while True:
+            if self._event is None:
+                if self._events is None and not self._next_file():
+                    self.done.set_result(None)
+                    return
+
+                self._event = next(self._events, None)
+                if self._event is None:
+                    self._events = None
+                    continue
+
+            due = self._due(self._event)
+            if due is not None:
+                now = self.loop.time()
+                if due > now:
+                    self._handle = self.loop.call_at(due, self._step)
+                    return
+                self.runner.max_lag = max(self.runner.max_lag, now - due)
+
+            event, self._event = self._event, None
+            self._channel_manager.on_event(event)
+
+    def _on_done(self, future):
+        if future.cancelled():
+            if self._handle is not None:
+                self._handle.cancel()
+            self._close()
+
+    def _close(self):
+        # The events may come from a generator, which closes the file.
+        close = getattr(self._events, 'close', None)
+        if close is not None:
+            close()
+        self._events = None
+
+
+def _replay_recorded(runner):
+    """
+    Run a FileRunner in a worker process.
+
+    Args:
+        runner (FileRunner): A runner with a RecordingReporter.
+
+    Returns:
+        RecordingReporter: The reporter, with the recorded calls.
+    """
+    runner.run()
+    return runner.reporter
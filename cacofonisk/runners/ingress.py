@@ -0,0 +1,197 @@
+"""
+A bounded queue between reading AMI events and handling them.
+
+The AmiRunner can put the events it reads in an IngressQueue and handle
+them from the event loop, instead of inside the callback of the AMI
+client. When the queue is full, its policy decides what happens:
+
+- block: the events are queued anyway and the runner stops reading from
+  Asterisk until the queue is half empty again.
+- drop: the droppable events (see ChannelManager.DROPPABLE_EVENTS) are
+  dropped; the other events are queued anyway, and then the runner
+  stops reading until the queue is half empty again.
+- spill: the events are written to a temporary file and read back in
+  order when the queue has room again. When max_spill events are
+  spilled, the runner stops reading until the queue is half empty
+  again, so the file doesn't grow without bound.
+
+The high_water, dropped, spilled and overflowed counters show how full
+the queue got, so it can be sized.
+"""
+import collections
+import json
+import tempfile
+
+BLOCK = 'block'
+DROP = 'drop'
+SPILL = 'spill'
+
+POLICIES = (BLOCK, DROP, SPILL)
+
+
+class IngressQueue(object):
+    """
+    IngressQueue is a FIFO queue of (index, event) items with a size
+    limit and an overflow policy.
+
+    Spilled items are stored as JSON, so they come back as tuples of
+    plain values: an event comes back as a dict.
+    """
+    def __init__(self, maxsize, policy=BLOCK, spill_dir=None, max_spill=1000000):
+        """
+        Args:
+            maxsize (int): The number of items to keep in memory.
+            policy (str): What to do when the queue is full: 'block',
+                'drop' or 'spill'.
+            spill_dir (str): The directory for the spill file, the
+                default temporary directory if None.
+            max_spill (int): The number of items to spill before the
+                queue is overflowing.
+        """
+        if maxsize < 1:
+            raise ValueError('The queue size must be positive, not {!r}'.format(maxsize))
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy {!r}, expected one of {}'.format(policy, ', '.join(POLICIES)))
+        if max_spill < 1:
+            raise ValueError('The spill size must be positive, not {!r}'.format(max_spill))
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_dir = spill_dir
+        self.max_spill = max_spill
+
+        self._items = collections.deque()
+        self._spill_file = None
+        self._spill_offset = 0
+        self._spill_count = 0
+
+        # The largest number of items queued at once, spilled or not.
+        self.high_water = 0
+        # The number of items dropped, spilled to disk, and queued in
+        # memory (or spilled beyond max_spill) while the queue was full.
+        self.dropped = 0
+        self.spilled = 0
+        self.overflowed = 0
+
+    def __len__(self):
+        return len(self._items) + self._spill_count
+
+    @property
+    def full(self):
+        """
+        Returns:
+            bool: Whether the queue holds maxsize items or more.
+        """
+        return len(self) >= self.maxsize
+
+    @property
+    def overflowing(self):
+        """
+        Whether the items should stop coming until the queue is half
+        empty: it is full (block), it holds more items than it may
+        (drop), or max_spill items are spilled (spill).
+
+        Returns:
+            bool: Whether the queue is overflowing.
+        """
+        if self.policy == BLOCK:
+            return len(self) >= self.maxsize
+        if self.policy == DROP:
+            return len(self._items) > self.maxsize
+        return self._spill_count >= self.max_spill
+
+    def stats(self):
+        """
+        Returns:
+            dict: The size, limit and counters of the queue.
+        """
+        return {
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'max_spill': self.max_spill,
+            'policy': self.policy,
+            'high_water': self.high_water,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'overflowed': self.overflowed,
+        }
+
+    def put(self, item, droppable=False):
+        """
+        Add an item to the queue.
+
+        Args:
+            item (tuple): The item to add.
+            droppable (bool): Whether the drop policy may drop the item.
+
+        Returns:
+            bool: False if the item was dropped.
+        """
+        if self._spill_count or (self.policy == SPILL and len(self._items) >= self.maxsize):
+            # Once items are spilled, all new items go to the file until
+            # it is read back, so they stay in order.
+            if self._spill_count >= self.max_spill:
+                self.overflowed += 1
+            self._spill(item)
+        elif len(self._items) >= self.maxsize:
+            if self.policy == DROP and droppable:
+                self.dropped += 1
+                return False
+            self.overflowed += 1
+            self._items.append(item)
+        else:
+            self._items.append(item)
+
+        size = len(self)
+        if size > self.high_water:
+            self.high_water = size
+        return True
+
+    def get(self):
+        """
+        Take the oldest item from the queue.
+
+        Returns:
+            tuple: The item.
+
+        Raises:
+            IndexError: If the queue is empty.
+        """
+        if not self._items and self._spill_count:
+            self._unspill(self.maxsize)
+        return self._items.popleft()
+
+    def close(self):
+        """
+        Remove the spill file. Spilled items are lost.
+        """
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._spill_offset = 0
+        self._spill_count = 0
+
+    def _spill(self, item):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        self._spill_file.seek(0, 2)
+        self._spill_file.write(json.dumps(item, default=dict).encode('utf8') + b'\n')
+        self._spill_count += 1
+        self.spilled += 1
+
+    def _unspill(self, count):
+        f = self._spill_file
+        f.seek(self._spill_offset)
+        for line in f:
+            self._items.append(tuple(json.loads(line.decode('utf8'))))
+            self._spill_count -= 1
+            count -= 1
+            if count == 0 or self._spill_count == 0:
+                break
+        self._spill_offset = f.tell()
+
+        if self._spill_count == 0:
+            # Reuse the space of the file for the next spill.
+            f.seek(0)
+            f.truncate()
+            self._spill_offset = 0
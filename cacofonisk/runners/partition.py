@@ -0,0 +1,431 @@
+"""
+Replay a single capture in parallel, split into independent calls.
+
+The events of a call only refer to the channels of that call, by name or
+by uniqueid. The DialBegin, LocalBridge, Masquerade, Transfer (and so
+on) events which tie channels together refer to all of them at once. So
+when the channels which appear in the same event are joined, every group
+of connected channels is a call, or a few calls which were joined by a
+transfer, and its events don't depend on any other events.
+
+The PartitionedFileRunner spreads these groups over a number of
+partitions, replays every partition in a worker process with its own
+ChannelManager and merges the hook calls back in the order of the
+events. The reporter gets the same calls as from a FileRunner, which can
+be checked with verify.
+"""
+import copy
+import heapq
+import json
+import mmap
+import multiprocessing
+import os
+import re
+from array import array
+
+from ..channel import NO_CHANNELS_LEFT, ChannelManager
+from ..reporters.recording_reporter import HOOKS, RecordingReporter
+from .capture import EVENT_KEY, decode_spans, find_spans, is_mappable
+from .file_runner import FileRunner
+
+#: The event keys which refer to a channel. Channels are joined on any
+#: of them, so having too many only costs parallelism.
+CHANNEL_KEYS = (
+    'Channel', 'Uniqueid', 'UniqueID', 'Linkedid',
+    'DestChannel', 'DestUniqueID', 'DestLinkedid',
+    'LocalOneChannel', 'LocalTwoChannel', 'Uniqueid1', 'Uniqueid2',
+    'Channel1', 'Channel2', 'BridgedChannel', 'BridgedUniqueID',
+    'Newname', 'Clone', 'CloneUniqueid', 'Original', 'OriginalUniqueid',
+    'TargetChannel', 'TargetUniqueid',
+)
+
+# The pseudo hook which records the number of channels of a partition.
+_SIZE = '_size'
+
+
+class PartitionMismatch(Exception):
+    """
+    The partitioned replay of a capture differs from the sequential one.
+    """
+    pass
+
+
+class Partitioner(object):
+    """
+    Partitioner joins the channels which appear in the same event, with
+    a union-find, and assigns the events to partitions.
+
+    Usage::
+
+        partitioner = Partitioner()
+        for event in events:
+            partitioner.add([event.get(key) for key in CHANNEL_KEYS])
+        assignment = partitioner.assign(8)
+    """
+    def __init__(self):
+        self._nodes = {}
+        self._parents = []
+        self._event_nodes = array('l')
+
+    def __len__(self):
+        return len(self._event_nodes)
+
+    def _find(self, node):
+        parents = self._parents
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    def add(self, references):
+        """
+        Add the next event.
+
+        Args:
+            references (iterable): The channel names and uniqueids the
+                event refers to. Empty values are ignored.
+        """
+        nodes = self._nodes
+        parents = self._parents
+        event_node = -1
+
+        for value in references:
+            if not value:
+                continue
+
+            node = nodes.get(value)
+            if node is None:
+                node = nodes[value] = len(parents)
+                parents.append(node)
+
+            if event_node == -1:
+                event_node = node
+            else:
+                root, other = self._find(event_node), self._find(node)
+                if root != other:
+                    parents[other] = root
+
+        self._event_nodes.append(event_node)
+
+    def assign(self, partitions):
+        """
+        Spread the groups of connected channels over the partitions by
+        their number of events, largest first. Events which don't refer
+        to a channel (like FullyBooted) go to the first partition.
+
+        Args:
+            partitions (int): The number of partitions, at most 65536.
+
+        Returns:
+            array: The partition of every event, by index.
+        """
+        roots = array('l', (-1 if node == -1 else self._find(node) for node in self._event_nodes))
+
+        sizes = {}
+        for root in roots:
+            if root != -1:
+                sizes[root] = sizes.get(root, 0) + 1
+
+        loads = [(0, partition) for partition in range(partitions)]
+        assigned = {-1: 0}
+        for root in sorted(sizes, key=sizes.get, reverse=True):
+            load, partition = heapq.heappop(loads)
+            assigned[root] = partition
+            heapq.heappush(loads, (load + sizes[root], partition))
+
+        return array('H', (assigned[root] for root in roots))
+
+
+def partition_events(events, partitions, keys=CHANNEL_KEYS):
+    """
+    Assign the events of a capture to partitions, keeping the events of
+    connected channels together.
+
+    Args:
+        events (iterable): The events of the capture.
+        partitions (int): The number of partitions.
+        keys (tuple): The event keys which refer to a channel.
+
+    Returns:
+        array: The partition of every event, by index.
+    """
+    partitioner = Partitioner()
+    for event in events:
+        partitioner.add([event.get(key) for key in keys])
+    return partitioner.assign(partitions)
+
+
+def partition_mapped(mapped, partitions, names=None, keys=CHANNEL_KEYS):
+    """
+    Assign the events of a memory-mapped line-delimited capture to
+    partitions, like partition_events, mostly without decoding them.
+
+    The channels are read from the lines with a regular expression.
+    Lines with escapes in them, or which aren't written like json.dumps
+    writes them, are decoded.
+
+    Args:
+        mapped (mmap): The capture.
+        partitions (int): The number of partitions.
+        names (set): The names of the events to partition, or None for
+            all events.
+        keys (tuple): The event keys which refer to a channel.
+
+    Returns:
+        tuple: The partition of every event (array) and the start and
+            end offset of every event (array, two per event).
+    """
+    reference = re.compile(b'"(?:' + b'|'.join(re.escape(key.encode('utf8')) for key in keys) + b')": "([^"\\\\]*)"')
+    wanted = None if names is None else frozenset(name.encode('utf8') for name in names)
+    key_size = len(EVENT_KEY)
+
+    partitioner = Partitioner()
+    offsets = array('q')
+
+    for start, end in find_spans(mapped, names):
+        line = mapped[start:end]
+        name_start = line.find(EVENT_KEY)
+
+        if name_start == -1 or b'\\' in line:
+            if not line.strip():
+                continue
+            event = json.loads(line.decode('utf8'))
+            if names is not None and event['Event'] not in names:
+                continue
+            references = [event.get(key) for key in keys]
+        else:
+            name_start += key_size
+            if wanted is not None and line[name_start:line.find(b'"', name_start)] not in wanted:
+                continue
+            references = reference.findall(line)
+
+        partitioner.add(references)
+        offsets.append(start)
+        offsets.append(end)
+
+    return partitioner.assign(partitions), offsets
+
+
+class PartitionRecorder(RecordingReporter):
+    """
+    PartitionRecorder records the hook calls of a partition with the
+    index of the event they were called for, so they can be merged.
+    """
+    def __init__(self, hooks=HOOKS):
+        super().__init__(hooks)
+        self.index = -1
+
+    def _record(self, hook, *args):
+        if hook in self.hooks:
+            self.calls.append((self.index, len(self.calls), hook, args))
+
+    def record_size(self, partition, size):
+        """
+        Record the number of channels after the current event.
+
+        Args:
+            partition (int): The partition of the channels.
+            size (int): The number of channels.
+        """
+        self.calls.append((self.index, len(self.calls), _SIZE, (partition, size)))
+
+
+def merge_recordings(recordings, assignment):
+    """
+    Merge the hook calls of the partitions in the order of the events.
+
+    The '(no channels left)' trace of a partition only holds for the
+    whole capture when the other partitions are empty too, so it is
+    dropped otherwise.
+
+    Args:
+        recordings (list): The calls of every PartitionRecorder.
+        assignment (array): The partition of every event.
+
+    Yields:
+        tuple: The name of the hook and its arguments.
+    """
+    sizes = [0] * len(recordings)
+
+    for index, sequence, hook, args in heapq.merge(*recordings):
+        if hook == _SIZE:
+            partition, size = args
+            sizes[partition] = size
+        elif hook == 'trace_msg' and args[0] == NO_CHANNELS_LEFT:
+            if not sum(sizes) - sizes[assignment[index]]:
+                yield hook, args
+        else:
+            yield hook, args
+
+
+class PartitionedFileRunner(FileRunner):
+    """
+    PartitionedFileRunner replays each of its files in parallel, split
+    into independent calls.
+
+    Usage::
+
+        runner = PartitionedFileRunner('capture.ndjson', reporter, use_mmap=True, processes=8)
+        runner.run()
+
+    With use_mmap, line-delimited captures are partitioned without
+    decoding most events, and every worker only decodes the events of
+    its partition. Otherwise the capture is decoded once to partition it,
+    and once more by every worker, which is only worth it if handling
+    the events costs much more than reading them.
+
+    The channel_manager_class may not evict channels: which channels are
+    evicted depends on all channels, not just those of a partition.
+    """
+    def __init__(self, files, reporter, channel_manager_class=ChannelManager, use_mmap=False, processes=None,
+                 verify=False):
+        """
+        Args:
+            files [str]: A list of strings containing filenames or, a string
+                containing a filename.
+            reporter (Reporter): The reporter to use for this Runner.
+            channel_manager_class: The ChannelManager to instantiate for
+                every partition. It must be picklable.
+            use_mmap (bool): Whether to memory-map line-delimited files.
+            processes (int): The number of partitions and worker
+                processes, None for one per CPU.
+            verify (bool): Whether to replay every file sequentially as
+                well (in another worker), and raise PartitionMismatch if
+                the hook calls differ.
+
+        Raises:
+            ValueError: If the channel_manager_class evicts channels.
+        """
+        super().__init__(files, reporter, channel_manager_class=channel_manager_class, use_mmap=use_mmap,
+                         processes=processes or os.cpu_count())
+        self.verify = verify
+
+        if (channel_manager_class.MAX_CHANNEL_AGE is not None or
+                channel_manager_class.MAX_CHANNELS is not None or
+                channel_manager_class.PURGE_ON_FULLY_BOOTED):
+            raise ValueError('A capture can not be partitioned for a ChannelManager which evicts channels')
+
+    def run(self):
+        """
+        Replay the files one after the other, each in parallel.
+        """
+        with multiprocessing.Pool(self.processes) as pool:
+            for filename in self.files:
+                self._run_partitioned(pool, filename)
+        self.reporter.close()
+
+    def _event_names(self):
+        names = self.channel_manager_class.INTERESTING_EVENTS
+        return None if '*' in names else names
+
+    def _interesting_events(self, filename):
+        names = self._event_names()
+        for event in self._load_events_from_disk(filename):
+            if names is None or event['Event'] in names:
+                yield event
+
+    def _run_partitioned(self, pool, filename):
+        """
+        Partition a file, replay the partitions in the pool and pass the
+        merged hook calls to the reporter.
+        """
+        # The workers get a copy of this runner, without the reporter,
+        # which may not be picklable.
+        runner = copy.copy(self)
+        runner.reporter = None
+        runner.channel_managers = []
+
+        wanted = RecordingReporter.for_reporter(self.reporter).hooks
+        hooks = HOOKS if self.verify else wanted
+
+        if self.use_mmap and is_mappable(filename):
+            with open(filename, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    assignment, offsets = partition_mapped(mapped, self.processes, self._event_names())
+
+            jobs = []
+            for partition in range(self.processes):
+                indices = array('l', (index for index, assigned in enumerate(assignment) if assigned == partition))
+                spans = array('q')
+                for index in indices:
+                    spans.append(offsets[2 * index])
+                    spans.append(offsets[2 * index + 1])
+                jobs.append((runner, filename, hooks, partition, None, indices, spans))
+        else:
+            assignment = partition_events(self._interesting_events(filename), self.processes)
+            jobs = [
+                (runner, filename, hooks, partition, assignment, None, None)
+                for partition in range(self.processes)
+            ]
+
+        if self.verify:
+            jobs.append((runner, filename, hooks, None, None, None, None))
+
+        recordings = pool.map(_replay_partition, jobs)
+
+        calls = merge_recordings(recordings[:self.processes], assignment)
+        if self.verify:
+            calls = list(calls)
+            expected = [(hook, args) for index, sequence, hook, args in recordings[-1]]
+            _compare(filename, expected, calls)
+
+        for hook, args in calls:
+            if hook in wanted:
+                getattr(self.reporter, hook)(*args)
+
+
+def _compare(filename, expected, calls):
+    for position, (expected_call, call) in enumerate(zip(expected, calls)):
+        if expected_call != call:
+            raise PartitionMismatch('{}: hook call {} is {!r} sequentially but {!r} partitioned'.format(
+                filename, position, expected_call, call))
+
+    if len(expected) != len(calls):
+        raise PartitionMismatch('{}: {} hook calls sequentially but {} partitioned'.format(
+            filename, len(expected), len(calls)))
+
+
+def _replay_partition(job):
+    """
+    Replay the events of one partition of a file in a worker process.
+
+    Args:
+        job (tuple): The runner, the file name, the hooks to record, the
+            partition, and either the partition of every event, or the
+            indices and line offsets of the events of the partition.
+            Without any, all events are replayed.
+
+    Returns:
+        list: The calls of the PartitionRecorder.
+    """
+    runner, filename, hooks, partition, assignment, indices, spans = job
+    recorder = PartitionRecorder(hooks)
+    channel_manager = runner.channel_manager_class(reporter=recorder)
+    track_size = partition is not None and recorder.wants_trace_msg
+
+    def replay(indexed_events):
+        size = 0
+        for index, event in indexed_events:
+            recorder.index = index
+            yield event
+
+            # The event has been handled when the next one is asked for.
+            if track_size and len(channel_manager._registry) != size:
+                size = len(channel_manager._registry)
+                recorder.record_size(partition, size)
+
+    if spans is None:
+        events = enumerate(runner._interesting_events(filename))
+        if assignment is not None:
+            events = ((index, event) for index, event in events if assignment[index] == partition)
+        channel_manager.on_events(replay(events))
+        return recorder.calls
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            events = decode_spans(mapped, zip(spans[::2], spans[1::2]))
+            try:
+                channel_manager.on_events(replay(zip(indices, events)))
+            finally:
+                events.close()
+    return recorder.calls
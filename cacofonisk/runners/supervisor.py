@@ -0,0 +1,247 @@
+"""
+Run the AMI connections of an AmiRunner in worker processes.
+
+The ChannelManagers of different Asterisk hosts share no state, so the
+hosts can be spread over processes. Every worker runs a copy of the
+AmiRunner with its share of the hosts, on its own event loop. The
+Supervisor starts the workers and restarts a worker which exits, after
+a delay which doubles every time the worker exits again soon after
+being started. A restarted worker connects again, and resyncs the
+channels which exist, like after a reconnect.
+
+The reporter calls are made in the parent: every worker gets a
+PipeReporter, which sends the hook calls to the parent, where they are
+passed to the reporter. Or, with a reporter_factory, every worker
+creates a reporter of its own and nothing is sent to the parent.
+"""
+import asyncio
+import copy
+import multiprocessing
+import time
+
+from ..reporters.async_reporter import schedule_reporter
+from ..reporters.recording_reporter import HOOKS, RecordingReporter
+
+
+class PipeReporter(RecordingReporter):
+    """
+    PipeReporter sends the hook calls of a worker to the parent process.
+
+    The calls are collected and sent as one list once the event loop
+    has handled the events it has read, so the pipe is not written for
+    every hook call.
+    """
+    def __init__(self, connection, loop, hooks=HOOKS):
+        """
+        Args:
+            connection (Connection): The end of the pipe to send on.
+            loop (AbstractEventLoop): The event loop of the worker.
+            hooks (iterable): The names of the hooks to send.
+        """
+        super().__init__(hooks)
+        self.connection = connection
+        self.loop = loop
+        self._flush_scheduled = False
+
+    def _record(self, hook, *args):
+        if hook in self.hooks:
+            self.calls.append((hook, args))
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """
+        Send the collected calls to the parent.
+        """
+        self._flush_scheduled = False
+        if self.calls:
+            calls, self.calls = self.calls, []
+            self.connection.send(calls)
+
+    # The events are sent as plain dicts, since the event objects of an
+    # AMI client don't have to be picklable.
+    def trace_ami(self, event):
+        self._record('trace_ami', dict(event))
+
+    def on_event(self, event):
+        self._record('on_event', dict(event))
+
+    def on_user_event(self, event):
+        self._record('on_user_event', dict(event))
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class Worker(object):
+    """
+    Worker is the parent's side of a worker process.
+    """
+    def __init__(self, amihosts):
+        """
+        Args:
+            amihosts (list): The AMI hosts of this worker.
+        """
+        self.amihosts = amihosts
+        self.process = None
+        self.connection = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_delay = None
+
+
+class Supervisor(object):
+    """
+    Supervisor runs the hosts of an AmiRunner in worker processes on the
+    event loop of the runner, and restarts the workers which exit.
+    """
+    # The delay before restarting a worker which exited, which doubles
+    # up to MAX_RESTART_DELAY while the worker keeps exiting. A worker
+    # which ran for MAX_RESTART_DELAY is restarted after RESTART_DELAY
+    # again.
+    RESTART_DELAY = 1.0
+    MAX_RESTART_DELAY = 60.0
+
+    def __init__(self, runner, processes=None, reporter_factory=None):
+        """
+        Args:
+            runner (AmiRunner): The runner with the hosts to run.
+            processes (int): The number of worker processes, or None for
+                a process per host.
+            reporter_factory (callable): Called in every worker to create
+                its reporter. If None, the calls are passed to the
+                reporter of the runner.
+        """
+        self.runner = runner
+        self.loop = runner.loop
+        self.logger = runner.logger
+        self.reporter_factory = reporter_factory
+
+        amihosts = list(runner.amihosts)
+        count = len(amihosts) if processes is None else max(1, min(processes, len(amihosts)))
+        self.workers = [Worker(amihosts[i::count]) for i in range(count)]
+        self._stopping = False
+
+    def start(self):
+        """
+        Start all workers.
+        """
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def stop(self):
+        """
+        Stop all workers, and stop restarting them.
+        """
+        self._stopping = True
+        for worker in self.workers:
+            process = worker.process
+            if process is None:
+                continue
+            self._forget_process(worker)
+            process.terminate()
+            process.join()
+
+    def _start_worker(self, worker):
+        if self._stopping:
+            return
+
+        runner = copy.copy(self.runner)
+        runner.amihosts = worker.amihosts
+        runner.processes = 1
+        runner.reporter_factory = None
+        runner.reporter = None
+        runner.loop = None
+
+        if self.reporter_factory is None:
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            hooks = RecordingReporter.for_reporter(self.runner.reporter).hooks
+        else:
+            reader = writer = hooks = None
+
+        process = multiprocessing.Process(
+            target=_run_worker, args=(runner, writer, hooks, self.reporter_factory), daemon=True)
+        process.start()
+        worker.process = process
+        worker.started_at = time.monotonic()
+        self.logger.info('Started worker %d for %s', process.pid,
+                         ', '.join('{}:{}'.format(host['host'], host['port']) for host in worker.amihosts))
+
+        if writer is not None:
+            writer.close()
+            worker.connection = reader
+            self.loop.add_reader(reader.fileno(), self._receive, worker)
+        self.loop.add_reader(process.sentinel, self._on_exit, worker)
+
+    def _receive(self, worker):
+        """
+        Pass the calls a worker sent to the reporter.
+        """
+        connection = worker.connection
+        reporter = self.runner.reporter
+        try:
+            while connection.poll():
+                for hook, args in connection.recv():
+                    try:
+                        getattr(reporter, hook)(*args)
+                    except Exception:
+                        self.logger.exception('Reporter failed on %s', hook)
+        except (EOFError, OSError):
+            # The worker is gone; _on_exit follows.
+            self.loop.remove_reader(connection.fileno())
+
+    def _on_exit(self, worker):
+        """
+        Restart a worker which exited.
+        """
+        process = worker.process
+        if worker.connection is not None and not worker.connection.closed:
+            # Pass on what the worker sent before it exited.
+            self._receive(worker)
+        self._forget_process(worker)
+        process.join()
+
+        if self._stopping:
+            return
+
+        uptime = time.monotonic() - worker.started_at
+        if worker.restart_delay is None or uptime >= self.MAX_RESTART_DELAY:
+            worker.restart_delay = self.RESTART_DELAY
+        else:
+            worker.restart_delay = min(worker.restart_delay * 2, self.MAX_RESTART_DELAY)
+
+        worker.restarts += 1
+        self.logger.warning('Worker %d exited with %s, restarting in %.1f s', process.pid, process.exitcode,
+                            worker.restart_delay)
+        self.loop.call_later(worker.restart_delay, self._start_worker, worker)
+
+    def _forget_process(self, worker):
+        self.loop.remove_reader(worker.process.sentinel)
+        if worker.connection is not None:
+            if not worker.connection.closed:
+                self.loop.remove_reader(worker.connection.fileno())
+                worker.connection.close()
+            worker.connection = None
+        worker.process = None
+
+
+def _run_worker(runner, connection, hooks, reporter_factory):
+    """
+    Run an AmiRunner in a worker process, on a new event loop.
+
+    Args:
+        runner (AmiRunner): The runner, with the hosts of this worker.
+        connection (Connection): The end of the pipe to send the hook
+            calls on, or None to use the reporter_factory.
+        hooks (frozenset): The hooks to send.
+        reporter_factory (callable): Creates the reporter of the worker.
+    """
+    runner.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(runner.loop)
+    if connection is not None:
+        runner.reporter = PipeReporter(connection, runner.loop, hooks)
+    else:
+        runner.reporter = schedule_reporter(reporter_factory(), runner.loop, runner.max_tasks, runner.max_waiting)
+    runner.run()
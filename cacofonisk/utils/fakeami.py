@@ -0,0 +1,275 @@
+"""
+A fake Asterisk Manager Interface server, to test runners against.
+
+It accepts any login, answers actions with canned responses and can
+push events to the connected clients. It only speaks enough AMI for
+panoramisk and the runners.
+
+Like Asterisk, it honours the Filter action: the events sent to a
+client are matched against the filters the client added, as text.
+"""
+import asyncio
+import re
+
+
+BANNER = 'Asterisk Call Manager/2.10.3\r\n'
+
+FULLY_BOOTED = {
+    'Event': 'FullyBooted',
+    'Privilege': 'system,all',
+    'Status': 'Fully Booted',
+}
+
+
+def format_message(message):
+    """
+    Format an AMI message for the wire.
+
+    Args:
+        message (dict): The keys and values of the message.
+
+    Returns:
+        bytes: The message, including the empty line which ends it.
+    """
+    lines = ['{}: {}\r\n'.format(key, value) for key, value in message.items()]
+    return (''.join(lines) + '\r\n').encode('utf8')
+
+
+# The POSIX character classes Asterisk's regular expressions may use.
+_POSIX_CLASSES = {
+    '[:space:]': r'\s',
+    '[:digit:]': r'\d',
+    '[:alpha:]': 'a-zA-Z',
+    '[:alnum:]': 'a-zA-Z0-9',
+    '[:upper:]': 'A-Z',
+    '[:lower:]': 'a-z',
+}
+
+
+def compile_filter(pattern):
+    """
+    Compile the regular expression of an AMI Filter.
+
+    Args:
+        pattern (str): The filter. A leading ! makes it a blacklist
+            filter.
+
+    Returns:
+        tuple: The compiled expression and whether it is a blacklist
+            filter.
+
+    Raises:
+        re.error: If the filter is not a valid expression.
+    """
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    for posix, python in _POSIX_CLASSES.items():
+        pattern = pattern.replace(posix, python)
+    return re.compile(pattern), negate
+
+
+def parse_message(data):
+    """
+    Parse an AMI message from the wire.
+
+    Args:
+        data (str): The lines of one message.
+
+    Returns:
+        dict: The keys and values of the message.
+    """
+    message = {}
+    for line in data.split('\r\n'):
+        key, sep, value = line.partition(':')
+        if sep:
+            message[key.strip()] = value.strip()
+    return message
+
+
+class FakeAmiProtocol(asyncio.Protocol):
+    """
+    FakeAmiProtocol handles one client connection of a FakeAmiServer.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.filters = []
+        self.filtered = 0
+        self._buffer = ''
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.clients.append(self)
+        transport.write(BANNER.encode('utf8'))
+
+    def connection_lost(self, exc):
+        if self in self.server.clients:
+            self.server.clients.remove(self)
+
+    def data_received(self, data):
+        self._buffer += data.decode('utf8')
+        while '\r\n\r\n' in self._buffer:
+            data, self._buffer = self._buffer.split('\r\n\r\n', 1)
+            action = parse_message(data)
+            if action:
+                self.server.handle_action(self, action)
+
+    def send(self, message):
+        """
+        Send a message to the client.
+
+        Args:
+            message (dict): The keys and values of the message.
+        """
+        self.transport.write(format_message(message))
+
+    def send_event(self, event):
+        """
+        Send an event to the client, unless its filters block it.
+
+        Without filters, all events are sent. With whitelist filters,
+        only the events which match one of them are sent. Events which
+        match a blacklist filter are never sent.
+
+        Args:
+            event (dict): The keys and values of the event.
+        """
+        data = format_message(event)
+        if self.filters:
+            text = data.decode('utf8')
+            whitelists = [regex for regex, negate in self.filters if not negate]
+            if ((whitelists and not any(regex.search(text) for regex in whitelists)) or
+                    any(regex.search(text) for regex, negate in self.filters if negate)):
+                self.filtered += 1
+                return
+        self.transport.write(data)
+
+
+class FakeAmiServer(object):
+    """
+    FakeAmiServer listens on localhost and replays canned responses.
+
+    Usage::
+
+        server = FakeAmiServer(responses={
+            'CoreShowChannels': [
+                {'Response': 'Success', 'EventList': 'start'},
+                {'Event': 'CoreShowChannel', 'Channel': 'SIP/201-00000001', ...},
+                {'Event': 'CoreShowChannelsComplete', 'EventList': 'Complete'},
+            ],
+        })
+        server.start()
+        amihost = {'host': '127.0.0.1', 'port': server.port, ...}
+
+    Every message of a response gets the ActionID of the action. After a
+    successful Login the login_events (by default FullyBooted) are sent.
+    Filter actions add filters to the connection; responses to actions
+    are not filtered, only events.
+    """
+    def __init__(self, responses=None, login_events=(FULLY_BOOTED,), loop=None, host='127.0.0.1', port=0):
+        """
+        Args:
+            responses (dict): The list of messages to send in response to
+                each action name.
+            login_events (list): Events to send after a client logs in.
+            loop (AbstractEventLoop): The event loop to serve on.
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 for any free port.
+        """
+        self.responses = responses or {}
+        self.login_events = list(login_events)
+        self.loop = loop or asyncio.get_event_loop()
+        self.host = host
+        self._port = port
+        self._server = None
+
+        self.clients = []
+        self.actions = []
+
+    @property
+    def port(self):
+        """
+        Returns:
+            int: The port the server is listening on.
+        """
+        return self._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        """
+        Start listening. The event loop must not be running yet.
+        """
+        self._server = self.loop.run_until_complete(
+            self.loop.create_server(lambda: FakeAmiProtocol(self), self.host, self._port))
+
+    def close(self):
+        """
+        Disconnect all clients and stop listening.
+        """
+        for client in list(self.clients):
+            client.transport.close()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def send_event(self, event):
+        """
+        Send an event to all connected clients.
+
+        Args:
+            event (dict): The keys and values of the event.
+        """
+        for client in self.clients:
+            client.send_event(event)
+
+    def handle_action(self, client, action):
+        """
+        Answer an action from a client.
+
+        Args:
+            client (FakeAmiProtocol): The connection the action came in on.
+            action (dict): The keys and values of the action.
+        """
+        self.actions.append(action)
+        name = action.get('Action', '')
+        action_id = action.get('ActionID')
+
+        if name.lower() == 'login':
+            responses = [{'Response': 'Success', 'Message': 'Authentication accepted'}]
+        elif name.lower() == 'filter':
+            responses = [self.add_filter(client, action)]
+        elif name in self.responses:
+            responses = self.responses[name]
+        elif name.lower() == 'ping':
+            responses = [{'Response': 'Success', 'Ping': 'Pong'}]
+        else:
+            responses = [{'Response': 'Error', 'Message': 'Invalid/unknown command'}]
+
+        for response in responses:
+            response = dict(response)
+            if action_id is not None:
+                response['ActionID'] = action_id
+            client.send(response)
+
+        if name.lower() == 'login':
+            for event in self.login_events:
+                client.send_event(event)
+
+    def add_filter(self, client, action):
+        """
+        Add the filter of a Filter action to a connection.
+
+        Args:
+            client (FakeAmiProtocol): The connection the action came in on.
+            action (dict): The keys and values of the action.
+
+        Returns:
+            dict: The response.
+        """
+        if action.get('Operation', '').lower() != 'add' or not action.get('Filter'):
+            return {'Response': 'Error', 'Message': 'Unknown operation'}
+        try:
+            client.filters.append(compile_filter(action['Filter']))
+        except re.error:
+            return {'Response': 'Error', 'Message': 'Filter Not Added'}
+        return {'Response': 'Success', 'Message': 'Filter Added Successfully'}
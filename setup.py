@@ -73,7 +73,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['panoramisk>=1.0,<2'],
+    install_requires=['panoramisk>=1.4,<2'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
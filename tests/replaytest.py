@@ -77,10 +77,7 @@ class BogoRunner(object):
 
     def run(self):
         channelmgr = ChannelManager(reporter=self.reporter)
-        for event in self.events:
-            if ('*' in channelmgr.INTERESTING_EVENTS or
-                    event['Event'] in channelmgr.INTERESTING_EVENTS):
-                channelmgr.on_event(event)
+        channelmgr.on_events(self.events)
 
         self.channel_managers.append(channelmgr)
 
@@ -0,0 +1,129 @@
+import asyncio
+from unittest import TestCase
+
+from cacofonisk import AmiClient
+from cacofonisk.runners.ami_client import AmiProtocol, parse_message
+from cacofonisk.utils.fakeami import BANNER, FakeAmiServer, format_message
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        pass
+
+
+class TestAmiProtocol(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.client = AmiClient(loop=self.loop)
+        self.received = []
+        self.client.register_event('Newchannel', lambda client, event: self.received.append(event))
+
+        self.protocol = AmiProtocol(self.client)
+        self.protocol.connection_made(FakeTransport())
+
+    def test_split_messages(self):
+        """Test messages are parsed however the data is split up.
+        """
+        newchannel = {'Event': 'Newchannel', 'Channel': 'SIP/201-00000001', 'Uniqueid': 'a.1'}
+        data = BANNER.encode('utf8') + b''.join(format_message(event) for event in (
+            newchannel,
+            {'Event': 'VarSet', 'Channel': 'SIP/201-00000001', 'Variable': 'A', 'Value': 'Event: Newchannel'},
+            {'Event': 'Newchannel', 'Channel': 'SIP/202-00000002', 'Uniqueid': 'b.1'},
+        ))
+
+        for size in (1, 7, len(data)):
+            del self.received[:]
+            self.protocol = AmiProtocol(self.client)
+            self.protocol.connection_made(FakeTransport())
+            for i in range(0, len(data), size):
+                self.protocol.data_received(data[i:i + size])
+
+            self.assertEqual('2.10.3', self.protocol.version)
+            self.assertEqual([newchannel, 'b.1'], [self.received[0], self.received[1]['Uniqueid']])
+            self.assertEqual(0, len(self.protocol._buffer))
+
+    def test_parse_message(self):
+        """Test repeated keys get a list of values, like panoramisk does.
+        """
+        message = parse_message('Event: Test\r\nVariable: A=1\r\nVariable: B=2\r\nValue: a: b\r\nJunk')
+
+        self.assertEqual({'Event': 'Test', 'Variable': ['A=1', 'B=2'], 'Value': 'a: b'}, message)
+
+
+class TestAmiClient(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        # Let the transports finish closing.
+        self.addCleanup(self.loop.run_until_complete, asyncio.sleep(0.01))
+
+        self.server = FakeAmiServer(responses={
+            'CoreShowChannels': [
+                {'Response': 'Success', 'EventList': 'start'},
+                {'Event': 'CoreShowChannel', 'Channel': 'SIP/201-00000001'},
+                {'Event': 'CoreShowChannelsComplete', 'EventList': 'Complete'},
+            ],
+        }, loop=self.loop)
+        self.server.start()
+        self.addCleanup(self.server.close)
+
+        self.client = AmiClient(loop=self.loop, host='127.0.0.1', port=self.server.port, username='user',
+                                secret='secret')
+        self.addCleanup(self.client.close)
+
+        self.booted = asyncio.Future(loop=self.loop)
+        self.client.register_event('FullyBooted', lambda client, event: self.booted.set_result(event))
+
+    def run_until(self, future):
+        return self.loop.run_until_complete(asyncio.wait_for(future, 5))
+
+    def test_login(self):
+        """Test the client logs in and gets the registered events.
+        """
+        self.client.connect()
+        event = self.run_until(self.booted)
+
+        self.assertEqual('Fully Booted', event['Status'])
+        self.assertTrue(self.client.authenticated)
+        self.assertEqual({'Action': 'Login', 'Username': 'user', 'Secret': 'secret', 'Events': 'on'},
+                         {key: value for key, value in self.server.actions[0].items() if key != 'ActionID'})
+
+    def test_actions(self):
+        """Test the responses to actions, lists and errors.
+        """
+        self.client.connect()
+        self.run_until(self.booted)
+
+        response = self.run_until(self.client.send_action({'Action': 'Ping'}))
+        self.assertEqual('Pong', response['Ping'])
+
+        messages = self.run_until(self.client.send_action({'Action': 'CoreShowChannels'}, as_list=True))
+        self.assertEqual(['Success', 'CoreShowChannel', 'CoreShowChannelsComplete'],
+                         [message.get('Response') or message.get('Event') for message in messages])
+        self.assertFalse(self.client.has_list_actions)
+
+        error = self.run_until(self.client.send_action({'Action': 'Unknown'}, as_list=True))
+        self.assertEqual('Error', error['Response'])
+
+    def test_close(self):
+        """Test waiting actions are cancelled on close.
+        """
+        self.client.connect()
+        self.run_until(self.booted)
+
+        self.server.responses['Slow'] = []
+        future = self.client.send_action({'Action': 'Slow'})
+        self.client.close()
+
+        self.assertTrue(future.cancelled())
+        self.assertIsInstance(self.client.send_action({'Action': 'Ping'}).exception(), ConnectionError)
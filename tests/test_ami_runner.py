@@ -0,0 +1,338 @@
+import asyncio
+from unittest import TestCase
+
+from panoramisk import Manager
+
+from cacofonisk import AmiClient, AmiRunner, BaseReporter, ChannelManager
+from cacofonisk.channel import MissingChannel
+from cacofonisk.runners.ami_runner import event_filter
+from cacofonisk.utils.fakeami import FakeAmiServer, compile_filter, format_message
+
+
+def core_show_channel(channel, uniqueid, state, callerid, bridge_id=''):
+    return {
+        'Event': 'CoreShowChannel',
+        'Channel': channel,
+        'Uniqueid': uniqueid,
+        'Linkedid': 'resync-1.1',
+        'ChannelState': str(state),
+        'CallerIDNum': callerid,
+        'CallerIDName': '',
+        'AccountCode': '',
+        'Context': 'default',
+        'Exten': '202',
+        'Application': 'Dial',
+        'BridgeId': bridge_id,
+    }
+
+
+CHANNELS = [
+    core_show_channel('SIP/201-00000001', 'resync-1.1', 6, '201', 'bridge-a'),
+    core_show_channel('Local/202@default-00000001;1', 'resync-1.2', 6, '201', 'bridge-a'),
+    core_show_channel('Local/202@default-00000001;2', 'resync-1.3', 6, '201', 'bridge-b'),
+    core_show_channel('SIP/202-00000002', 'resync-1.4', 6, '202', 'bridge-b'),
+    core_show_channel('SIP/203-00000003', 'resync-2.1', 4, '203'),
+]
+
+CORE_SHOW_CHANNELS = (
+    [{'Response': 'Success', 'EventList': 'start', 'Message': 'Channels will follow'}] +
+    CHANNELS +
+    [{'Event': 'CoreShowChannelsComplete', 'EventList': 'Complete', 'ListItems': str(len(CHANNELS))}]
+)
+
+
+class TestAmiRunnerResync(TestCase):
+    manager_class = Manager
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.server = FakeAmiServer(responses={
+            'CoreShowChannels': CORE_SHOW_CHANNELS,
+        }, loop=self.loop)
+        self.server.start()
+
+        self.resynced = asyncio.Future(loop=self.loop)
+        resynced = self.resynced
+
+        class ResyncChannelManager(ChannelManager):
+            def resync(self, channels):
+                added = super().resync(channels)
+                resynced.set_result(self)
+                return added
+
+        self.runner = AmiRunner([{
+            'host': '127.0.0.1',
+            'port': self.server.port,
+            'username': 'cacofonisk',
+            'password': 'secret',
+        }], BaseReporter(), channel_manager=ResyncChannelManager, manager_class=self.manager_class)
+
+    def tearDown(self):
+        for amimgr in getattr(self.runner, 'amimgrs', ()):
+            amimgr.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_resync_after_fully_booted(self):
+        """Test the channels which exist when we connect are tracked.
+        """
+        self.runner.attach_all()
+        manager = self.loop.run_until_complete(asyncio.wait_for(self.resynced, 5))
+        registry = manager._registry
+
+        self.assertIn('CoreShowChannels', [action.get('Action') for action in self.server.actions])
+        self.assertEqual(5, len(registry))
+
+        a_chan = registry.get_by_name('SIP/201-00000001')
+        local_one = registry.get_by_name('Local/202@default-00000001;1')
+        local_two = registry.get_by_uniqueid('resync-1.3')
+        b_chan = registry.get_by_uniqueid('resync-1.4')
+
+        self.assertTrue(a_chan.is_up)
+        self.assertIs(local_two, local_one._fwd_local_bridge)
+        self.assertEqual({local_one}, a_chan._bridged)
+        self.assertEqual({b_chan}, local_two._bridged)
+        self.assertFalse(registry.get_by_name('SIP/203-00000003').is_bridged)
+
+    def test_resync_keeps_known_channels(self):
+        """Test channels which are already tracked aren't replaced.
+        """
+        manager = ChannelManager(BaseReporter())
+        manager.on_event({
+            'Event': 'Newchannel',
+            'Channel': 'SIP/201-00000001',
+            'Uniqueid': 'resync-1.1',
+            'ChannelState': '0',
+            'Exten': '202',
+            'AccountCode': '',
+            'CallerIDName': '',
+            'CallerIDNum': '201',
+        })
+        known = manager._registry.get_by_uniqueid('resync-1.1')
+
+        channels = CHANNELS
+        added = manager.resync(channels)
+
+        self.assertEqual(4, len(added))
+        self.assertIs(known, manager._registry.get_by_uniqueid('resync-1.1'))
+
+
+class TestAmiRunnerResyncAmiClient(TestAmiRunnerResync):
+    manager_class = AmiClient
+
+
+class ListingManager(object):
+    """
+    An AMI manager whose CoreShowChannels response the test completes.
+    """
+    def __init__(self, loop):
+        self.channels = asyncio.Future(loop=loop)
+
+    def send_action(self, action, as_list=False):
+        return self.channels
+
+
+class TestAmiRunnerResyncOrder(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        if self.runner.queue is not None:
+            self.runner.queue.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def assert_hangup_after_list(self, **kwargs):
+        self.runner = AmiRunner([], BaseReporter(), filter_events=False, **kwargs)
+        self.runner.attach_all()
+        amimgr = ListingManager(self.loop)
+        manager = ChannelManager(BaseReporter())
+        self.runner._add_amimgr(amimgr, manager)
+
+        self.runner.on_event(amimgr, {'Event': 'FullyBooted'})
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertIn(amimgr, self.runner._resyncs)
+        # Read before the list is complete, so handled before it.
+        self.runner.on_event(amimgr, {
+            'Event': 'Newchannel', 'Channel': 'SIP/204-00000004', 'Uniqueid': 'resync-3.1', 'ChannelState': '4',
+            'Exten': '202', 'AccountCode': '', 'CallerIDName': '', 'CallerIDNum': '204'})
+        # The Hangup comes in the same read as the end of the list, before
+        # the callbacks of the response run.
+        amimgr.channels.set_result(CORE_SHOW_CHANNELS)
+        self.runner.on_event(amimgr, {
+            'Event': 'Hangup', 'Channel': 'SIP/203-00000003', 'Uniqueid': 'resync-2.1', 'Cause': '16'})
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+        registry = manager._registry
+        self.assertRaises(MissingChannel, registry.get_by_name, 'SIP/203-00000003')
+        self.assertEqual('resync-3.1', registry.get_by_name('SIP/204-00000004').uniqueid)
+        self.assertEqual(5, len(registry))
+        self.assertEqual({}, self.runner._resyncs)
+
+    def test_hangup_after_list(self):
+        """Test an event read after the channel list is handled after it.
+        """
+        self.assert_hangup_after_list()
+
+    def test_hangup_after_list_queued(self):
+        """Test the order is kept when the events are queued.
+        """
+        self.assert_hangup_after_list(queue_size=10)
+
+    def assert_hangup_while_listing(self, **kwargs):
+        self.runner = AmiRunner([], BaseReporter(), filter_events=False, **kwargs)
+        self.runner.attach_all()
+        amimgr = ListingManager(self.loop)
+        manager = ChannelManager(BaseReporter())
+        self.runner._add_amimgr(amimgr, manager)
+
+        self.runner.on_event(amimgr, {'Event': 'FullyBooted'})
+        self.loop.run_until_complete(asyncio.sleep(0))
+        # A listed channel hangs up while the list is on its way. The
+        # Hangup is handled first, so the channel must not be resynced.
+        self.runner.on_event(amimgr, {
+            'Event': 'Hangup', 'Channel': 'SIP/203-00000003', 'Uniqueid': 'resync-2.1', 'Cause': '16'})
+        self.loop.run_until_complete(asyncio.sleep(0))
+        amimgr.channels.set_result(CORE_SHOW_CHANNELS)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+        registry = manager._registry
+        self.assertRaises(MissingChannel, registry.get_by_name, 'SIP/203-00000003')
+        self.assertEqual(4, len(registry))
+        self.assertEqual({}, self.runner._resyncs)
+
+    def test_hangup_while_listing(self):
+        """Test a listed channel which hung up before the list came is left out.
+        """
+        self.assert_hangup_while_listing()
+
+    def test_hangup_while_listing_queued(self):
+        """Test a listed channel which hung up is left out when events are queued.
+        """
+        self.assert_hangup_while_listing(queue_size=10)
+
+
+class RecordingChannelManager(ChannelManager):
+    """
+    A manager which records the names of the events it gets.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+
+    def on_event(self, event):
+        self.events.append(event['Event'])
+        super().on_event(event)
+
+
+class AllEventsChannelManager(RecordingChannelManager):
+    INTERESTING_EVENTS = ('*',)
+
+
+NOISE = [
+    {'Event': 'VarSet', 'Channel': 'SIP/201-00000001', 'Variable': 'RTPAUDIOQOS', 'Value': ''},
+    {'Event': 'Newexten', 'Channel': 'SIP/201-00000001', 'Extension': '202', 'Application': 'Dial'},
+    {'Event': 'HangupRequest', 'Channel': 'SIP/201-00000001', 'Uniqueid': 'filter-1.1'},
+]
+
+CALL = [
+    {'Event': 'Newchannel', 'Channel': 'SIP/201-00000001', 'Uniqueid': 'filter-1.1', 'ChannelState': '4',
+     'Exten': '202', 'AccountCode': '', 'CallerIDName': '', 'CallerIDNum': '201'},
+    {'Event': 'Hangup', 'Channel': 'SIP/201-00000001', 'Uniqueid': 'filter-1.1', 'Cause': '16'},
+]
+
+
+class TestAmiRunnerFilter(TestCase):
+    manager_class = Manager
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.server = FakeAmiServer(loop=self.loop)
+        self.server.start()
+
+    def tearDown(self):
+        for amimgr in getattr(self.runner, 'amimgrs', ()):
+            amimgr.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.fail('timed out')
+
+    def attach(self, channel_manager, **kwargs):
+        self.runner = AmiRunner([{
+            'host': '127.0.0.1',
+            'port': self.server.port,
+            'username': 'cacofonisk',
+            'password': 'secret',
+        }], BaseReporter(), channel_manager=channel_manager, resync=False, manager_class=self.manager_class,
+            **kwargs)
+        self.runner.attach_all()
+        self.manager = next(iter(self.runner.amimgrs.values()))
+        self.run_until(lambda: 'FullyBooted' in self.manager.events)
+        # Let the Filter action, if any, be answered.
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        return self.server.clients[-1]
+
+    def test_filter(self):
+        """Test Asterisk only sends the interesting events once we're booted.
+        """
+        client = self.attach(RecordingChannelManager)
+
+        filters = [action for action in self.server.actions if action.get('Action') == 'Filter']
+        self.assertEqual(1, len(filters))
+        self.assertEqual(event_filter(ChannelManager.INTERESTING_EVENTS), filters[0]['Filter'])
+        self.assertEqual(1, len(client.filters))
+
+        for event in NOISE + CALL:
+            self.server.send_event(event)
+        self.run_until(lambda: 'Hangup' in self.manager.events)
+
+        self.assertEqual(['FullyBooted', 'Newchannel', 'Hangup'], self.manager.events)
+        self.assertEqual(len(NOISE), client.filtered)
+
+    def test_no_filter(self):
+        """Test no filter is added for all events, or when it's turned off.
+        """
+        client = self.attach(AllEventsChannelManager)
+        self.assertFalse(client.filters)
+        self.runner.amimgrs.popitem()[0].close()
+
+        client = self.attach(RecordingChannelManager, filter_events=False)
+        self.assertFalse(client.filters)
+
+        self.assertNotIn('Filter', [action.get('Action') for action in self.server.actions])
+
+
+class TestAmiRunnerFilterAmiClient(TestAmiRunnerFilter):
+    manager_class = AmiClient
+
+
+class TestEventFilter(TestCase):
+
+    def test_event_filter(self):
+        """Test the filter matches the event names as a whole.
+        """
+        regex, negate = compile_filter(event_filter(['Hangup', 'Newchannel']))
+        self.assertFalse(negate)
+
+        self.assertTrue(regex.search(format_message(CALL[1]).decode('utf8')))
+        self.assertTrue(regex.search(format_message(CALL[0]).decode('utf8')))
+        for event in NOISE:
+            self.assertFalse(regex.search(format_message(event).decode('utf8')))
+
+        self.assertIsNone(event_filter(['*', 'Hangup']))
@@ -0,0 +1,220 @@
+import asyncio
+from unittest import TestCase
+
+from cacofonisk import AmiClient, AmiRunner, AsyncBaseReporter, BaseReporter
+from cacofonisk.reporters.async_reporter import TaskReporter
+from cacofonisk.utils.fakeami import FakeAmiServer
+
+from .test_partition import call_events, interleave
+
+
+class SleepingReporter(AsyncBaseReporter):
+    """
+    A reporter with coroutine hooks, which records how many run at once.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.calls = []
+        self.running = 0
+        self.most_running = 0
+        self.closed = False
+
+    async def _call(self, *call):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if call[-1] == 'fail':
+            raise ValueError(call)
+        self.calls.append(call)
+
+    async def on_up(self, call_id, caller, to_number, callee):
+        await self._call('on_up', call_id)
+
+    async def on_hangup(self, call_id, caller, to_number, reason):
+        await self._call('on_hangup', call_id, reason)
+
+    def trace_msg(self, msg):
+        self.calls.append(('trace_msg', msg))
+
+    def close(self):
+        self.closed = True
+
+
+class TestTaskReporter(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_max_tasks(self):
+        """Test at most max_tasks coroutines run at a time, and all run.
+        """
+        reporter = SleepingReporter(self.loop)
+        tasks = TaskReporter(reporter, self.loop, max_tasks=3)
+        for number in range(10):
+            tasks.on_hangup('call-{}'.format(number), None, '202', 'completed')
+        tasks.trace_msg('sync')
+
+        self.assertEqual([('trace_msg', 'sync')], reporter.calls)
+        self.assertEqual({'running': 3, 'waiting': 7, 'max_tasks': 3, 'max_waiting': 10000, 'high_water': 3,
+                          'completed': 0, 'errors': 0, 'dropped': 0}, tasks.stats())
+
+        self.loop.run_until_complete(tasks.drain())
+        tasks.close()
+
+        self.assertEqual(3, reporter.most_running)
+        self.assertEqual(['call-{}'.format(number) for number in range(10)],
+                         [call[1] for call in reporter.calls if call[0] == 'on_hangup'])
+        self.assertEqual(10, tasks.completed)
+        self.assertTrue(reporter.closed)
+
+    def test_waiting_calls(self):
+        """Test waiting calls keep their arguments, and plain hooks are called right away.
+        """
+        reporter = SleepingReporter(self.loop)
+        plain = []
+        reporter.on_up = lambda call_id, caller, to_number, callee: plain.append(call_id)
+        tasks = TaskReporter(reporter, self.loop, max_tasks=2)
+        for number in range(4):
+            tasks.on_hangup('call-{}'.format(number), None, '202', 'completed')
+        tasks.on_up('call-9', None, '202', None)
+
+        self.assertEqual(['call-9'], plain)
+        self.assertEqual([
+            ('call-2', 'on_hangup', ('call-2', None, '202', 'completed')),
+            ('call-3', 'on_hangup', ('call-3', None, '202', 'completed')),
+        ], list(tasks._waiting))
+
+        self.loop.run_until_complete(tasks.drain())
+        self.assertEqual(4, tasks.completed)
+
+    def test_per_call_order(self):
+        """Test the hooks of one call run one after the other, in order.
+        """
+        class SlowUpReporter(SleepingReporter):
+            async def on_up(self, call_id, caller, to_number, callee):
+                await asyncio.sleep(0.03)
+                await self._call('on_up', call_id)
+
+        reporter = SlowUpReporter(self.loop)
+        tasks = TaskReporter(reporter, self.loop, max_tasks=10, max_waiting=2)
+        for number in range(2):
+            tasks.on_up('call-{}'.format(number), None, '202', None)
+            tasks.on_hangup('call-{}'.format(number), None, '202', 'completed')
+        self.assertEqual((2, 2), (tasks.running, tasks.stats()['waiting']))
+        with self.assertLogs('cacofonisk.reporters.async_reporter', 'WARNING'):
+            tasks.on_hangup('call-0', None, '202', 'completed')
+        self.assertEqual(1, tasks.dropped)
+
+        self.loop.run_until_complete(tasks.drain())
+        self.assertEqual(2, reporter.most_running)
+        for number in range(2):
+            call_id = 'call-{}'.format(number)
+            self.assertEqual(['on_up', 'on_hangup'], [call[0] for call in reporter.calls if call[1] == call_id])
+        self.assertEqual({}, tasks._held)
+
+    def test_max_waiting(self):
+        """Test the calls past max_waiting are dropped, counted and logged once.
+        """
+        reporter = SleepingReporter(self.loop)
+        tasks = TaskReporter(reporter, self.loop, max_tasks=2, max_waiting=3)
+        with self.assertLogs('cacofonisk.reporters.async_reporter', 'WARNING') as logs:
+            for number in range(10):
+                tasks.on_hangup('call-{}'.format(number), None, '202', 'completed')
+        self.assertEqual(1, len(logs.output))
+
+        stats = tasks.stats()
+        self.assertEqual((2, 3, 5), (stats['running'], stats['waiting'], stats['dropped']))
+
+        self.loop.run_until_complete(tasks.drain())
+        self.assertEqual(['call-{}'.format(number) for number in range(5)],
+                         [call[1] for call in reporter.calls if call[0] == 'on_hangup'])
+
+        # Once the waiting calls caught up, a new drop is logged again.
+        with self.assertLogs('cacofonisk.reporters.async_reporter', 'WARNING'):
+            for number in range(6):
+                tasks.on_hangup('call-{}'.format(number), None, '202', 'completed')
+        self.assertEqual(6, tasks.dropped)
+        self.loop.run_until_complete(tasks.drain())
+
+    def test_errors(self):
+        """Test a failing coroutine is logged and counted.
+        """
+        tasks = TaskReporter(SleepingReporter(self.loop), self.loop)
+        with self.assertLogs('cacofonisk.reporters.async_reporter'):
+            tasks.on_hangup('call-1', None, '202', 'fail')
+            tasks.on_hangup('call-2', None, '202', 'completed')
+            self.loop.run_until_complete(tasks.drain())
+
+        self.assertEqual(1, tasks.errors)
+        self.assertEqual(2, tasks.completed)
+        self.loop.run_until_complete(asyncio.wait_for(tasks.drain(), 1))
+
+    def test_hooks(self):
+        """Test only the hooks the reporter overrides are called.
+        """
+        tasks = TaskReporter(SleepingReporter(self.loop), self.loop)
+        self.assertTrue(tasks.overrides('on_up'))
+        self.assertFalse(tasks.overrides('on_b_dial'))
+        self.assertTrue(tasks.wants_trace_msg)
+        self.assertRaises(ValueError, TaskReporter, SleepingReporter(self.loop), self.loop, max_tasks=0)
+        self.assertRaises(ValueError, TaskReporter, SleepingReporter(self.loop), self.loop, max_waiting=-1)
+
+
+class TestAmiRunnerAsyncReporter(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.server = FakeAmiServer(loop=self.loop)
+        self.server.start()
+
+    def tearDown(self):
+        for amimgr in getattr(self.runner, 'amimgrs', ()):
+            amimgr.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_runner(self):
+        """Test the AmiRunner runs the coroutine hooks of its reporter.
+        """
+        reporter = SleepingReporter(self.loop)
+        self.runner = AmiRunner([{
+            'host': '127.0.0.1',
+            'port': self.server.port,
+            'username': 'cacofonisk',
+            'password': 'secret',
+        }], reporter, resync=False, manager_class=AmiClient, max_tasks=2)
+        self.assertIsInstance(self.runner.reporter, TaskReporter)
+        self.runner.attach_all()
+
+        amimgr = next(iter(self.runner.amimgrs))
+        for _ in range(500):
+            if amimgr.authenticated:
+                break
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+        for event in interleave(call_events(1, 2), call_events(3, 4), call_events(5, 6))[1:]:
+            self.server.send_event(event)
+        for _ in range(500):
+            if self.runner.reporter.completed == 6:
+                break
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.run_until_complete(self.runner.reporter.drain())
+
+        self.assertEqual(2, reporter.most_running)
+        self.assertEqual(
+            [('on_up', 'test-1.1'), ('on_up', 'test-3.1'), ('on_up', 'test-5.1')],
+            [call for call in reporter.calls if call[0] == 'on_up'])
+        self.assertEqual(3, sum(1 for call in reporter.calls if call[0] == 'on_hangup'))
+
+    def test_sync_reporter(self):
+        """Test a synchronous reporter is used as it is.
+        """
+        reporter = BaseReporter()
+        self.runner = AmiRunner([], reporter)
+        self.assertIs(reporter, self.runner.reporter)
@@ -0,0 +1,394 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from cacofonisk import BaseReporter, FileRunner, JsonReporter
+from cacofonisk.runners.capture import (
+    create_capture, detect_compression, follow_events, iter_event_offsets, iter_json_array, map_events, read_events)
+
+EVENTS = [
+    {'Event': 'FullyBooted', 'Status': 'Fully Booted'},
+    {'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': '[{"a": 1}, "]"]'},
+    {'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': 'x' * 100},
+]
+
+
+class EventReporter(BaseReporter):
+    def __init__(self):
+        self.events = []
+
+    def on_event(self, event):
+        self.events.append(event)
+
+
+class TestReadEvents(TestCase):
+
+    def test_json_array(self):
+        """Test JSON arrays are read, however they are formatted.
+        """
+        captures = (
+            json.dumps(EVENTS),
+            json.dumps(EVENTS, indent=4),
+            '[' + ','.join('\n  ' + json.dumps(event) for event in EVENTS) + '\n]\n',
+        )
+
+        for capture in captures:
+            for chunk_size in (1, 7, 4096):
+                events = list(read_events(io.StringIO(capture), chunk_size=chunk_size))
+                self.assertEqual(EVENTS, events)
+
+    def test_empty_json_array(self):
+        """Test an empty JSON array holds no events.
+        """
+        self.assertEqual([], list(read_events(io.StringIO(' [ ] '))))
+
+    def test_ndjson(self):
+        """Test line-delimited JSON is read.
+        """
+        capture = '\n' + '\n'.join(json.dumps(event) for event in EVENTS) + '\n\n'
+
+        self.assertEqual(EVENTS, list(read_events(io.StringIO(capture))))
+
+    def test_streaming(self):
+        """Test events are yielded before the rest of the capture is read.
+        """
+        capture = io.StringIO(json.dumps(EVENTS * 1000))
+        events = read_events(capture, chunk_size=256)
+
+        self.assertEqual(EVENTS[0], next(events))
+        self.assertLess(capture.tell(), 1024)
+
+    def test_unterminated_json_array(self):
+        """Test the events of a cut off capture are read before it fails.
+        """
+        capture = json.dumps(EVENTS)[:-1]
+        events = []
+
+        with self.assertRaises(ValueError):
+            for event in iter_json_array(io.StringIO(capture), chunk_size=16):
+                events.append(event)
+
+        self.assertEqual(EVENTS, events)
+
+    def test_invalid_json_array(self):
+        """Test junk between the events is rejected.
+        """
+        capture = io.StringIO('[{"Event": "FullyBooted"} {"Event": "FullyBooted"}]')
+
+        self.assertRaises(ValueError, list, read_events(capture))
+
+
+class TestFileRunner(TestCase):
+
+    def test_ndjson_file(self):
+        """Test the FileRunner replays line-delimited JSON files.
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            for event in EVENTS:
+                f.write(json.dumps(event) + '\n')
+        self.addCleanup(os.remove, f.name)
+
+        reporter = EventReporter()
+        FileRunner(f.name, reporter).run()
+
+        self.assertEqual(EVENTS, reporter.events)
+
+
+class TestCompression(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_capture(self, filename, compression=None):
+        path = os.path.join(self.directory.name, filename)
+        reporter = JsonReporter(path, compression=compression, timestamps=False)
+        for event in EVENTS:
+            reporter.trace_ami(event)
+        reporter.close()
+        return path
+
+    def replay(self, path):
+        reporter = EventReporter()
+        FileRunner(path, reporter).run()
+        return reporter.events
+
+    def test_compressed_round_trip(self):
+        """Test compressed captures written by the JsonReporter are replayed.
+        """
+        for filename, compression in (
+                ('capture.json', None),
+                ('capture.json.gz', 'gzip'),
+                ('capture.json.bz2', 'bz2'),
+                ('capture.json.xz', 'xz')):
+            path = self.write_capture(filename)
+
+            self.assertEqual(compression, detect_compression(path))
+            self.assertEqual(EVENTS, self.replay(path))
+
+    def test_detect_by_content(self):
+        """Test the compression is detected from the content, not the name.
+        """
+        path = self.write_capture('capture.json', compression='xz')
+
+        self.assertEqual('xz', detect_compression(path))
+        self.assertEqual(EVENTS, self.replay(path))
+
+    def test_unsupported_compression(self):
+        """Test an unknown compression is rejected.
+        """
+        path = os.path.join(self.directory.name, 'capture.json.zip')
+
+        self.assertRaises(ValueError, create_capture, path, 'zip')
+
+
+class TestEventOffsets(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, filename, data):
+        path = os.path.join(self.directory.name, filename)
+        with (gzip.open if filename.endswith('.gz') else open)(path, 'wb') as f:
+            f.write(data.encode('utf8'))
+        return path
+
+    def assert_resumable(self, path, events):
+        read = list(iter_event_offsets(path))
+        self.assertEqual(events, [event for event, offset in read])
+
+        for index, (event, offset) in enumerate(read):
+            self.assertEqual(events[index + 1:], [event for event, offset in iter_event_offsets(path, offset)])
+
+    def test_json_array(self):
+        """Test a JSON array is read on from every offset, however it is formatted.
+        """
+        events = EVENTS + [
+            {'Event': 'Newchannel', 'CallerIDName': 'J\xf6rg M\xfcller \u260e'},
+            {'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': '\xe9' * 40000},
+            {'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': '\u2026]'},
+        ]
+        lines = [json.dumps(event, ensure_ascii=False) for event in events]
+        for filename, data in (
+                ('compact.json', json.dumps(events)),
+                ('indented.json.gz', json.dumps(events, indent=2, ensure_ascii=False)),
+                ('crlf.json', '[\r\n' + ',\r\n'.join(lines) + '\r\n]\r\n')):
+            self.assert_resumable(self.write_file(filename, data), events)
+
+    def test_json_reporter(self):
+        """Test captures written by the JsonReporter are read on from every offset.
+        """
+        path = os.path.join(self.directory.name, 'capture.json.gz')
+        reporter = JsonReporter(path, timestamps=False)
+        for event in EVENTS:
+            reporter.trace_ami(event)
+        reporter.close()
+
+        self.assert_resumable(path, EVENTS)
+
+    def test_ndjson(self):
+        """Test line-delimited captures are read on from every offset.
+        """
+        path = self.write_file('capture.ndjson', '\n' + ''.join(json.dumps(event) + '\n' for event in EVENTS))
+        self.assert_resumable(path, EVENTS)
+
+
+class TestMapEvents(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, data, filename='capture.ndjson'):
+        path = os.path.join(self.directory.name, filename)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_all_events(self):
+        """Test all events are read without names, even the last line without a newline.
+        """
+        path = self.write_file('\n'.join(json.dumps(event) for event in EVENTS))
+
+        self.assertEqual(EVENTS, list(map_events(path)))
+
+    def test_filter(self):
+        """Test only the events with the given names are read.
+        """
+        events = [
+            {'Event': 'VarSet', 'Variable': 'A'},
+            {'Event': 'Newchannel', 'Channel': 'SIP/201-00000001'},
+            {'Variable': 'B', 'Event': 'VarSet'},
+            {'Event': 'Hangup', 'Channel': 'SIP/201-00000001', 'Data': '"Event": "Hangup"'},
+            {'Event': 'Newexten'},
+        ]
+        lines = [json.dumps(event) for event in events]
+        # Written with other separators, and with an escaped name.
+        lines.insert(1, '{"Event":"Newstate"}')
+        lines.insert(1, '{"Event": "VarSet\\u0021"}')
+        lines.insert(0, '')
+
+        path = self.write_file('\n'.join(lines) + '\n')
+
+        self.assertEqual(
+            [{'Event': 'Newstate'}, events[1], events[3]],
+            list(map_events(path, {'Newchannel', 'Newstate', 'Hangup'})))
+        self.assertEqual(
+            [{'Event': 'VarSet!'}],
+            list(map_events(path, {'VarSet!'})))
+
+    def test_other_captures(self):
+        """Test JSON arrays, compressed and empty captures are read too.
+        """
+        array = self.write_file(json.dumps(EVENTS, indent=2), 'capture.json')
+        with create_capture(os.path.join(self.directory.name, 'capture.ndjson.gz')) as f:
+            f.write(''.join(json.dumps(event) + '\n' for event in EVENTS))
+        empty = self.write_file('', 'empty.ndjson')
+
+        for path in (array, f.name):
+            self.assertEqual(EVENTS, list(map_events(path)))
+            self.assertEqual(EVENTS[:1], list(map_events(path, {'FullyBooted'})))
+        self.assertEqual([], list(map_events(empty)))
+
+    def test_close_early(self):
+        """Test the capture can be closed before all events are read.
+        """
+        lines = [json.dumps({'Event': 'VarSet' if i % 3 else 'Newstate', 'Value': i}) for i in range(30)]
+        lines.insert(10, '{"Event":"VarSet"}')
+        path = self.write_file('\n'.join(lines))
+
+        for names in (None, {'Newstate'}):
+            for count in range(1, 8):
+                events = map_events(path, names)
+                for i in range(count):
+                    next(events)
+                events.close()
+
+    def test_invalid_line(self):
+        """Test a line which isn't JSON is rejected.
+        """
+        path = self.write_file('{"Event": "FullyBooted"}\n{"Event": "Newstate"\n')
+
+        self.assertRaises(ValueError, list, map_events(path, {'Newstate'}))
+
+    def test_file_runner(self):
+        """Test the FileRunner passes the interesting events with use_mmap.
+        """
+        events = [{'Event': 'VarSet', 'Variable': 'A'}] + EVENTS
+        path = self.write_file(''.join(json.dumps(event) + '\n' for event in events))
+
+        reporter = EventReporter()
+        FileRunner(path, reporter, use_mmap=True).run()
+
+        self.assertEqual(EVENTS, reporter.events)
+
+
+class TestFollowEvents(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'capture.ndjson')
+
+        # Never hang the tests.
+        self.stop = threading.Event()
+        timer = threading.Timer(10, self.stop.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def follow(self):
+        events = follow_events(self.path, self.stop, poll_interval=0.005, max_poll_interval=0.02)
+        self.addCleanup(events.close)
+        return events
+
+    def append(self, data, path=None):
+        with open(path or self.path, 'a') as f:
+            f.write(data)
+
+    def test_appended_lines(self):
+        """Test lines are read as they are appended, and only when whole.
+        """
+        events = self.follow()
+        lines = [json.dumps(event) + '\n' for event in EVENTS]
+
+        self.append(lines[0])
+        self.assertEqual(EVENTS[0], next(events))
+
+        self.append(lines[1][:10])
+        threading.Timer(0.05, self.append, (lines[1][10:] + lines[2],)).start()
+        self.assertEqual(EVENTS[1], next(events))
+        self.assertEqual(EVENTS[2], next(events))
+
+    def test_rotation(self):
+        """Test the new file is read after the capture is moved away.
+        """
+        events = self.follow()
+        self.append(json.dumps(EVENTS[0]) + '\n')
+        self.assertEqual(EVENTS[0], next(events))
+
+        self.append(json.dumps(EVENTS[1]) + '\n')
+        os.rename(self.path, self.path + '.1')
+        self.append(json.dumps(EVENTS[2]) + '\n')
+
+        self.assertEqual(EVENTS[1], next(events))
+        self.assertEqual(EVENTS[2], next(events))
+
+    def test_truncation(self):
+        """Test the file is read from the start after it is truncated.
+        """
+        events = self.follow()
+        self.append(json.dumps(EVENTS[2]) + '\n')
+        self.assertEqual(EVENTS[2], next(events))
+
+        with open(self.path, 'w') as f:
+            f.write(json.dumps(EVENTS[0]) + '\n')
+
+        self.assertEqual(EVENTS[0], next(events))
+
+    def test_json_reporter(self):
+        """Test a capture is followed while the JsonReporter writes it.
+        """
+        events = self.follow()
+
+        reporter = JsonReporter(self.path, timestamps=False, flush=True)
+        reporter.trace_ami(EVENTS[0])
+        reporter.trace_ami(EVENTS[1])
+        self.assertEqual(EVENTS[:2], [next(events), next(events)])
+
+        reporter.close()
+        os.rename(self.path, self.path + '.1')
+        reporter = JsonReporter(self.path, timestamps=False, flush=True)
+        reporter.trace_ami(EVENTS[2])
+        self.assertEqual(EVENTS[2], next(events))
+        reporter.close()
+
+    def test_stop(self):
+        """Test following ends when stop is set, also before the file exists.
+        """
+        events = self.follow()
+        threading.Timer(0.05, self.stop.set).start()
+        self.assertEqual([], list(events))
+
+    def test_file_runner(self):
+        """Test the FileRunner follows a capture until it is stopped.
+        """
+        self.append(''.join(json.dumps(event) + '\n' for event in EVENTS))
+        reporter = EventReporter()
+        runner = FileRunner(self.path, reporter, follow=True)
+
+        thread = threading.Thread(target=runner.run)
+        thread.start()
+        while len(reporter.events) < len(EVENTS) and not self.stop.wait(0.01):
+            pass
+        runner.stop()
+        thread.join()
+
+        self.assertEqual(EVENTS, reporter.events)
+        self.assertEqual(1, len(runner.channel_managers))
+        self.assertRaises(ValueError, FileRunner, [self.path, self.path], reporter, follow=True)
+        self.assertRaises(ValueError, FileRunner, self.path, reporter, follow=True, use_mmap=True)
@@ -0,0 +1,142 @@
+from unittest import TestCase
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import FLAG_IGNORE_A_HANGUP, FLAG_IGNORE_B_DIAL, Channel, ChannelManager
+
+
+def new_channel(manager, name, uniqueid):
+    return Channel({
+        'Channel': name,
+        'Uniqueid': uniqueid,
+        'ChannelState': '0',
+        'Exten': '201',
+        'AccountCode': '',
+        'CallerIDName': '',
+        'CallerIDNum': '201',
+    }, channel_manager=manager)
+
+
+class TestChannel(TestCase):
+
+    def setUp(self):
+        self.manager = ChannelManager(BaseReporter())
+
+    def test_slots(self):
+        """Test channels are slotted and have no markers until used.
+        """
+        channel = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+
+        self.assertFalse(hasattr(channel, '__dict__'))
+        self.assertIsNone(channel._markers)
+        self.assertFalse(channel.has_flag(FLAG_IGNORE_B_DIAL))
+        self.assertFalse(channel.pop_flag(FLAG_IGNORE_B_DIAL))
+        self.assertIsNone(channel.pop_raw_blind_transfer())
+        self.assertIsNone(channel._markers)
+
+    def test_flags(self):
+        """Test the markers are independent of each other.
+        """
+        channel = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        channel.set_flag(FLAG_IGNORE_B_DIAL)
+        channel.set_flag(FLAG_IGNORE_A_HANGUP)
+
+        self.assertTrue(channel.pop_flag(FLAG_IGNORE_B_DIAL))
+        self.assertFalse(channel.pop_flag(FLAG_IGNORE_B_DIAL))
+        self.assertTrue(channel.has_flag(FLAG_IGNORE_A_HANGUP))
+        self.assertEqual({}, channel.custom)
+
+    def test_masquerade_shares_markers(self):
+        """Test the original shares the markers and custom data of the clone.
+        """
+        original = new_channel(self.manager, 'Local/201@test-00000001;1', 'test-1.1')
+        clone = new_channel(self.manager, 'SIP/201-00000002', 'test-2.1')
+        original.custom['foo'] = 'original'
+        original.set_flag(FLAG_IGNORE_B_DIAL)
+        clone.custom['foo'] = 'clone'
+
+        original.do_masquerade(clone)
+
+        self.assertEqual({'foo': 'clone'}, original.custom)
+        self.assertFalse(original.has_flag(FLAG_IGNORE_B_DIAL))
+
+        # Writing to the soon to be destroyed clone still reaches original.
+        clone.custom['bar'] = True
+        clone.set_flag(FLAG_IGNORE_A_HANGUP)
+        clone.set_raw_blind_transfer(clone)
+        self.assertTrue(original.custom['bar'])
+        self.assertTrue(original.has_flag(FLAG_IGNORE_A_HANGUP))
+        self.assertIs(clone, original.pop_raw_blind_transfer())
+
+    def _local_pair(self, index):
+        one = new_channel(self.manager, 'Local/{}@test-{:08x};1'.format(index, index), 'local-{}.1'.format(index))
+        two = new_channel(self.manager, 'Local/{}@test-{:08x};2'.format(index, index), 'local-{}.2'.format(index))
+        one.do_localbridge(two)
+        return one, two
+
+    def test_dialing_channel_deep_chain(self):
+        """Test deep chains of Local channels don't hit the recursion limit.
+        """
+        a_chan = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        dialing = a_chan
+        for i in range(5000):
+            one, two = self._local_pair(i)
+            dialing.do_dial(one)
+            dialing = two
+        b_chan = new_channel(self.manager, 'SIP/202-00000002', 'test-2.1')
+        dialing.do_dial(b_chan)
+
+        self.assertIs(a_chan, b_chan.get_dialing_channel())
+        self.assertEqual([b_chan], a_chan.get_dialed_channels())
+
+    def test_dialed_channels_ring_group(self):
+        """Test all targets of a ring group behind Local channels are found.
+        """
+        a_chan = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        group_one, group_two = self._local_pair(0)
+        a_chan.do_dial(group_one)
+
+        b_chans = []
+        for i in range(1, 501):
+            one, two = self._local_pair(i)
+            group_two.do_dial(one)
+            b_chan = new_channel(self.manager, 'SIP/{}-{:08x}'.format(i, i), 'test-{}.2'.format(i))
+            two.do_dial(b_chan)
+            b_chans.append(b_chan)
+
+        self.assertEqual(b_chans, a_chan.get_dialed_channels())
+        self.assertEqual(b_chans, group_one.get_dialed_channels())
+
+    def test_dialed_channels_order(self):
+        """Test the dialed channels come out in the order they were dialed.
+        """
+        a_chan = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        # Dialed first, but the highest uniqueid.
+        first = new_channel(self.manager, 'SIP/203-00000003', 'test-9.1')
+        a_chan.do_dial(first)
+        one, two = self._local_pair(1)
+        a_chan.do_dial(one)
+        second = new_channel(self.manager, 'SIP/204-00000004', 'test-5.1')
+        third = new_channel(self.manager, 'SIP/202-00000002', 'test-2.1')
+        two.do_dial(second)
+        two.do_dial(third)
+        fourth = new_channel(self.manager, 'SIP/205-00000005', 'test-1.2')
+        a_chan.do_dial(fourth)
+
+        self.assertEqual([first, second, third, fourth], a_chan.get_dialed_channels())
+
+    def test_dialing_channel_forgotten(self):
+        """Test the cached dialing channel follows dials and hangups.
+        """
+        a_chan = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        one, two = self._local_pair(1)
+        b_chan = new_channel(self.manager, 'SIP/202-00000002', 'test-2.1')
+        two.do_dial(b_chan)
+
+        self.assertIs(one, b_chan.get_dialing_channel())
+
+        a_chan.do_dial(one)
+        self.assertIs(a_chan, b_chan.get_dialing_channel())
+
+        one.do_hangup({})
+        self.assertIs(two, b_chan.get_dialing_channel())
+        self.assertIs(one, one.get_dialing_channel())
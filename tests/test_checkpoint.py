@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from cacofonisk import FileRunner, JsonReporter
+from cacofonisk.channel import ChannelManager
+from cacofonisk.runners.capture import create_capture
+from cacofonisk.runners.checkpoint import Checkpoint, load_checkpoint, save_checkpoint
+
+from .test_partition import CallReporter, call_events, interleave
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingReporter(CallReporter):
+    """
+    A reporter which crashes after a number of calls.
+    """
+    def __init__(self, crash_after):
+        super().__init__()
+        self.crash_after = crash_after
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        super().on_hangup(call_id, caller, to_number, reason)
+        if len(self.calls) >= self.crash_after:
+            raise Crash()
+
+
+class TestCheckpoints(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.checkpoint = os.path.join(self.directory.name, 'checkpoint')
+
+        self.files = [
+            self.write_capture('one.ndjson', interleave(call_events(1, 2), call_events(3, 4))),
+            self.write_capture('two.ndjson.gz', interleave(call_events(5, 6), call_events(7, 8), call_events(9, 10))),
+        ]
+
+        self.expected = CallReporter()
+        FileRunner(self.files, self.expected).run()
+
+    def write_capture(self, filename, events):
+        path = os.path.join(self.directory.name, filename)
+        with create_capture(path) as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        return path
+
+    def write_json_capture(self, filename, events):
+        path = os.path.join(self.directory.name, filename)
+        reporter = JsonReporter(path, timestamps=False)
+        for event in events:
+            reporter.trace_ami(event)
+        reporter.close()
+        return path
+
+    def assert_resumes(self, files):
+        expected = CallReporter()
+        FileRunner(files, expected).run()
+
+        for crash_after in range(5, len(expected.calls), 4):
+            crashing = CrashingReporter(crash_after)
+            runner = FileRunner(files, crashing, checkpoint=self.checkpoint, checkpoint_interval=3)
+            self.assertRaises(Crash, runner.run)
+            self.assertIsNotNone(load_checkpoint(self.checkpoint))
+
+            resumed = CallReporter()
+            FileRunner(files, resumed, checkpoint=self.checkpoint, checkpoint_interval=3).run()
+
+            # What came before the checkpoint is not repeated, the rest is.
+            before = len(expected.calls) - len(resumed.calls)
+            self.assertLessEqual(before, len(crashing.calls))
+            self.assertEqual(expected.calls[:before], crashing.calls[:before])
+            self.assertEqual(expected.calls[before:], resumed.calls)
+            self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        """Test a run continues from the last checkpoint, in any file.
+        """
+        self.assert_resumes(self.files)
+
+    def test_resume_json_array(self):
+        """Test a run continues from the last checkpoint in captures written by the JsonReporter.
+        """
+        self.assert_resumes([
+            self.write_json_capture('one.json', interleave(call_events(1, 2), call_events(3, 4))),
+            self.write_json_capture('two.json.gz', interleave(call_events(5, 6), call_events(7, 8))),
+        ])
+
+    def test_flush(self):
+        """Test what the reporter wrote before a checkpoint is flushed.
+        """
+        path = os.path.join(self.directory.name, 'rewritten.json')
+
+        class CrashingJsonReporter(JsonReporter):
+            def on_hangup(self, call_id, caller, to_number, reason):
+                raise Crash()
+
+        reporter = CrashingJsonReporter(path)
+        self.addCleanup(reporter.close)
+        runner = FileRunner(self.files[:1], reporter, checkpoint=self.checkpoint, checkpoint_interval=3)
+        self.assertRaises(Crash, runner.run)
+
+        checkpoint = load_checkpoint(self.checkpoint)
+        with open(self.files[0], 'rb') as f:
+            before = f.read(checkpoint.offset).count(b'\n')
+        with open(path) as f:
+            written = f.read().count('"Event"')
+        self.assertGreater(before, 0)
+        self.assertGreaterEqual(written, before)
+
+    def test_open_channels(self):
+        """Test the open channels are saved and restored.
+        """
+        # Crash at the first hangup in the second file, while the other
+        # calls are up.
+        answered = self.expected.calls.index(('on_up', 'test-7.1', '208'))
+        runner = FileRunner(self.files, CrashingReporter(answered), checkpoint=self.checkpoint, checkpoint_interval=1)
+        self.assertRaises(Crash, runner.run)
+
+        checkpoint = load_checkpoint(self.checkpoint)
+        self.assertEqual(self.files[1], checkpoint.filename)
+
+        channel_manager = ChannelManager(CallReporter())
+        channels = channel_manager.load_channels(checkpoint.channels)
+        self.assertTrue(channels)
+        self.assertEqual(len(channels), len(channel_manager._registry))
+        self.assertTrue(all(channel._channel_manager is channel_manager for channel in channels))
+
+    def test_invalid(self):
+        """Test checkpoints are refused where they can't work.
+        """
+        save_checkpoint(self.checkpoint, Checkpoint('other.ndjson', 0, None))
+        self.assertRaises(ValueError, FileRunner(self.files, CallReporter(), checkpoint=self.checkpoint).run)
+        os.remove(self.checkpoint)
+
+        self.assertRaises(ValueError, FileRunner, self.files, CallReporter(), checkpoint=self.checkpoint, processes=2)
+
+        with open(self.checkpoint, 'wb') as f:
+            f.write(b'\x80\x04N.')
+        self.assertRaises(ValueError, load_checkpoint, self.checkpoint)
@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+from cacofonisk import BaseReporter
+from cacofonisk.channel import ChannelManager, DebugChannelManager, handles
+
+
+class TestEventDispatch(TestCase):
+
+    def test_interesting_events_from_handlers(self):
+        """Test INTERESTING_EVENTS holds exactly the handled events.
+        """
+        self.assertIsInstance(ChannelManager.INTERESTING_EVENTS, frozenset)
+        self.assertEqual(set(ChannelManager._event_handlers), ChannelManager.INTERESTING_EVENTS)
+        self.assertIn('Newchannel', ChannelManager.INTERESTING_EVENTS)
+        self.assertNotIn('DialEnd', ChannelManager.INTERESTING_EVENTS)
+        self.assertEqual(frozenset(('*',)), DebugChannelManager.INTERESTING_EVENTS)
+
+    def test_subclass_handlers(self):
+        """Test subclasses can add and override handlers.
+        """
+        class MyChannelManager(ChannelManager):
+            @handles('Newexten')
+            def _on_newexten(self, event):
+                self.seen.append(event['Event'])
+
+            @handles('FullyBooted')
+            def _on_booted(self, event):
+                self.seen.append(event['Event'])
+
+        manager = MyChannelManager(BaseReporter())
+        manager.seen = []
+        manager.on_event({'Event': 'Newexten'})
+        manager.on_event({'Event': 'FullyBooted'})
+
+        self.assertEqual(['Newexten', 'FullyBooted'], manager.seen)
+        self.assertIn('Newexten', MyChannelManager.INTERESTING_EVENTS)
+        self.assertNotIn('Newexten', ChannelManager.INTERESTING_EVENTS)
+        self.assertIs(ChannelManager._on_fully_booted, ChannelManager._event_handlers['FullyBooted'])
+
+    def test_no_substring_match(self):
+        """Test only the Bridge event itself reaches the Bridge handler.
+        """
+        manager = ChannelManager(BaseReporter())
+
+        # These used to match the "in 'Bridge'" test and then fail on the
+        # missing LocalOneChannel key.
+        manager.on_event({'Event': 'Bri'})
+        manager.on_event({'Event': 'ridge'})
+
+    def test_on_events(self):
+        """Test on_events handles the interesting events like on_event.
+        """
+        class EventReporter(BaseReporter):
+            def __init__(self):
+                self.seen = []
+
+            def on_event(self, event):
+                self.seen.append(event['Event'])
+
+        reporter = EventReporter()
+        manager = ChannelManager(reporter)
+        manager.on_events([
+            {'Event': 'VarSet'},
+            {'Event': 'Newstate', 'Channel': 'SIP/201-00000001'},
+            {'Event': 'FullyBooted'},
+        ])
+
+        # The missing channel is traced, not raised.
+        self.assertEqual(['Newstate', 'FullyBooted'], reporter.seen)
+
+    def test_on_events_subclass(self):
+        """Test on_events goes through on_event if a subclass overrides it.
+        """
+        class MyChannelManager(ChannelManager):
+            def on_event(self, event):
+                self.seen.append(event['Event'])
+
+        manager = MyChannelManager(BaseReporter())
+        manager.seen = []
+        manager.on_events([{'Event': 'VarSet'}, {'Event': 'FullyBooted'}])
+
+        self.assertEqual(['FullyBooted'], manager.seen)
+
+    def test_reporter_hooks_skipped(self):
+        """Test the per-event reporter hooks are only used if overridden.
+        """
+        class TraceReporter(BaseReporter):
+            def trace_ami(self, event):
+                pass
+
+        manager = ChannelManager(BaseReporter())
+        self.assertIsNone(manager._trace_ami)
+        self.assertIsNone(manager._reporter_on_event)
+
+        reporter = TraceReporter()
+        manager = ChannelManager(reporter)
+        self.assertEqual(reporter.trace_ami, manager._trace_ami)
+        self.assertIsNone(manager._reporter_on_event)
+        self.assertTrue(reporter.overrides('trace_ami'))
+        self.assertFalse(reporter.overrides('on_event'))
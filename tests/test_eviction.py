@@ -0,0 +1,218 @@
+import asyncio
+from unittest import TestCase
+
+from cacofonisk import AmiClient, AmiRunner, BaseReporter
+from cacofonisk.channel import ChannelManager, ChannelRegistry, MissingChannel
+
+from .test_channel import new_channel
+
+
+class EvictionReporter(BaseReporter):
+    def __init__(self):
+        self.evicted = []
+
+    def on_channel_evicted(self, uniqueid, name, reason):
+        self.evicted.append((uniqueid, reason))
+
+
+def newchannel_event(index):
+    return {
+        'Event': 'Newchannel',
+        'Channel': 'SIP/201-{:08x}'.format(index),
+        'Uniqueid': 'test-{}.1'.format(index),
+        'ChannelState': '0',
+        'Exten': '202',
+        'AccountCode': '',
+        'CallerIDName': '',
+        'CallerIDNum': '201',
+    }
+
+
+class TestChannelRegistry(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.manager = ChannelManager(BaseReporter())
+
+    def clock(self):
+        return self.now
+
+    def test_no_policy(self):
+        """Test nothing is tracked or evicted by default.
+        """
+        registry = ChannelRegistry()
+        registry.add(new_channel(self.manager, 'SIP/201-00000001', 'test-1.1'))
+
+        self.assertIsNone(registry._last_used)
+        self.assertEqual((None, None), registry.get_stale())
+
+    def test_max_size(self):
+        """Test the least recently used channel is stale above max_size.
+        """
+        registry = ChannelRegistry(max_size=2, clock=self.clock)
+        one = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        two = new_channel(self.manager, 'SIP/202-00000002', 'test-2.1')
+        three = new_channel(self.manager, 'SIP/203-00000003', 'test-3.1')
+
+        registry.add(one)
+        registry.add(two)
+        registry.get_by_name('SIP/201-00000001')
+        registry.add(three)
+
+        self.assertEqual((two, 'max-size'), registry.get_stale())
+        registry.remove(two)
+        self.assertEqual((None, None), registry.get_stale())
+
+    def test_max_age(self):
+        """Test channels which weren't used for max_age seconds are stale.
+        """
+        registry = ChannelRegistry(max_age=60, clock=self.clock)
+        one = new_channel(self.manager, 'SIP/201-00000001', 'test-1.1')
+        two = new_channel(self.manager, 'SIP/202-00000002', 'test-2.1')
+
+        registry.add(one)
+        registry.add(two)
+        self.now = 50
+        registry.get_by_uniqueid('test-1.1')
+        self.now = 61
+
+        self.assertEqual((two, 'max-age'), registry.get_stale())
+        registry.remove(two)
+        self.assertEqual((None, None), registry.get_stale())
+
+    def test_invalid_max_size(self):
+        """Test max_size must leave room for the channel being added.
+        """
+        self.assertRaises(ValueError, ChannelRegistry, max_size=0)
+
+
+class TestEviction(TestCase):
+
+    def test_evict_on_newchannel(self):
+        """Test channels above MAX_CHANNELS are evicted and reported.
+        """
+        class BoundedChannelManager(ChannelManager):
+            MAX_CHANNELS = 2
+
+        reporter = EvictionReporter()
+        manager = BoundedChannelManager(reporter)
+        for i in range(1, 5):
+            manager.on_event(newchannel_event(i))
+
+        self.assertEqual([('test-1.1', 'max-size'), ('test-2.1', 'max-size')], reporter.evicted)
+        self.assertEqual(2, len(manager._registry))
+        self.assertRaises(MissingChannel, manager._registry.get_by_name, 'SIP/201-00000001')
+
+    def test_purge_on_fully_booted(self):
+        """Test FullyBooted only evicts all channels if asked to.
+        """
+        class PurgingChannelManager(ChannelManager):
+            PURGE_ON_FULLY_BOOTED = True
+
+        for manager_class, expected in ((ChannelManager, 2), (PurgingChannelManager, 0)):
+            reporter = EvictionReporter()
+            manager = manager_class(reporter)
+            manager.on_event(newchannel_event(1))
+            manager.on_event(newchannel_event(2))
+            manager.on_event({'Event': 'FullyBooted'})
+
+            self.assertEqual(expected, len(manager._registry))
+            self.assertEqual(2 - expected, len(reporter.evicted))
+
+    def test_evict_unlinks(self):
+        """Test an evicted channel is unlinked from its dials and bridges.
+        """
+        manager = ChannelManager(BaseReporter())
+        a_chan = new_channel(manager, 'SIP/201-00000001', 'test-1.1')
+        b_chan = new_channel(manager, 'SIP/202-00000002', 'test-2.1')
+        c_chan = new_channel(manager, 'SIP/203-00000003', 'test-3.1')
+        a_chan.do_dial(b_chan)
+        a_chan.do_link(b_chan)
+        c_chan.do_dial(a_chan)
+
+        a_chan.do_evict()
+
+        self.assertIsNone(b_chan.back_dial)
+        self.assertEqual([], a_chan.fwd_dials)
+        self.assertEqual([], c_chan.fwd_dials)
+        self.assertFalse(b_chan._bridged)
+        self.assertIs(b_chan, b_chan.get_dialing_channel())
+
+    def test_evict_on_hangup(self):
+        """Test old channels are also evicted when a channel hangs up.
+        """
+        class AgingChannelManager(ChannelManager):
+            MAX_CHANNEL_AGE = 60
+
+        now = [0]
+        reporter = EvictionReporter()
+        manager = AgingChannelManager(reporter)
+        manager._registry._clock = lambda: now[0]
+        manager.on_event(newchannel_event(1))
+        now[0] = 50
+        manager.on_event(newchannel_event(2))
+        now[0] = 70
+        manager.on_event(dict(newchannel_event(2), Event='Hangup', Cause='16'))
+
+        self.assertEqual([('test-1.1', 'max-age')], reporter.evicted)
+        self.assertEqual(0, len(manager._registry))
+
+    def test_evict_stale(self):
+        """Test evict_stale evicts the old channels without any events.
+        """
+        class AgingChannelManager(ChannelManager):
+            MAX_CHANNEL_AGE = 60
+
+        now = [0]
+        reporter = EvictionReporter()
+        manager = AgingChannelManager(reporter)
+        manager._registry._clock = lambda: now[0]
+        manager.on_event(newchannel_event(1))
+        manager.on_event(newchannel_event(2))
+
+        self.assertEqual(0, manager.evict_stale())
+        now[0] = 61
+        self.assertEqual(2, manager.evict_stale())
+        self.assertEqual([('test-1.1', 'max-age'), ('test-2.1', 'max-age')], reporter.evicted)
+
+
+class TestAmiRunnerEviction(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_evict_when_traffic_stops(self):
+        """Test the runner evicts old channels while no events come in.
+        """
+        class AgingChannelManager(ChannelManager):
+            MAX_CHANNEL_AGE = 0.05
+
+        class QuickAmiRunner(AmiRunner):
+            EVICT_INTERVAL = 0.02
+
+        reporter = EvictionReporter()
+        runner = QuickAmiRunner([], reporter, channel_manager=AgingChannelManager, resync=False,
+                                filter_events=False)
+        runner.attach_all()
+        amimgr = AmiClient(loop=self.loop)
+        runner._add_amimgr(amimgr, AgingChannelManager(reporter))
+
+        runner.on_event(amimgr, newchannel_event(1))
+        runner.on_event(amimgr, newchannel_event(2))
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        runner._evict_handle.cancel()
+
+        self.assertEqual([('test-1.1', 'max-age'), ('test-2.1', 'max-age')], reporter.evicted)
+        self.assertEqual(0, len(runner.amimgrs[amimgr]._registry))
+
+    def test_no_eviction_without_max_age(self):
+        """Test the runner doesn't wake up for managers which don't evict.
+        """
+        runner = AmiRunner([], EvictionReporter(), resync=False, filter_events=False)
+        runner.attach_all()
+        self.assertIsNone(runner._evict_handle)
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from cacofonisk import AsyncBaseReporter, BaseReporter, FileRunner, JsonReporter, RecordingReporter
+from cacofonisk.reporters.async_reporter import TaskReporter
+
+
+class EventReporter(BaseReporter):
+    def __init__(self):
+        self.calls = []
+
+    def trace_ami(self, event):
+        self.calls.append(('trace_ami', event['Data']))
+
+    def on_user_event(self, event):
+        self.calls.append(('on_user_event', event['Data']))
+
+    def trace_msg(self, msg):
+        self.calls.append(('trace_msg', msg))
+
+    def close(self):
+        self.calls.append(('close',))
+
+
+class TestParallelFileRunner(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.files = []
+        for i in range(4):
+            path = os.path.join(self.directory.name, 'capture{}.json'.format(i))
+            with open(path, 'w') as f:
+                json.dump([
+                    {'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': '{}-{}'.format(i, j)}
+                    for j in range(3 + i)
+                ], f)
+            self.files.append(path)
+
+    def test_same_calls_in_order(self):
+        """Test the reporter gets the same calls, in order, from a pool.
+        """
+        serial = EventReporter()
+        FileRunner(self.files, serial).run()
+
+        parallel = EventReporter()
+        runner = FileRunner(self.files, parallel, processes=3)
+        runner.run()
+
+        self.assertEqual(serial.calls, parallel.calls)
+        self.assertEqual(('close',), parallel.calls[-1])
+        self.assertEqual([], runner.channel_managers)
+
+    def test_worker_error(self):
+        """Test an error in a worker is raised in the parent.
+        """
+        with open(self.files[2], 'w') as f:
+            f.write('[{"Event": ')
+
+        self.assertRaises(ValueError, FileRunner(self.files, EventReporter(), processes=2).run)
+
+
+class TestRecordingReporter(TestCase):
+
+    def test_for_reporter(self):
+        """Test only the hooks a reporter overrides are recorded.
+        """
+        recorder = RecordingReporter.for_reporter(EventReporter())
+
+        self.assertEqual({'trace_ami', 'trace_msg', 'on_user_event'}, recorder.hooks)
+        self.assertTrue(recorder.wants_trace_msg)
+        self.assertFalse(recorder.overrides('on_event'))
+
+        recorder = RecordingReporter.for_reporter(BaseReporter())
+
+        self.assertEqual(frozenset(), recorder.hooks)
+        self.assertFalse(recorder.wants_trace_msg)
+
+    def test_replay(self):
+        """Test the recorded calls are replayed in order.
+        """
+        recorder = RecordingReporter()
+        recorder.on_user_event({'Data': 'a'})
+        recorder.trace_msg('b')
+        recorder.on_hangup('call', 'caller', '202', 'completed')
+
+        reporter = EventReporter()
+        recorder.replay(reporter)
+
+        self.assertEqual([('on_user_event', 'a'), ('trace_msg', 'b')], reporter.calls[:2])
+        self.assertEqual(3, len(recorder.calls))
+
+
+class TimingReporter(BaseReporter):
+    def __init__(self, loop):
+        self.loop = loop
+        self.times = []
+
+    def on_user_event(self, event):
+        self.times.append((event['Data'], self.loop.time()))
+
+
+class AsyncTimingReporter(AsyncBaseReporter):
+    def __init__(self, loop):
+        self.loop = loop
+        self.times = []
+        self.closed = False
+
+    async def on_user_event(self, event):
+        await asyncio.sleep(0.01)
+        self.times.append((event['Data'], self.loop.time()))
+
+    def close(self):
+        self.closed = True
+
+
+class TestPacedReplay(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'capture.json')
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        # Record a burst of three events, a pause of 2 seconds and one
+        # more event.
+        clock = iter([1000.0, 1000.0, 1000.001, 1002.0])
+        reporter = JsonReporter(self.path, timestamps=True, clock=lambda: next(clock))
+        for i in range(4):
+            reporter.trace_ami({'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': str(i)})
+        reporter.close()
+
+    def test_timestamps(self):
+        """Test the JsonReporter writes the time the events are received, if asked.
+        """
+        with open(self.path) as f:
+            events = json.load(f)
+
+        self.assertEqual([1000.0, 1000.0, 1000.001, 1002.0], [event['Received'] for event in events])
+
+        path = os.path.join(self.directory.name, 'untimed.json')
+        reporter = JsonReporter(path)
+        reporter.trace_ami({'Event': 'FullyBooted'})
+        reporter.close()
+
+        with open(path) as f:
+            self.assertEqual([{'Event': 'FullyBooted'}], json.load(f))
+
+        path = os.path.join(self.directory.name, 'retimed.json')
+        reporter = JsonReporter(path, timestamps=True, clock=lambda: 2000.0)
+        reporter.trace_ami({'Event': 'FullyBooted', 'Received': 1000.0})
+        reporter.trace_ami({'Event': 'FullyBooted'})
+        reporter.close()
+
+        with open(path) as f:
+            self.assertEqual([1000.0, 2000.0], [event['Received'] for event in json.load(f)])
+
+    def test_speed(self):
+        """Test the events are replayed at their pace, sped up.
+        """
+        reporter = TimingReporter(self.loop)
+        runner = FileRunner(self.path, reporter, speed=20, loop=self.loop)
+        runner.run()
+
+        data = [item for item, time in reporter.times]
+        times = [time - reporter.times[0][1] for item, time in reporter.times]
+
+        self.assertEqual(['0', '1', '2', '3'], data)
+        self.assertLess(times[2], 0.05)
+        self.assertGreaterEqual(times[3], 0.1)
+        self.assertLess(times[3], 0.5)
+        self.assertLess(runner.max_lag, 0.5)
+
+    def test_async_reporter(self):
+        """Test the coroutine hooks of an AsyncBaseReporter run during a paced replay.
+        """
+        reporter = AsyncTimingReporter(self.loop)
+        runner = FileRunner(self.path, reporter, speed=20, loop=self.loop)
+        runner.run()
+
+        self.assertIsInstance(runner.reporter, TaskReporter)
+        self.assertEqual(['0', '1', '2', '3'], [item for item, time in reporter.times])
+        self.assertTrue(reporter.closed)
+
+        # Without a loop, nothing would run the coroutines.
+        self.assertRaises(ValueError, FileRunner, self.path, AsyncTimingReporter(self.loop))
+
+    def test_untimed(self):
+        """Test events without a time are replayed right away.
+        """
+        with open(self.path, 'w') as f:
+            json.dump([{'Event': 'UserEvent', 'UserEvent': 'Test', 'Data': str(i)} for i in range(3)], f)
+
+        reporter = TimingReporter(self.loop)
+        FileRunner(self.path, reporter, speed=1, loop=self.loop).run()
+
+        self.assertEqual(3, len(reporter.times))
+        self.assertLess(reporter.times[-1][1] - reporter.times[0][1], 0.1)
+
+    def test_cancel(self):
+        """Test cancelling the replay stops it right away.
+        """
+        reporter = TimingReporter(self.loop)
+        future = FileRunner(self.path, reporter, speed=1, loop=self.loop).replay_paced()
+
+        self.loop.call_later(0.05, future.cancel)
+        self.assertRaises(asyncio.CancelledError, self.loop.run_until_complete, future)
+
+        self.assertEqual(['0', '1', '2'], [item for item, time in reporter.times])
+
+    def test_invalid_speed(self):
+        """Test the speed must be positive and replayed in process.
+        """
+        self.assertRaises(ValueError, FileRunner, self.path, BaseReporter(), speed=0)
+        self.assertRaises(ValueError, FileRunner, self.path, BaseReporter(), speed=10, processes=2)
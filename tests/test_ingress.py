@@ -0,0 +1,291 @@
+import asyncio
+import tempfile
+from unittest import TestCase
+
+from cacofonisk import AmiClient, AmiRunner, ChannelManager
+from cacofonisk.runners.ingress import IngressQueue
+from cacofonisk.utils.fakeami import FakeAmiServer
+
+from .test_partition import CallReporter, call_events, interleave
+
+
+class TestIngressQueue(TestCase):
+
+    def test_block(self):
+        """Test a full queue keeps every item and counts the overflow.
+        """
+        queue = IngressQueue(2)
+        for number in range(5):
+            self.assertTrue(queue.put((0, {'Event': 'Newchannel', 'Number': number})))
+            self.assertEqual(number >= 1, queue.full)
+
+        self.assertEqual([number for number in range(5)], [queue.get()[1]['Number'] for _ in range(5)])
+        self.assertRaises(IndexError, queue.get)
+        self.assertEqual({
+            'size': 0,
+            'maxsize': 2,
+            'max_spill': 1000000,
+            'policy': 'block',
+            'high_water': 5,
+            'dropped': 0,
+            'spilled': 0,
+            'overflowed': 3,
+        }, queue.stats())
+
+    def test_drop(self):
+        """Test a full queue drops droppable items only.
+        """
+        queue = IngressQueue(2, 'drop')
+        self.assertTrue(queue.put((0, 'one'), droppable=True))
+        self.assertTrue(queue.put((0, 'two')))
+        self.assertFalse(queue.put((0, 'three'), droppable=True))
+        self.assertTrue(queue.put((0, 'four')))
+
+        self.assertEqual(['one', 'two', 'four'], [queue.get()[1] for _ in range(3)])
+        self.assertEqual(1, queue.dropped)
+        self.assertEqual(3, queue.high_water)
+
+    def test_spill(self):
+        """Test items beyond the limit go to disk and come back in order.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            queue = IngressQueue(3, 'spill', spill_dir=directory)
+            for number in range(10):
+                queue.put((number % 2, {'Event': 'Newchannel', 'Number': number}))
+            self.assertEqual(10, len(queue))
+            self.assertEqual(7, queue.spilled)
+
+            got = [queue.get() for _ in range(4)]
+            # New items are spilled until the spilled items are read.
+            queue.put((0, {'Event': 'Hangup', 'Number': 10}))
+            got += [queue.get() for _ in range(len(queue))]
+            queue.close()
+
+        self.assertEqual(list(range(11)), [event['Number'] for index, event in got])
+        self.assertEqual([number % 2 for number in range(10)], [index for index, event in got[:10]])
+        self.assertEqual(10, queue.high_water)
+        self.assertEqual(0, len(queue))
+
+    def test_spill_bound(self):
+        """Test the queue is overflowing once max_spill items are spilled.
+        """
+        queue = IngressQueue(2, 'spill', max_spill=3)
+        self.addCleanup(queue.close)
+        for number in range(7):
+            queue.put((0, number))
+            self.assertEqual(number >= 4, queue.overflowing)
+
+        self.assertEqual(5, queue.spilled)
+        self.assertEqual(2, queue.overflowed)
+        self.assertEqual([0, 1, 2, 3, 4], [queue.get()[1] for _ in range(5)])
+        self.assertFalse(queue.overflowing)
+        self.assertEqual([5, 6], [queue.get()[1] for _ in range(2)])
+
+    def test_invalid(self):
+        """Test the size and policy are checked.
+        """
+        self.assertRaises(ValueError, IngressQueue, 0)
+        self.assertRaises(ValueError, IngressQueue, 10, 'overwrite')
+        self.assertRaises(ValueError, IngressQueue, 10, 'spill', max_spill=0)
+
+
+class SlowChannelManager(ChannelManager):
+    """
+    A manager which also listens to a trace-only event, and records the
+    events it handles.
+    """
+    INTERESTING_EVENTS = ChannelManager.INTERESTING_EVENTS | {'VarSet'}
+
+    def on_event(self, event):
+        self._reporter.calls.append(('event', event['Event']))
+        super().on_event(event)
+
+
+class TestAmiRunnerQueue(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.server = FakeAmiServer(login_events=(), loop=self.loop)
+        self.server.start()
+        self.reporter = CallReporter()
+
+    def tearDown(self):
+        for amimgr in getattr(self.runner, 'amimgrs', ()):
+            amimgr.close()
+        self.runner.queue.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_events(self, events, **kwargs):
+        self.runner = AmiRunner([{
+            'host': '127.0.0.1',
+            'port': self.server.port,
+            'username': 'cacofonisk',
+            'password': 'secret',
+        }], self.reporter, channel_manager=SlowChannelManager, resync=False, manager_class=AmiClient, **kwargs)
+        self.runner.attach_all()
+
+        amimgr = next(iter(self.runner.amimgrs))
+        for _ in range(500):
+            if amimgr.authenticated:
+                break
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+        for event in events:
+            self.server.send_event(event)
+
+        # Hangups are never dropped, so wait for the last one.
+        hangups = sum(1 for event in events if event['Event'] == 'Hangup')
+        for _ in range(500):
+            if not self.runner._draining and self.reporter.calls.count(('event', 'Hangup')) == hangups:
+                break
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def assert_same_calls(self, overflow):
+        events = interleave(call_events(1, 2), call_events(3, 4), call_events(5, 6))
+        expected = CallReporter()
+        manager = SlowChannelManager(expected)
+        for event in events:
+            manager.on_event(event)
+
+        self.run_events(events, queue_size=4, overflow=overflow)
+
+        self.assertEqual(expected.calls, self.reporter.calls)
+        self.assertGreater(self.runner.queue.high_water, 4)
+
+    def test_block(self):
+        """Test events queued with the block policy give the same calls.
+        """
+        self.assert_same_calls('block')
+
+    def test_drop(self):
+        """Test events queued with the drop policy give the same calls.
+        """
+        self.assert_same_calls('drop')
+
+    def test_spill(self):
+        """Test events queued with the spill policy give the same calls.
+        """
+        self.assert_same_calls('spill')
+
+    def test_drop_trace_only(self):
+        """Test the drop policy only drops the events which aren't handled.
+        """
+        events = interleave(call_events(1, 2))
+        events = [event for event in events for event in (event, {'Event': 'VarSet', 'Variable': 'X'})]
+
+        self.run_events(events, queue_size=2, overflow='drop')
+
+        self.assertGreater(self.runner.queue.dropped, 0)
+        handled = [call[1] for call in self.reporter.calls if call[0] == 'event']
+        self.assertEqual([event['Event'] for event in events if event['Event'] != 'VarSet'],
+                         [name for name in handled if name != 'VarSet'])
+        self.assertIn(('on_hangup', 'test-1.1', 'completed'), self.reporter.calls)
+
+    def start_paused_runner(self, channel_manager, **kwargs):
+        paused = []
+
+        class Transport(object):
+            def pause_reading(self):
+                paused.append(True)
+
+            def resume_reading(self):
+                paused.append(False)
+
+            def close(self):
+                pass
+
+        self.runner = AmiRunner([], self.reporter, channel_manager=channel_manager, resync=False,
+                                queue_size=3, filter_events=False, **kwargs)
+        amimgr = AmiClient(loop=self.loop)
+        amimgr.protocol = type('Protocol', (object,), {'transport': Transport()})()
+        self.runner.attach_all()
+        self.runner._add_amimgr(amimgr, channel_manager(self.reporter))
+        return amimgr, paused
+
+    def test_block_pauses_reading(self):
+        """Test the block policy stops reading while the queue is full.
+        """
+        amimgr, paused = self.start_paused_runner(SlowChannelManager)
+
+        for event in interleave(call_events(1, 2)):
+            self.runner.on_event(amimgr, event)
+        self.assertEqual([True], paused)
+
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual([True, False], paused)
+        self.assertEqual(0, len(self.runner.queue))
+        self.assertEqual(9, self.runner.queue.high_water)
+
+    def test_drop_pauses_reading(self):
+        """Test the drop policy stops reading when handled events overflow the queue.
+        """
+        # None of the events of a call can be dropped.
+        amimgr, paused = self.start_paused_runner(ChannelManager, overflow='drop')
+
+        for event in interleave(call_events(1, 2)):
+            self.runner.on_event(amimgr, event)
+        self.assertEqual([True], paused)
+        self.assertEqual(0, self.runner.queue.dropped)
+
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual([True, False], paused)
+        self.assertEqual(0, len(self.runner.queue))
+        self.assertIn(('on_hangup', 'test-1.1', 'completed'), self.reporter.calls)
+
+    def test_drop_default_manager(self):
+        """Test the drop policy sheds the droppable events of the default manager.
+        """
+        amimgr, paused = self.start_paused_runner(ChannelManager, overflow='drop')
+
+        events = interleave(call_events(1, 2))
+        for event in events[:3]:
+            self.runner.on_event(amimgr, event)
+        for name in ('UserEvent', 'NewCallerid', 'NewAccountCode'):
+            self.runner.on_event(amimgr, {'Event': name, 'Channel': 'SIP/201-00000001', 'UserEvent': 'Test'})
+        self.assertEqual([], paused)
+        self.assertEqual(3, self.runner.queue.dropped)
+
+        for event in events[3:]:
+            self.runner.on_event(amimgr, event)
+        self.assertEqual([True], paused)
+
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual([True, False], paused)
+        self.assertIn(('on_hangup', 'test-1.1', 'completed'), self.reporter.calls)
+
+    def test_spill_pauses_reading(self):
+        """Test the spill policy stops reading once max_spill events are spilled.
+        """
+        amimgr, paused = self.start_paused_runner(SlowChannelManager, overflow='spill', max_spill=2)
+
+        events = interleave(call_events(1, 2))
+        for event in events[:5]:
+            self.runner.on_event(amimgr, event)
+        self.assertEqual([True], paused)
+        self.assertEqual(2, self.runner.queue.spilled)
+
+        for event in events[5:]:
+            self.runner.on_event(amimgr, event)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual([True, False], paused)
+        self.assertEqual(0, len(self.runner.queue))
+        self.assertIn(('on_hangup', 'test-1.1', 'completed'), self.reporter.calls)
+
+    def test_drop_keeps_reading(self):
+        """Test the drop policy keeps reading while it can drop events.
+        """
+        amimgr, paused = self.start_paused_runner(SlowChannelManager, overflow='drop')
+
+        events = interleave(call_events(1, 2))
+        for event in events[:3] + [{'Event': 'VarSet', 'Variable': 'X'}] * 5:
+            self.runner.on_event(amimgr, event)
+        self.assertEqual([], paused)
+        self.assertEqual(5, self.runner.queue.dropped)
+
+        self.runner.on_event(amimgr, events[3])
+        self.assertEqual([True], paused)
@@ -0,0 +1,147 @@
+from unittest import TestCase
+
+from cacofonisk.channel import ChannelManager, InternTable
+
+from .test_partition import CallReporter, call_events, interleave
+
+
+class InterningChannelManager(ChannelManager):
+    INTERN_STRINGS = True
+
+
+class TestInternTable(TestCase):
+
+    def test_intern(self):
+        """Test equal strings are replaced by the first one.
+        """
+        table = InternTable()
+        first = 'SIP/201-00000001'
+        second = ''.join(['SIP/201-', '00000001'])
+        self.assertIsNot(first, second)
+
+        self.assertIs(first, table.intern(first))
+        self.assertIs(first, table.intern(second))
+        self.assertEqual(1, len(table))
+
+    def test_release(self):
+        """Test a released string is forgotten.
+        """
+        table = InternTable()
+        first = table.intern('SIP/201-00000001')
+        table.release(''.join(['SIP/201-', '00000001']))
+        table.release('SIP/202-00000002')
+
+        self.assertEqual(0, len(table))
+        second = ''.join(['SIP/201-', '00000001'])
+        self.assertIs(second, table.intern(second))
+        self.assertIsNot(first, table.intern(second))
+
+    def test_max_size(self):
+        """Test new strings are passed through when the table is full.
+        """
+        table = InternTable(max_size=1)
+        table.intern('test-1.1')
+        second = ''.join(['test-', '2.1'])
+
+        self.assertIs(second, table.intern(second))
+        self.assertIsNot(second, table.intern(''.join(['test-', '2.1'])))
+        self.assertEqual(1, len(table))
+        self.assertRaises(ValueError, InternTable, max_size=0)
+
+    def test_intern_event(self):
+        """Test an event gets the interned strings, but adds none.
+        """
+        table = InternTable()
+        name = table.intern('SIP/201-00000001')
+        event = {
+            'Event': 'Newstate',
+            'Channel': ''.join(['SIP/201-', '00000001']),
+            'Uniqueid': 'test-1.1',
+            'ConnectedLineNum': 'SIP/201-00000001',
+        }
+        uniqueid = event['Uniqueid']
+        connected = event['ConnectedLineNum']
+        table.intern_event(event)
+
+        self.assertIs(name, event['Channel'])
+        self.assertIs(uniqueid, event['Uniqueid'])
+        self.assertIs(connected, event['ConnectedLineNum'])
+        self.assertEqual(1, len(table))
+
+
+class TestChannelManagerInterning(TestCase):
+
+    def test_off_by_default(self):
+        """Test nothing is interned by default.
+        """
+        manager = ChannelManager(CallReporter())
+        self.assertIsNone(manager._interned)
+        self.assertIsNone(manager._registry._interned)
+
+    def test_events_share_names(self):
+        """Test the events and the channels share the names and uniqueids.
+        """
+        manager = InterningChannelManager(CallReporter())
+        events = [event for step in call_events(1, 2)[:5] for event in step]
+        manager.on_events(events)
+
+        caller = manager._registry.get_by_uniqueid('test-1.1')
+        callee = manager._registry.get_by_uniqueid('test-2.1')
+        self.assertIs(caller.name, events[0]['Channel'])
+        self.assertIs(caller.name, events[2]['Channel'])
+        self.assertIs(callee.name, events[2]['DestChannel'])
+        self.assertIs(callee.uniqueid, events[2]['DestUniqueID'])
+        self.assertIs(callee.name, events[3]['Channel'])
+        self.assertEqual(4, len(manager._interned))
+
+    def test_unknown_channels(self):
+        """Test the events of unknown channels don't fill the table.
+        """
+        manager = InterningChannelManager(CallReporter())
+        manager.on_events(call_events(1, 2)[0])
+        for i in range(100):
+            manager.on_event({
+                'Event': 'Hangup',
+                'Channel': 'SIP/300-{:08x}'.format(i),
+                'Uniqueid': 'unknown-{}.1'.format(i),
+                'Cause': '16',
+            })
+        manager.on_event({
+            'Event': 'Transfer',
+            'Channel': 'SIP/201-00000001',
+            'TargetChannel': 'SIP/301-00000301',
+            'TargetUniqueid': 'unknown-301.1',
+            'TransferType': 'Blind',
+            'TransferExten': '301',
+        })
+
+        self.assertEqual(2, len(manager._interned))
+
+    def test_released_on_hangup(self):
+        """Test the strings of the channels are released when they hang up.
+        """
+        reporter = CallReporter()
+        manager = InterningChannelManager(reporter)
+        for event in interleave(call_events(1, 2), call_events(3, 4)):
+            manager.on_event(event)
+
+        self.assertIn(('on_hangup', 'test-1.1', 'completed'), reporter.calls)
+        self.assertIn(('on_hangup', 'test-3.1', 'completed'), reporter.calls)
+        self.assertEqual(0, len(manager._registry))
+        self.assertEqual(0, len(manager._interned))
+
+    def test_rename(self):
+        """Test the old name is released on a rename.
+        """
+        manager = InterningChannelManager(CallReporter())
+        manager.on_events(call_events(1, 2)[0])
+        manager.on_event({
+            'Event': 'Rename',
+            'Channel': 'SIP/201-00000001',
+            'Uniqueid': 'test-1.1',
+            'Newname': 'SIP/201-00000001<ZOMBIE>',
+        })
+
+        channel = manager._registry.get_by_uniqueid('test-1.1')
+        self.assertIs(channel.name, manager._interned.intern('SIP/201-00000001<ZOMBIE>'))
+        self.assertEqual(2, len(manager._interned))
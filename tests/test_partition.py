@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from cacofonisk import BaseReporter, FileRunner, PartitionedFileRunner
+from cacofonisk.channel import ChannelManager
+from cacofonisk.runners.partition import PartitionMismatch, partition_events
+
+
+def channel_event(event, index, **kwargs):
+    event = {
+        'Event': event,
+        'Channel': 'SIP/{}-{:08x}'.format(200 + index, index),
+        'Uniqueid': 'test-{}.1'.format(index),
+    }
+    event.update(kwargs)
+    return event
+
+
+def call_events(caller, callee):
+    """
+    The events of an answered call, one list per step, so calls can be
+    interleaved.
+    """
+    return [
+        [channel_event('Newchannel', caller, ChannelState='4', Exten=str(200 + callee), AccountCode='',
+                       CallerIDName='', CallerIDNum=str(200 + caller))],
+        [channel_event('Newchannel', callee, ChannelState='0', Exten=str(200 + callee), AccountCode='',
+                       CallerIDName='', CallerIDNum=str(200 + callee))],
+        [{
+            'Event': 'DialBegin',
+            'Channel': 'SIP/{}-{:08x}'.format(200 + caller, caller),
+            'UniqueID': 'test-{}.1'.format(caller),
+            'DestChannel': 'SIP/{}-{:08x}'.format(200 + callee, callee),
+            'DestUniqueID': 'test-{}.1'.format(callee),
+        }],
+        [channel_event('Newstate', callee, ChannelState='5')],
+        [channel_event('Newstate', callee, ChannelState='6'), channel_event('Newstate', caller, ChannelState='6')],
+        [channel_event('Hangup', callee, Cause='16')],
+        [channel_event('Hangup', caller, Cause='16')],
+    ]
+
+
+def interleave(*calls):
+    events = [{'Event': 'FullyBooted', 'Status': 'Fully Booted'}]
+    for steps in zip(*calls):
+        for step in steps:
+            events.extend(step)
+    return events
+
+
+class CallReporter(BaseReporter):
+    def __init__(self):
+        self.calls = []
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        self.calls.append(('on_b_dial', call_id, to_number))
+
+    def on_up(self, call_id, caller, to_number, callee):
+        self.calls.append(('on_up', call_id, to_number))
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        self.calls.append(('on_hangup', call_id, reason))
+
+    def trace_msg(self, msg):
+        self.calls.append(('trace_msg', msg))
+
+
+class TestPartitionEvents(TestCase):
+
+    def test_calls(self):
+        """Test the events of a call stay together and calls are spread.
+        """
+        events = interleave(call_events(1, 2), call_events(3, 4))
+        assignment = partition_events(events, 2)
+
+        self.assertEqual(len(events), len(assignment))
+        self.assertEqual(0, assignment[0])
+
+        one = {assignment[i] for i, event in enumerate(events) if event.get('Uniqueid') in ('test-1.1', 'test-2.1')}
+        two = {assignment[i] for i, event in enumerate(events) if event.get('Uniqueid') in ('test-3.1', 'test-4.1')}
+        self.assertEqual(1, len(one))
+        self.assertEqual(1, len(two))
+        self.assertNotEqual(one, two)
+
+    def test_joined_calls(self):
+        """Test calls which are joined by an event end up together.
+        """
+        events = interleave(call_events(1, 2), call_events(3, 4))
+        events.append({
+            'Event': 'Transfer',
+            'TargetChannel': 'SIP/202-00000002',
+            'TargetUniqueid': 'test-2.1',
+            'Channel': 'SIP/203-00000003',
+            'Uniqueid': 'test-3.1',
+        })
+
+        self.assertEqual({0}, set(partition_events(events, 2)))
+
+
+class TestPartitionedFileRunner(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'capture.ndjson')
+
+        events = interleave(call_events(1, 2), call_events(3, 4), call_events(5, 6))
+        events += interleave(call_events(7, 8))
+        with open(self.path, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+
+        self.expected = CallReporter()
+        FileRunner(self.path, self.expected).run()
+
+    def test_same_calls(self):
+        """Test the reporter gets the same calls as from a FileRunner.
+        """
+        self.assertIn(('trace_msg', '(no channels left)'), self.expected.calls)
+        self.assertEqual(12, sum(1 for call in self.expected.calls if call[0] != 'trace_msg'))
+
+        for use_mmap in (False, True):
+            for processes in (1, 2, 3):
+                reporter = CallReporter()
+                PartitionedFileRunner(self.path, reporter, use_mmap=use_mmap, processes=processes).run()
+                self.assertEqual(self.expected.calls, reporter.calls)
+
+    def test_verify(self):
+        """Test verify compares the partitioned and sequential replay.
+        """
+        for use_mmap in (False, True):
+            reporter = CallReporter()
+            PartitionedFileRunner(self.path, reporter, use_mmap=use_mmap, processes=2, verify=True).run()
+            self.assertEqual(self.expected.calls, reporter.calls)
+
+    def test_mismatch(self):
+        """Test a manager which depends on other calls fails to verify.
+        """
+        runner = PartitionedFileRunner(self.path, CallReporter(), CountingChannelManager, processes=2, verify=True)
+
+        self.assertRaises(PartitionMismatch, runner.run)
+
+    def test_eviction(self):
+        """Test managers which evict channels are refused.
+        """
+        self.assertRaises(ValueError, PartitionedFileRunner, self.path, CallReporter(), EvictingChannelManager)
+
+
+class CountingChannelManager(ChannelManager):
+    """
+    A manager which numbers the channels across all calls.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.channel_count = 0
+
+    def _on_newchannel(self, event):
+        super()._on_newchannel(event)
+        self.channel_count += 1
+        self._trace('channel {}', self.channel_count)
+
+
+class EvictingChannelManager(ChannelManager):
+    MAX_CHANNELS = 100
@@ -0,0 +1,265 @@
+import asyncio
+from unittest import TestCase
+
+from panoramisk import Manager
+
+from cacofonisk import AmiClient, AmiRunner, ChannelManager
+from cacofonisk.runners.ami_runner import RunnerManagerMixin, runner_manager_class
+from cacofonisk.utils.fakeami import FakeAmiServer
+
+from .test_partition import CallReporter, call_events
+
+
+CORE_SHOW_CHANNELS = [
+    {'Response': 'Success', 'EventList': 'start', 'Message': 'Channels will follow'},
+    {'Event': 'CoreShowChannelsComplete', 'EventList': 'Complete', 'ListItems': '0'},
+]
+
+
+class LostCallReporter(CallReporter):
+    def on_channel_evicted(self, uniqueid, name, reason):
+        self.calls.append(('on_channel_evicted', uniqueid, reason))
+
+
+def steps(events, count):
+    return [event for step in events[:count] for event in step]
+
+
+class TestInvalidate(TestCase):
+
+    def setUp(self):
+        self.reporter = LostCallReporter()
+        self.manager = ChannelManager(self.reporter)
+        # An answered call and a call which is still ringing.
+        for event in steps(call_events(1, 2), 5) + steps(call_events(3, 4), 4):
+            self.manager.on_event(event)
+        del self.reporter.calls[:]
+
+    def test_invalidate(self):
+        """Test all channels are evicted, without reporting hangups.
+        """
+        self.assertEqual(4, self.manager.invalidate())
+
+        self.assertEqual(0, len(self.manager._registry))
+        self.assertEqual(
+            ['test-1.1', 'test-2.1', 'test-3.1', 'test-4.1'],
+            sorted(call[1] for call in self.reporter.calls if call[0] == 'on_channel_evicted'))
+        reasons = {call[2] for call in self.reporter.calls if call[0] == 'on_channel_evicted'}
+        self.assertEqual({'disconnected'}, reasons)
+        self.assertNotIn('on_hangup', [call[0] for call in self.reporter.calls])
+
+    def test_report_hangups(self):
+        """Test the calls in progress are reported as lost, once per call.
+        """
+        self.manager.invalidate(report_hangups=True)
+
+        self.assertEqual(
+            [('on_hangup', 'test-1.1', 'lost'), ('on_hangup', 'test-3.1', 'lost')],
+            sorted(call for call in self.reporter.calls if call[0] == 'on_hangup'))
+        self.assertEqual(0, len(self.manager._registry))
+
+    def test_calls_after_invalidate(self):
+        """Test a new call with the same channels is tracked as usual.
+        """
+        self.manager.invalidate()
+        for event in steps(call_events(1, 2), 7):
+            self.manager.on_event(event)
+
+        self.assertIn(('on_hangup', 'test-1.1', 'completed'), self.reporter.calls)
+        self.assertEqual(0, len(self.manager._registry))
+
+
+class QuickAmiRunner(AmiRunner):
+    RECONNECT_DELAY = 0.01
+    MAX_RECONNECT_DELAY = 0.04
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delays = []
+
+    def reconnect_delay(self, attempts):
+        self.delays.append(attempts)
+        return super().reconnect_delay(attempts)
+
+
+class TestAmiRunnerReconnect(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.server = FakeAmiServer(responses={'CoreShowChannels': CORE_SHOW_CHANNELS}, loop=self.loop)
+        self.server.start()
+        self.reporter = LostCallReporter()
+        self.runner = None
+
+    def tearDown(self):
+        if self.runner is not None:
+            self.runner._closing = True
+            for handle in self.runner._reconnects.values():
+                handle.cancel()
+            for amimgr in self.runner.amimgrs:
+                amimgr.close()
+        self.server.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def start_runner(self, manager_class=AmiClient, **kwargs):
+        self.runner = QuickAmiRunner([{
+            'host': '127.0.0.1',
+            'port': self.server.port,
+            'username': 'cacofonisk',
+            'password': 'secret',
+        }], self.reporter, manager_class=manager_class, **kwargs)
+        self.runner.attach_all()
+        return next(iter(self.runner.amimgrs))
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.fail('Timed out')
+
+    def count_actions(self, name):
+        return sum(1 for action in self.server.actions if action.get('Action') == name)
+
+    def assert_invalidate_and_resync(self, manager_class):
+        amimgr = self.start_runner(manager_class, report_lost=True)
+        self.wait_for(lambda: self.count_actions('CoreShowChannels') == 1 and amimgr.authenticated)
+
+        for event in steps(call_events(1, 2), 5):
+            self.server.send_event(event)
+        self.wait_for(lambda: ('on_up', 'test-1.1', '202') in self.reporter.calls)
+
+        self.server.clients[0].transport.close()
+        self.wait_for(lambda: self.count_actions('CoreShowChannels') == 2)
+
+        self.assertIn(('on_hangup', 'test-1.1', 'lost'), self.reporter.calls)
+        self.assertIn(('on_channel_evicted', 'test-2.1', 'disconnected'), self.reporter.calls)
+        self.assertEqual(0, len(self.runner.amimgrs[amimgr]._registry))
+        self.assertEqual(2, self.count_actions('Login'))
+        self.assertEqual(0, self.runner._reconnect_attempts[amimgr])
+
+    def assert_backoff(self, manager_class):
+        amimgr = self.start_runner(manager_class, resync=False)
+        self.wait_for(lambda: amimgr.authenticated)
+
+        port = self.server.port
+        self.server.close()
+        self.wait_for(lambda: len(self.runner.delays) >= 4)
+        self.assertEqual([0, 1, 2, 3], self.runner.delays[:4])
+
+        # Asterisk is back.
+        self.server = FakeAmiServer(loop=self.loop, port=port)
+        self.server.start()
+        self.wait_for(lambda: self.count_actions('Login') and self.runner._reconnect_attempts[amimgr] == 0)
+        self.assertTrue(amimgr.authenticated)
+        self.assertEqual({}, self.runner._reconnects)
+
+    def test_invalidate_and_resync(self):
+        """Test a lost connection forgets the channels, and reconnects.
+        """
+        self.assert_invalidate_and_resync(AmiClient)
+
+    def test_invalidate_and_resync_panoramisk(self):
+        """Test a lost connection of panoramisk's Manager forgets the channels, and reconnects.
+        """
+        self.assert_invalidate_and_resync(Manager)
+
+    def test_backoff(self):
+        """Test a host which is down is retried with growing delays.
+        """
+        self.assert_backoff(AmiClient)
+
+    def test_backoff_panoramisk(self):
+        """Test the failed connects of panoramisk's Manager make the delay grow too.
+        """
+        self.assert_backoff(Manager)
+
+    def test_actions_not_sent_again(self):
+        """Test the actions panoramisk's Manager was waiting for fail, instead of being sent twice.
+        """
+        # The channel list doesn't come.
+        self.server.responses = {'CoreShowChannels': []}
+        amimgr = self.start_runner(Manager)
+        self.wait_for(lambda: self.count_actions('CoreShowChannels') == 1)
+        future = self.runner._resyncs[amimgr][0]
+
+        self.server.clients[0].transport.close()
+        self.wait_for(lambda: self.count_actions('CoreShowChannels') == 2)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+
+        self.assertIsInstance(future.exception(), ConnectionError)
+        self.assertEqual(2, self.count_actions('CoreShowChannels'))
+        self.assertEqual(2, self.count_actions('Filter'))
+        self.assertEqual(0, len(amimgr.awaiting_actions))
+
+    def test_no_reconnect_after_close(self):
+        """Test the runner doesn't reconnect while it is closing.
+        """
+        amimgr = self.start_runner(resync=False)
+        self.wait_for(lambda: amimgr.authenticated)
+
+        self.runner._closing = True
+        self.server.clients[0].transport.close()
+        self.wait_for(lambda: not amimgr.authenticated)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+
+        self.assertEqual({}, self.runner._reconnects)
+        self.assertEqual(1, self.count_actions('Login'))
+
+
+class TestReconnectDelay(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.runner = AmiRunner([], CallReporter(), resync=False, filter_events=False)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_delay(self):
+        """Test the delay doubles up to the maximum, with jitter.
+        """
+        for attempts, low, high in ((0, 0.5, 1), (1, 1, 2), (3, 4, 8), (6, 30, 60), (10000, 30, 60)):
+            delays = [self.runner.reconnect_delay(attempts) for _ in range(20)]
+            self.assertTrue(all(low <= delay <= high for delay in delays), (attempts, delays))
+        self.assertGreater(len(set(self.runner.reconnect_delay(0) for _ in range(20))), 1)
+
+    def test_panoramisk(self):
+        """Test panoramisk's Manager is reconnected by the runner, not by itself.
+        """
+        self.runner.amihosts = [{'host': '127.0.0.1', 'port': 1, 'username': 'cacofonisk', 'password': 'secret'}]
+        self.runner.attach_all()
+        amimgr = next(iter(self.runner.amimgrs))
+        self.assertIsInstance(amimgr, Manager)
+        self.assertIsInstance(amimgr, RunnerManagerMixin)
+
+        # Count the connects panoramisk would schedule itself.
+        connects = []
+        amimgr.reconnect_timeout = 0.01
+        amimgr.connect = lambda: connects.append(1)
+
+        # The connection is refused.
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(1, self.runner._reconnect_attempts[amimgr])
+        self.runner._reconnects.pop(amimgr).cancel()
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual([], connects)
+
+    def test_runner_manager_class(self):
+        """Test the mixin is added to panoramisk's Manager and its subclasses only, once.
+        """
+        class SubManager(Manager):
+            pass
+
+        self.assertIs(AmiClient, runner_manager_class(AmiClient))
+        self.assertIs(runner_manager_class(Manager), runner_manager_class(Manager))
+        self.assertTrue(issubclass(runner_manager_class(SubManager), SubManager))
+        self.assertTrue(issubclass(runner_manager_class(SubManager), RunnerManagerMixin))
+        manager_class = runner_manager_class(Manager)
+        self.assertIs(manager_class, runner_manager_class(manager_class))
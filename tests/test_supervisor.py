@@ -0,0 +1,98 @@
+import asyncio
+import os
+import signal
+import time
+from unittest import TestCase
+
+from cacofonisk import AmiClient, AmiRunner
+from cacofonisk.runners.supervisor import Supervisor
+from cacofonisk.utils.fakeami import FakeAmiServer
+
+from .test_partition import CallReporter, call_events, interleave
+
+
+class QuickSupervisor(Supervisor):
+    RESTART_DELAY = 0.05
+
+
+class TestSupervisor(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.servers = [FakeAmiServer(loop=self.loop) for _ in range(3)]
+        for server in self.servers:
+            server.start()
+
+        self.reporter = CallReporter()
+        self.runner = AmiRunner([{
+            'host': '127.0.0.1',
+            'port': server.port,
+            'username': 'cacofonisk',
+            'password': 'secret',
+        } for server in self.servers], self.reporter, resync=False, manager_class=AmiClient, processes=2)
+        self.runner.supervisor = self.supervisor = QuickSupervisor(self.runner, processes=2)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        for server in self.servers:
+            server.close()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'timed out')
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def send_calls(self, first):
+        # Wait until every worker has logged in.
+        self.run_until(lambda: all(
+            server.clients and any(action.get('Action') == 'Login' for action in server.actions)
+            for server in self.servers))
+
+        for number, server in enumerate(self.servers):
+            caller = first + 2 * number
+            for event in interleave(call_events(caller, caller + 1))[1:]:
+                server.send_event(event)
+
+        hangups = ('on_hangup', 'test-{}.1')
+        expected = [(hangups[0], hangups[1].format(first + 2 * number), 'completed')
+                    for number in range(len(self.servers))]
+        self.run_until(lambda: all(call in self.reporter.calls for call in expected))
+
+    def test_hosts_in_workers(self):
+        """Test the hosts are spread over workers and the calls reach the reporter.
+        """
+        self.supervisor.start()
+
+        self.assertEqual([2, 1], [len(worker.amihosts) for worker in self.supervisor.workers])
+        pids = {worker.process.pid for worker in self.supervisor.workers}
+        self.assertEqual(2, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+
+        self.send_calls(1)
+        self.assertEqual(3, sum(1 for call in self.reporter.calls if call[0] == 'on_up'))
+
+    def test_restart(self):
+        """Test a worker which is killed is restarted and connects again.
+        """
+        self.supervisor.start()
+        self.send_calls(1)
+
+        worker = self.supervisor.workers[0]
+        killed = worker.process.pid
+        ports = {amihost['port'] for amihost in worker.amihosts}
+        for server in self.servers:
+            if server.port in ports:
+                server.actions.clear()
+        os.kill(killed, signal.SIGKILL)
+
+        self.run_until(lambda: worker.restarts == 1 and worker.process is not None)
+        self.assertNotEqual(killed, worker.process.pid)
+
+        self.send_calls(11)
+        self.assertEqual(6, sum(1 for call in self.reporter.calls if call[0] == 'on_up'))
@@ -0,0 +1,197 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from cacofonisk import BaseReporter, FileRunner, ThreadedReporter
+
+from .test_partition import CallReporter, call_events, interleave
+
+
+class SlowReporter(BaseReporter):
+    """
+    A reporter which takes a while per hook, and records the thread it
+    was called on.
+    """
+    def __init__(self):
+        self.calls = []
+        self.threads = set()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def _call(self, *call):
+        time.sleep(0.001)
+        with self._lock:
+            self.calls.append(call)
+            self.threads.add(threading.current_thread().name)
+
+    def on_b_dial(self, call_id, caller, to_number, targets):
+        self._call('on_b_dial', call_id)
+
+    def on_up(self, call_id, caller, to_number, callee):
+        self._call('on_up', call_id)
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        if reason == 'fail':
+            raise ValueError(reason)
+        self._call('on_hangup', call_id)
+
+    def close(self):
+        self.closed = True
+
+
+class GatedReporter(BaseReporter):
+    """
+    A reporter whose on_up waits for a gate, and which records the order
+    of the calls.
+    """
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self._lock = threading.Lock()
+
+    def _call(self, *call):
+        with self._lock:
+            self.calls.append(call)
+
+    def on_up(self, call_id, caller, to_number, callee):
+        self.started.set()
+        self.gate.wait(5)
+        self._call('on_up', call_id)
+
+    def on_warm_transfer(self, call_id, merged_id, redirector, caller, destination):
+        self._call('on_warm_transfer', call_id)
+
+    def on_hangup(self, call_id, caller, to_number, reason):
+        self._call('on_hangup', call_id)
+
+
+class TestThreadedReporter(TestCase):
+
+    def test_per_call_order(self):
+        """Test the calls of one call are made in order, on one thread.
+        """
+        slow = SlowReporter()
+        reporter = ThreadedReporter(slow, threads=4, maxsize=2, overflow='block')
+        for call_id in range(20):
+            reporter.on_b_dial(call_id, None, '202', [])
+            reporter.on_up(call_id, None, '202', None)
+            reporter.on_hangup(call_id, None, '202', 'completed')
+        reporter.close()
+
+        self.assertTrue(slow.closed)
+        self.assertEqual(60, len(slow.calls))
+        self.assertEqual(4, len(slow.threads))
+        for call_id in range(20):
+            self.assertEqual(['on_b_dial', 'on_up', 'on_hangup'],
+                             [hook for hook, call in slow.calls if call == call_id])
+
+    def test_errors(self):
+        """Test a failing hook is counted and the other calls are made.
+        """
+        slow = SlowReporter()
+        reporter = ThreadedReporter(slow, threads=2)
+        with self.assertLogs('cacofonisk.reporters.threaded_reporter'):
+            reporter.on_hangup('call-1', None, '202', 'fail')
+            reporter.on_hangup('call-2', None, '202', 'completed')
+            reporter.join()
+
+        self.assertEqual(1, reporter.errors)
+        self.assertEqual([('on_hangup', 'call-2')], slow.calls)
+
+        reporter.close()
+        reporter.close()
+        self.assertRaises(RuntimeError, reporter.on_up, 'call-3', None, '202', None)
+
+    def test_drop(self):
+        """Test calls for a full queue are dropped instead of waiting.
+        """
+        gated = GatedReporter()
+        reporter = ThreadedReporter(gated, threads=1, maxsize=2)
+        self.addCleanup(reporter.close)
+        reporter.on_up('call-1', None, '202', None)
+        self.assertTrue(gated.started.wait(5))
+
+        with self.assertLogs('cacofonisk.reporters.threaded_reporter'):
+            for number in range(2, 6):
+                reporter.on_hangup('call-{}'.format(number), None, '202', 'completed')
+        self.assertEqual(2, reporter.dropped)
+
+        gated.gate.set()
+        reporter.join()
+        self.assertEqual([('on_up', 'call-1'), ('on_hangup', 'call-2'), ('on_hangup', 'call-3')], gated.calls)
+        self.assertRaises(ValueError, ThreadedReporter, gated, overflow='spill')
+
+    def test_transfer_order(self):
+        """Test a transfer waits for its merged call, whose later calls follow it.
+        """
+        gated = GatedReporter()
+        reporter = ThreadedReporter(gated, threads=2)
+        self.addCleanup(reporter.close)
+        # Two calls which hash to different threads.
+        merged_id = 'call-1'
+        call_id = next('call-{}'.format(number) for number in range(2, 100)
+                       if hash('call-{}'.format(number)) % 2 != hash(merged_id) % 2)
+
+        reporter.on_up(merged_id, None, '202', None)
+        self.assertTrue(gated.started.wait(5))
+        reporter.on_warm_transfer(call_id, merged_id, None, None, None)
+        reporter.on_hangup(merged_id, None, '202', 'completed')
+        time.sleep(0.05)
+        gated.gate.set()
+        reporter.join()
+
+        self.assertEqual([
+            ('on_up', merged_id),
+            ('on_warm_transfer', call_id),
+            ('on_hangup', merged_id),
+        ], gated.calls)
+        self.assertEqual({}, reporter._routes)
+
+    def test_flush(self):
+        """Test flush waits for the queued calls and flushes the wrapped reporter.
+        """
+        slow = SlowReporter()
+        slow.flushed = []
+        slow.flush = lambda: slow.flushed.append(len(slow.calls))
+        reporter = ThreadedReporter(slow, threads=2)
+        self.addCleanup(reporter.close)
+        for call_id in range(10):
+            reporter.on_up(call_id, None, '202', None)
+        reporter.flush()
+
+        self.assertEqual([10], slow.flushed)
+
+    def test_hooks(self):
+        """Test only the hooks the reporter overrides are passed on.
+        """
+        reporter = ThreadedReporter(SlowReporter(), threads=1)
+        self.addCleanup(reporter.close)
+
+        self.assertTrue(reporter.overrides('on_up'))
+        self.assertFalse(reporter.overrides('on_event'))
+        self.assertFalse(reporter.wants_trace_msg)
+        self.assertRaises(ValueError, ThreadedReporter, SlowReporter(), threads=0)
+
+    def test_file_runner(self):
+        """Test a replay gives the same calls per call as without threads.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'capture.ndjson')
+            with open(path, 'w') as f:
+                for event in interleave(call_events(1, 2), call_events(3, 4), call_events(5, 6)):
+                    f.write(json.dumps(event) + '\n')
+
+            expected = CallReporter()
+            FileRunner(path, expected).run()
+
+            reporter = CallReporter()
+            FileRunner(path, ThreadedReporter(reporter, threads=3)).run()
+
+        for call_id in ('test-1.1', 'test-3.1', 'test-5.1'):
+            self.assertEqual([call for call in expected.calls if call[1] == call_id],
+                             [call for call in reporter.calls if call[1] == call_id])
+        self.assertEqual(sorted(expected.calls), sorted(reporter.calls))
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from cacofonisk import BaseReporter, DebugReporter
+from cacofonisk.channel import ChannelManager
+
+
+class Unformattable(object):
+    def __format__(self, format_spec):
+        raise AssertionError('Trace message was formatted')
+
+
+class TestTracing(TestCase):
+
+    def test_wants_trace_msg(self):
+        """Test reporters want trace messages only if they handle them.
+        """
+        class QuietDebugReporter(DebugReporter):
+            wants_trace_msg = False
+
+        self.assertFalse(BaseReporter().wants_trace_msg)
+        self.assertTrue(DebugReporter().wants_trace_msg)
+        self.assertFalse(QuietDebugReporter().wants_trace_msg)
+
+    def test_trace_not_formatted(self):
+        """Test trace messages are not formatted if nobody wants them.
+        """
+        manager = ChannelManager(BaseReporter())
+        manager._trace('{} ringing', Unformattable())
+
+    def test_trace_formatted(self):
+        """Test trace messages are formatted for reporters that want them.
+        """
+        class TraceReporter(BaseReporter):
+            def __init__(self):
+                self.messages = []
+
+            def trace_msg(self, msg):
+                self.messages.append(msg)
+
+        reporter = TraceReporter()
+        manager = ChannelManager(reporter)
+        manager._trace('{} ringing: {}', 'call-1', 201)
+        manager.on_event({'Event': 'FullyBooted'})
+
+        self.assertEqual(['call-1 ringing: 201', 'Connected to Asterisk'], reporter.messages)